@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+'''Summary tables of posts for the dashboard, kept up to date by update.py.
+
+    daily_topic_posts   posts and replies per day and topic
+    post_stats          replies per post, and when the first salesman
+                        answered it
+    salesman_activity   replies of each salesman
+
+Updater adds every batch it inserts to them (Aggregates.apply()), in the
+same transaction, so they never need a GROUP BY over the whole of posts.
+This script checks them against posts, or computes them again from it.
+
+$ python aggregates.py [-f 設定文件] (--verify | --rebuild)
+'''
+from collections import Counter
+from db import Database
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import argparse
+import sys
+
+
+TABLES: List[str] = ['daily_topic_posts', 'post_stats', 'salesman_activity']
+
+# the whole of each table computed from posts, for rebuild() and verify()
+FULL: Dict[str, str] = {
+    'daily_topic_posts':
+        'SELECT DATE(p.create_time), COALESCE(t.topic_id, 0), '
+        'SUM(p.position = 0), SUM(p.position > 0) '
+        'FROM posts p LEFT JOIN threads t ON t.post_id = p.post_id '
+        'GROUP BY 1, 2',
+    'post_stats':
+        'SELECT p.post_id, MAX(t.topic_id), '
+        'MIN(IF(p.position = 0, p.create_time, NULL)), '
+        'SUM(p.position > 0), '
+        'SUM(p.position > 0 AND u.insurer_or_salesman = 0), '
+        'MAX(IF(p.position > 0, p.create_time, NULL)), '
+        'MIN(IF(p.position > 0 AND u.insurer_or_salesman = 0, '
+        'p.create_time, NULL)) '
+        'FROM posts p LEFT JOIN users u ON u.id = p.author_id '
+        'LEFT JOIN threads t ON t.post_id = p.post_id '
+        'GROUP BY p.post_id',
+    'salesman_activity':
+        'SELECT p.author_id, COUNT(*), MIN(p.create_time), '
+        'MAX(p.create_time) '
+        'FROM posts p JOIN users u ON u.id = p.author_id '
+        'WHERE p.position > 0 AND u.insurer_or_salesman = 0 '
+        'GROUP BY p.author_id',
+}
+
+COLUMNS: Dict[str, str] = {
+    'daily_topic_posts': 'day, topic_id, posts, replies',
+    'post_stats': 'post_id, topic_id, created, replies, salesman_replies, '
+                  'last_reply, first_salesman_reply',
+    'salesman_activity': 'user_id, replies, first_reply, last_reply',
+}
+
+KEYS: Dict[str, int] = {  # leading columns making the primary key
+    'daily_topic_posts': 2,
+    'post_stats': 1,
+    'salesman_activity': 1,
+}
+
+
+def earliest(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    return b if a is None else a if b is None else min(a, b)
+
+
+def latest(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    return b if a is None else a if b is None else max(a, b)
+
+
+class Aggregates:
+    def __init__(self, database: Database):
+        self.db: Database = database
+
+    def apply(self,
+              posts: List[tuple],
+              users: List[tuple],
+              topics: Dict[int, Optional[int]]):
+        '''Add rows just inserted into posts to the summary tables.
+
+        posts are rows of posts with author_id filled in (see to_rows() in
+        update.py), users[i] the (name, is insurer) of posts[i] and topics
+        the topic_id of each post_id. Rows are upserted in the order of
+        their primary key, so concurrent batches lock them in the same
+        order and do not deadlock one another.
+        '''
+        if not posts:
+            return
+
+        daily: Counter = Counter()
+        stats: Dict[int, list] = {}
+        salesmen: Dict[int, list] = {}
+        for post, (_, insurer) in zip(posts, users):
+            post_id, position, create_time, author_id = post[:4]
+            topic_id: Optional[int] = topics.get(post_id)
+            reply: bool = position > 0
+            salesman: bool = reply and not insurer
+            daily[(create_time[:10], topic_id or 0, reply)] += 1
+
+            s = stats.setdefault(post_id, [topic_id, None, 0, 0, None, None])
+            if not reply:
+                s[1] = create_time
+            s[2] += reply
+            s[3] += salesman
+            if reply:
+                s[4] = latest(s[4], create_time)
+            if salesman:
+                s[5] = earliest(s[5], create_time)
+                a = salesmen.setdefault(author_id, [0, None, None])
+                a[0] += 1
+                a[1] = earliest(a[1], create_time)
+                a[2] = latest(a[2], create_time)
+
+        days: Dict[Tuple[str, int], List[int]] = {}
+        for (day, topic_id, reply), n in daily.items():
+            days.setdefault((day, topic_id), [0, 0])[reply] += n
+
+        self.db.cur.executemany(
+                'INSERT INTO daily_topic_posts (day, topic_id, posts, '
+                'replies) VALUES (?, ?, ?, ?) ON DUPLICATE KEY UPDATE '
+                'posts = posts + VALUES(posts), '
+                'replies = replies + VALUES(replies)',
+                [(day, topic_id, n[0], n[1])
+                 for (day, topic_id), n in sorted(days.items())]
+                )
+        # NULL in VALUES() keeps what is stored, e.g. a batch of new replies
+        # does not know when the post was created
+        self.db.cur.executemany(
+                'INSERT INTO post_stats (post_id, topic_id, created, '
+                'replies, salesman_replies, last_reply, '
+                'first_salesman_reply) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON DUPLICATE KEY UPDATE '
+                'created = COALESCE(created, VALUES(created)), '
+                'replies = replies + VALUES(replies), '
+                'salesman_replies = salesman_replies + '
+                'VALUES(salesman_replies), '
+                'last_reply = IF(last_reply IS NULL '
+                'OR VALUES(last_reply) > last_reply, '
+                'VALUES(last_reply), last_reply), '
+                'first_salesman_reply = IF(first_salesman_reply IS NULL '
+                'OR VALUES(first_salesman_reply) < first_salesman_reply, '
+                'VALUES(first_salesman_reply), first_salesman_reply)',
+                [(post_id, *s) for post_id, s in sorted(stats.items())]
+                )
+        if salesmen:
+            self.db.cur.executemany(
+                    'INSERT INTO salesman_activity (user_id, replies, '
+                    'first_reply, last_reply) VALUES (?, ?, ?, ?) '
+                    'ON DUPLICATE KEY UPDATE '
+                    'replies = replies + VALUES(replies), '
+                    'first_reply = LEAST(first_reply, VALUES(first_reply)), '
+                    'last_reply = GREATEST(last_reply, VALUES(last_reply))',
+                    [(user_id, *a) for user_id, a in sorted(salesmen.items())]
+                    )
+
+    def rebuild(self):
+        '''Compute every summary table again from posts.'''
+        with self.db.transaction():
+            self.db.clear(TABLES)
+            for table in TABLES:
+                self.db.cur.execute(f'INSERT INTO {table} '
+                                    f'({COLUMNS[table]}) {FULL[table]}')
+
+    def verify(self) -> int:
+        '''Compare every summary table with posts, print the differences
+        and return how many rows differ.
+        '''
+        differences: int = 0
+        for table in TABLES:
+            key: int = KEYS[table]
+            self.db.cur.execute(FULL[table])
+            expected: Dict[tuple, tuple] = {
+                    tuple(r[:key]): normalize(r[key:])
+                    for r in self.db.cur.fetchall()
+                    }
+            self.db.cur.execute(f'SELECT {COLUMNS[table]} FROM {table}')
+            stored: Dict[tuple, tuple] = {
+                    tuple(r[:key]): normalize(r[key:])
+                    for r in self.db.cur.fetchall()
+                    }
+
+            wrong: List[tuple] = [k for k in expected.keys() | stored.keys()
+                                  if expected.get(k) != stored.get(k)]
+            differences += len(wrong)
+            print(f'{table}: {len(stored)} 筆，{len(wrong)} 筆不一致')
+            for k in sorted(wrong, key=str)[:5]:
+                print(f'  {k}: 應為 {expected.get(k)}，實為 {stored.get(k)}')
+
+        return differences
+
+
+def normalize(values: tuple) -> tuple:
+    # SUM() comes back as a Decimal, the stored counts as int
+    return tuple(int(v) if isinstance(v, Decimal) else v for v in values)
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='檢查或重建統計資料表')
+    argpsr.add_argument('-f', '--file',
+                        help='使用指定的設定文件',
+                        metavar='文件路徑')
+    action = argpsr.add_mutually_exclusive_group(required=True)
+    action.add_argument('--verify',
+                        help='比對統計資料表與 posts，列出不一致之處',
+                        action='store_true')
+    action.add_argument('--rebuild',
+                        help='由 posts 重新計算所有統計資料表',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    cfg_path: Path = (Path(args.file).resolve() if args.file
+                      else Path(__file__).parent.resolve() / 'config.cfg')
+    aggregates: Aggregates = Aggregates(Database(str(cfg_path)))
+
+    if args.rebuild:
+        aggregates.rebuild()
+        print('統計資料表已重建')
+    elif aggregates.verify():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+from journal import CrawlJournal
+from metrics import METRICS
+from queue import Queue
+from throttle import Throttle, parse_retry_after
+from typing import List, Optional
+
+import aiohttp  # type: ignore
+import asyncio
+import finfo_view
+import time
+
+
+class AsyncCrawler:
+    '''Asyncio counterpart of DataPorter threads.
+
+    All requests go through one aiohttp session, whose connector is the
+    shared keep-alive connection pool. Fetched pages are passed through a
+    bounded queue to a single parser task, which puts the parsed articles
+    into out_queue just like DataPorter does. Parsing and putting into
+    out_queue, which blocks while the database catches up, run on threads
+    so the event loop keeps serving the requests in flight. concurrency is
+    the most requests in flight, throttle decides how many of them are
+    allowed.
+    '''
+    def __init__(self,
+                 indices: List[int],
+                 out_queue: Queue,
+                 concurrency: int = 100,
+                 conn_per_host: int = 0,
+                 journal: Optional[CrawlJournal] = None,
+                 retries: int = 3,
+                 backoff: float = 1,
+                 parse: bool = True,
+                 throttle: Optional[Throttle] = None):
+        self.job_not_done: List[int] = indices
+        self.out_queue: Queue = out_queue
+        self.concurrency: int = concurrency
+        # 0 means no limit other than the pool size (concurrency)
+        self.conn_per_host: int = conn_per_host
+        self.journal: Optional[CrawlJournal] = journal
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.parse: bool = parse  # False to put raw pages in out_queue
+        self.throttle: Throttle = (throttle if throttle is not None
+                                   else Throttle(concurrency, concurrency,
+                                                 adaptive=False))
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.conn_per_host)
+        timeout = aiohttp.ClientTimeout(total=finfo_view.TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout,
+                                         trace_configs=[trace_config()]) \
+                as session:
+            # bounded, so fetchers wait for the parser instead of piling
+            # up pages in memory
+            pages: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+            parser = asyncio.create_task(self._parse(pages))
+            await asyncio.gather(*[self._fetch(session, pages)
+                                   for _ in range(self.concurrency)])
+            await pages.put(None)  # no more pages
+            await parser
+
+    async def _fetch(self,
+                     session: aiohttp.ClientSession,
+                     pages: asyncio.Queue):
+        while True:
+            try:  # emptied by Updater.run() to stop early, too
+                index: int = self.job_not_done.pop()
+            except IndexError:
+                break
+            try:
+                page: str = await self._get(session, index)
+            except finfo_view.NotModified:
+                await self._put(finfo_view.Unchanged(index))
+                continue
+            except Exception as e:  # e.g. undecodable, or a full disk
+                METRICS.count('posts_failed')
+                print(f'AsyncCrawler: 無法擷取文章 {index}（{e!r}）')
+                self.record(CrawlJournal.FAILED, index, repr(e))
+                continue
+
+            await pages.put((index, page))
+
+    async def _get(self, session: aiohttp.ClientSession, index: int) -> str:
+        '''Download a post, retried with exponential backoff. Raises
+        finfo_view.NotModified like finfo_view.get_page().
+        '''
+        url: str = finfo_view.URL_BASE + '/' + str(index)
+        validators = finfo_view.VALIDATORS
+        headers: dict = (validators.headers(index) if validators is not None
+                         else {})
+        for attempt in range(self.retries + 1):
+            await self.throttle.acquire_async()
+            started: float = time.monotonic()
+            overloaded: bool = False
+            retry_after: float = 0
+            try:
+                async with session.get(url, headers=headers) as response:
+                    ttfb: float = time.monotonic()
+                    retry_after = parse_retry_after(
+                            response.headers.get('Retry-After'))
+                    if response.status != 404:  # 404 is a deleted post
+                        response.raise_for_status()
+                    page: str = await response.text()
+                    done: float = time.monotonic()
+                    METRICS.observe('fetch_seconds', done - started)
+                    METRICS.observe('fetch_ttfb_seconds', ttfb - started)
+                    METRICS.observe('fetch_body_seconds', done - ttfb)
+                    if validators is not None and not validators.modified(
+                            index, response.status, response.headers, page):
+                        raise finfo_view.NotModified(index)
+                    if finfo_view.CACHE is not None and response.status == 200:
+                        finfo_view.CACHE.put(index, page)
+                    return page
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                overloaded = is_overload(e)
+                if attempt == self.retries:
+                    raise
+            finally:
+                self.throttle.release(time.monotonic() - started,
+                                      overloaded, retry_after)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        return ''  # not reached
+
+    async def _parse(self, pages: asyncio.Queue):
+        while True:
+            item = await pages.get()
+            if item is None:
+                break
+
+            index, page = item
+            if not self.parse:  # left to ParseStage
+                self.record(CrawlJournal.FETCHED, index)
+                await self._put(item)
+                continue
+
+            article: Optional[dict]
+            try:
+                article = await self._off_loop(finfo_view.parse_page,
+                                               index, page)
+            except Exception as e:  # unexpected markup, keep going
+                METRICS.count('posts_failed')
+                print(f'AsyncCrawler: 無法解析文章 {index}（{e!r}）')
+                self.record(CrawlJournal.FAILED, index, repr(e))
+                continue
+
+            if article is None:
+                print(f'AsyncCrawler: 文章 {index} 不存在或已被刪除')
+                self.record(CrawlJournal.DELETED, index)
+                await self._put(index)
+            else:
+                self.record(CrawlJournal.FETCHED, index)
+                await self._put(article)
+
+    async def _put(self, item):
+        '''Put item into out_queue. While it is full, the parser waits and
+        the fetchers with it, as pages is bounded: the database is the
+        bottleneck then.
+        '''
+        await self._off_loop(self.out_queue.put, item)
+
+    async def _off_loop(self, function, *args):
+        '''function(*args) on a thread, as it blocks or takes the CPU.'''
+        return await asyncio.get_running_loop().run_in_executor(
+                None, function, *args)
+
+    def record(self, state: str, index: int, detail: str = ''):
+        if self.journal is not None:
+            self.journal.record(state, index, detail)
+
+
+def is_overload(e: Exception) -> bool:
+    '''Whether the error means finfo.tw is struggling with our requests.'''
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (asyncio.TimeoutError,
+                          aiohttp.ClientConnectionError))
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    '''Times DNS lookups and new connections, which only aiohttp tells
+    apart from the rest of a request.
+    '''
+    async def dns_start(session, ctx, params):
+        ctx.dns_started = time.monotonic()
+
+    async def dns_end(session, ctx, params):
+        METRICS.observe('fetch_dns_seconds',
+                        time.monotonic() - ctx.dns_started)
+
+    async def connect_start(session, ctx, params):
+        ctx.connect_started = time.monotonic()
+
+    async def connect_end(session, ctx, params):
+        METRICS.observe('fetch_connect_seconds',
+                        time.monotonic() - ctx.connect_started)
+
+    config = aiohttp.TraceConfig()
+    config.on_dns_resolvehost_start.append(dns_start)
+    config.on_dns_resolvehost_end.append(dns_end)
+    config.on_connection_create_start.append(connect_start)
+    config.on_connection_create_end.append(connect_end)
+    return config
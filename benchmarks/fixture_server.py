@@ -0,0 +1,233 @@
+#! /usr/bin/env python3
+'''A local stand-in for finfo.tw, to crawl without touching the real site.
+
+Serves the listing pages /posts?page=N, which discovery.py reads the
+latest post id and the posts active lately from (the --bumped ones, then
+the newest), and every post /posts/<id> up to --posts, made
+from the same markup as the real pages. Which posts are deleted and how
+many replies each has depend only on the id and --seed, so every run sees
+the same site. Set [finfo.tw] url to http://127.0.0.1:<port> to use it.
+
+$ python benchmarks/fixture_server.py --posts 5000 --latency 50 \\
+      --error-rate 0.01 --deleted-rate 0.05 --replies 0-20
+'''
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import List, Optional, Set, Tuple
+
+import argparse
+import random
+import time
+
+
+TOPICS: List[str] = ['投保規劃', '保單健檢', '理賠申請', '保單解約', '保險觀念']
+LISTING_CLASS: str = 'text-decoration-none d-flex justify-content-center row'
+PAGE: int = 20  # posts per listing page
+
+
+class Site:
+    '''What the fixture server serves, see the options of main().'''
+    def __init__(self,
+                 posts: int = 1000,
+                 latency: float = 0,
+                 error_rate: float = 0,
+                 deleted_rate: float = 0,
+                 replies: Tuple[int, int] = (0, 10),
+                 max_inflight: int = 0,
+                 bumped: int = 0,
+                 seed: int = 0):
+        self.posts: int = posts
+        self.latency: float = latency  # seconds, mean
+        self.error_rate: float = error_rate
+        self.deleted_rate: float = deleted_rate
+        self.replies: Tuple[int, int] = replies
+        self.max_inflight: int = max_inflight  # 429 beyond, 0 for no limit
+        # older posts replied to lately, listed first
+        self.bumped: List[int] = random.Random(f'{seed}-bumped').sample(
+                range(1, max(posts - PAGE, 1)),
+                min(bumped, max(posts - PAGE - 1, 0))
+                )
+        self.seed: int = seed
+        self.inflight: int = 0
+        self._lock: Lock = Lock()
+
+    def rng(self, index: int) -> random.Random:
+        return random.Random(f'{self.seed}-{index}')
+
+    def exists(self, index: int) -> bool:
+        return 1 <= index <= self.posts \
+            and self.rng(index).random() >= self.deleted_rate
+
+    def etag(self, index: int) -> str:
+        return f'"{self.seed}-{index}"'
+
+    def listing(self, page: int = 1) -> str:
+        bumped: Set[int] = set(self.bumped)
+        order: List[int] = self.bumped + [i for i
+                                          in range(self.posts, 0, -1)
+                                          if i not in bumped]
+        links: List[str] = [
+                f'<a class="{LISTING_CLASS}" href="/posts/{i}">'
+                f'<div>文章 {i}</div></a>'
+                for i in order[(page - 1) * PAGE:page * PAGE]
+                ]
+        return f'<html><body>{"".join(links)}</body></html>'
+
+    def post(self, index: int) -> str:
+        rng: random.Random = self.rng(index)
+        rng.random()  # the draw of exists()
+        topic: str = TOPICS[rng.randrange(len(TOPICS))]
+        month: int = rng.randrange(1, 13)
+        day: int = rng.randrange(1, 29)
+
+        replies: List[str] = []
+        for floor in range(1, rng.randint(*self.replies) + 1):
+            if rng.random() < 0.7:  # a salesman, linked to a consultation
+                author: str = (f'<span class="font-weight-bold">'
+                               f'業務員{rng.randrange(500)}</span>'
+                               f'<a href="/consultations?id='
+                               f'{rng.randrange(10**6)}">諮詢</a>')
+            else:
+                author = '<span class="font-weight-bold">王*</span>'
+            replies.append(
+                    f'<div class="d-flex justify-content-start mb-24-px">'
+                    f'<div>{author}<div class="t6 text-gray-1">'
+                    f'B{floor}．{month:02d}/{day:02d} '
+                    f'{rng.randrange(24):02d}:{rng.randrange(60):02d}'
+                    f'</div></div></div>\n'
+                    f'<div class="comment-content">'
+                    f'<div>{paragraph(rng)}</div></div>\n'
+                    )
+
+        return (f'<html><head><title>finfo</title></head><body>\n'
+                f'<h1 class="mb-16-px display-2 display-1-sm">'
+                f'{escape(f"保單問題 {index}")}</h1>\n'
+                f'<div class="d-flex justify-content-start mb-24-px">'
+                f'<span class="font-weight-bold">陳*</span>'
+                f'<div class="t6 text-gray-1">{topic}．{month:02d}/'
+                f'{day:02d} 09:30</div></div>\n'
+                f'<div class="post-content"><div>{paragraph(rng)}</div>'
+                f'<div>{paragraph(rng)}</div></div>\n'
+                f'{"".join(replies)}</body></html>')
+
+
+def paragraph(rng: random.Random) -> str:
+    parts: List[str] = ['我想請問這張保單的理賠範圍' * rng.randint(1, 8)]
+    if rng.random() < 0.5:
+        parts.append('<br/>第二段<b>重點</b>說明')
+    if rng.random() < 0.2:
+        parts.append('<a href="https://example.com/a.jpg">'
+                     '<img src="https://example.com/a.jpg"/></a>')
+    if rng.random() < 0.2:
+        parts.append('<a href="https://example.com">參考連結</a>')
+    return ''.join(parts)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real site
+    disable_nagle_algorithm = True
+    site: Site  # set by serve()
+
+    def do_GET(self):
+        site: Site = self.site
+        with site._lock:
+            site.inflight += 1
+            crowded: bool = 0 < site.max_inflight < site.inflight
+        try:
+            self.respond(site, crowded)
+        finally:
+            with site._lock:
+                site.inflight -= 1
+
+    def respond(self, site: Site, crowded: bool):
+        if site.latency:
+            time.sleep(random.uniform(0.5, 1.5) * site.latency)
+        if crowded:
+            return self.send(429, '', {'Retry-After': '1'})
+        if random.random() < site.error_rate:
+            return self.send(503, 'Service Unavailable')
+
+        path, _, query = self.path.partition('?')
+        path = path.rstrip('/')
+        if path == '/posts':
+            page: str = query.partition('page=')[2].split('&')[0]
+            return self.send(200, site.listing(int(page)
+                                               if page.isdigit() else 1))
+
+        index: Optional[int] = None
+        if path.startswith('/posts/') and path[7:].isdigit():
+            index = int(path[7:])
+        if index is None or not site.exists(index):
+            return self.send(404, '<html><body>找不到頁面</body></html>')
+
+        etag: str = site.etag(index)
+        if self.headers.get('If-None-Match') == etag:
+            return self.send(304, '', {'ETag': etag})
+        self.send(200, site.post(index), {'ETag': etag})
+
+    def send(self, status: int, body: str, headers: Optional[dict] = None):
+        data: bytes = body.encode('utf8')
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if status != 304:
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(site: Site, host: str = '127.0.0.1', port: int = 8765):
+    Handler.site = site
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    print(f'http://{host}:{server.server_port}/posts '
+          f'（共 {site.posts} 篇文章）', flush=True)
+    server.serve_forever()
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='模擬 finfo.tw 的本地伺服器')
+    argpsr.add_argument('--port', type=int, default=8765)
+    argpsr.add_argument('--posts', help='最新文章編號（預設：1000）',
+                        type=int, default=1000)
+    argpsr.add_argument('--latency', help='平均回應時間，毫秒（預設：0）',
+                        type=float, default=0)
+    argpsr.add_argument('--error-rate', help='回應 503 的比例（預設：0）',
+                        type=float, default=0)
+    argpsr.add_argument('--deleted-rate', help='已刪除文章的比例（預設：0）',
+                        type=float, default=0)
+    argpsr.add_argument('--replies', help='每篇文章的回應數範圍（預設：0-10）',
+                        metavar='MIN-MAX', default='0-10')
+    argpsr.add_argument('--max-inflight',
+                        help='同時超過 N 個請求即回應 429（預設：不限）',
+                        metavar='N', type=int, default=0)
+    argpsr.add_argument('--bumped',
+                        help='列表最前面、最近有新回應的舊文章數（預設：0）',
+                        metavar='N', type=int, default=0)
+    argpsr.add_argument('--seed', type=int, default=0)
+    args = argpsr.parse_args()
+
+    low, _, high = args.replies.partition('-')
+    site: Site = Site(posts=args.posts,
+                      latency=args.latency / 1000,
+                      error_rate=args.error_rate,
+                      deleted_rate=args.deleted_rate,
+                      replies=(int(low), int(high or low)),
+                      max_inflight=args.max_inflight,
+                      bumped=args.bumped,
+                      seed=args.seed)
+    try:
+        serve(site, port=args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
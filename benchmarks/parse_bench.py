@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+'''Check that every extractor gives the same articles, and time them.
+
+The corpus is a directory of raw post pages named <post id>.html. With
+--golden, the output of the bs4 extractor is stored next to each page as
+<post id>.json the first time, and every extractor is compared against it
+afterwards, so a parser change that alters the output shows up.
+
+$ python benchmarks/parse_bench.py corpus/ --save 1000-1100  # download
+$ python benchmarks/parse_bench.py corpus/ --golden
+'''
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import finfo_view  # noqa: E402
+
+
+def save(corpus: Path, first: int, last: int):
+    corpus.mkdir(parents=True, exist_ok=True)
+    session = finfo_view.requests.Session()
+    for index in range(first, last + 1):
+        page: str = finfo_view.get_page(index, session)
+        (corpus / f'{index}.html').write_text(page, encoding='utf8')
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='網頁解析正確性與效能測試')
+    argpsr.add_argument('corpus', help='存放 <文章編號>.html 的目錄')
+    argpsr.add_argument('--save', help='先下載指定範圍的文章至目錄',
+                        metavar='START-END')
+    argpsr.add_argument('--golden', help='與 <文章編號>.json 比對輸出',
+                        action='store_true')
+    argpsr.add_argument('--repeat', help='每篇文章解析次數（預設：5）',
+                        type=int, default=5)
+    args = argpsr.parse_args()
+
+    corpus: Path = Path(args.corpus)
+    if args.save:
+        first, _, last = args.save.partition('-')
+        save(corpus, int(first), int(last or first))
+
+    pages: Dict[int, str] = {int(p.stem): p.read_text(encoding='utf8')
+                             for p in corpus.glob('*.html')}
+    if not pages:
+        print(f'{corpus} 中沒有任何網頁')
+        sys.exit(1)
+
+    mismatches: int = 0
+    for index, page in sorted(pages.items()):
+        expected: Optional[dict] = finfo_view.EXTRACTORS['bs4'](index, page)
+        golden: Path = corpus / f'{index}.json'
+        if args.golden:
+            if golden.exists():
+                expected = json.loads(golden.read_text(encoding='utf8'))
+            else:
+                golden.write_text(json.dumps(expected, ensure_ascii=False,
+                                             indent=1),
+                                  encoding='utf8')
+
+        for name, extract in finfo_view.EXTRACTORS.items():
+            if extract(index, page) != expected:
+                print(f'不一致：文章 {index}，{name}')
+                mismatches += 1
+
+    print(f'{len(pages)} 篇文章，{mismatches} 處不一致\n')
+    print(f'{"extractor":>10} {"mean (ms)":>10} {"p50 (ms)":>9} '
+          f'{"pages/s":>8}')
+    for name, extract in finfo_view.EXTRACTORS.items():
+        timings: List[float] = []
+        for index, page in pages.items():
+            for _ in range(args.repeat):
+                start: float = time.perf_counter()
+                extract(index, page)
+                timings.append(time.perf_counter() - start)
+        mean: float = statistics.mean(timings)
+        print(f'{name:>10} {mean * 1000:>10.2f} '
+              f'{statistics.median(timings) * 1000:>9.2f} {1 / mean:>8.0f}')
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
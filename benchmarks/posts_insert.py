@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+'''Compare rows/sec of the ways Database can write posts.
+
+"autocommit" is the old path: executemany with a commit per row. The
+others write each batch in one transaction, using the [BULK] mode of the
+same name. Use a scratch database, the fake posts are left behind.
+
+$ python benchmarks/posts_insert.py -f scratch.cfg --rows 50000
+'''
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import argparse
+import configparser
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database  # noqa: E402
+
+
+def fake_posts(n: int, author_id: int) -> List[Tuple[Any, ...]]:
+    content: str = '我想請問這張保單的理賠範圍，' * 20
+    return [(10_000_000 + i // 10, i % 10, '2021-09-01 12:00', author_id,
+             content)
+            for i in range(n)]
+
+
+def with_bulk_mode(config_path: str, mode: str, defer_checks: bool) -> str:
+    '''A copy of the config file with [BULK] set to mode.'''
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.read(config_path, encoding='utf-8-sig')
+    if not config.has_section('BULK'):
+        config.add_section('BULK')
+    config['BULK']['mode'] = mode
+    config['BULK']['deferchecks'] = 'yes' if defer_checks else 'no'
+
+    fd, path = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(fd, 'w', encoding='utf8') as file:
+        config.write(file)
+    return path
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='文章寫入效能測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--rows', help='每種方式寫入的資料筆數',
+                        type=int, default=20_000)
+    argpsr.add_argument('--batch', help='每批寫入的資料筆數（預設：500）',
+                        type=int, default=500)
+    argpsr.add_argument('--defer-checks', help='寫入時暫停外鍵檢查',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    for mode in ('autocommit', 'executemany', 'multirow', 'infile'):
+        cfg_path: str = with_bulk_mode(
+                args.file,
+                'executemany' if mode == 'autocommit' else mode,
+                args.defer_checks
+                )
+        db: Database = Database(cfg_path)
+        os.remove(cfg_path)
+
+        author_id: int = db.insert('users', [('王*', True)])[0]
+        rows: List[Tuple[Any, ...]] = fake_posts(args.rows, author_id)
+
+        start: float = time.perf_counter()
+        for i in range(0, len(rows), args.batch):
+            if mode == 'autocommit':
+                db.insert('posts', rows[i:i + args.batch])
+            else:
+                with db.transaction():
+                    db.insert('posts', rows[i:i + args.batch])
+        elapsed: float = time.perf_counter() - start
+
+        db.cur.execute('DELETE FROM posts WHERE post_id >= 10000000')
+        print(f'{mode:>12}: {args.rows / elapsed:10.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+'''Query plans and timings of the lookups made on posts and users.
+
+The queries are the ones update.py, refresh.py and export.py make, and
+what the dashboard asks for. Run this before and after
+migrations/006_posts_indexes.sql (and 007, to try partitioning) on the
+same data: every run prints the plan MariaDB picks (access type, key,
+rows examined, partitions read) and the median time of each query, and
+is appended to benchmarks/results/query_plans.jsonl under --label.
+--against shows the change from the last run of an earlier label.
+
+--fill first adds fake posts, replies and salesmen until posts has that
+many rows; use a scratch database, they are left behind.
+
+$ python benchmarks/query_plans.py -f scratch.cfg --fill 1000000 \\
+      --label before
+$ mariadb finfo_scratch < migrations/006_posts_indexes.sql
+$ python benchmarks/query_plans.py -f scratch.cfg --label after \\
+      --against before
+'''
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from db import Database  # noqa: E402
+
+RESULTS: Path = ROOT / 'benchmarks' / 'results' / 'query_plans.jsonl'
+# columns of EXPLAIN worth keeping
+PLAN: List[str] = ['table', 'partitions', 'type', 'key', 'rows', 'Extra']
+
+
+def fill(db: Database, size: int, chunk: int = 5000):
+    '''Add posts of 1-20 rows over 2021, until posts has size rows.'''
+    db.cur.execute('SELECT COUNT(*), COALESCE(MAX(post_id), 0) FROM posts')
+    count, post_id = db.cur.fetchone()
+    rng: random.Random = random.Random(post_id)
+    salesmen: List[int] = db.insert('users', [(f'業務員{i}', False)
+                                              for i in range(2000)])
+    content: str = '我想請問這張保單的理賠範圍，' * 10
+
+    while count < size:
+        threads: List[Tuple[Any, ...]] = []
+        rows: List[Tuple[Any, ...]] = []
+        while len(rows) < chunk and count + len(rows) < size:
+            post_id += 1
+            created: float = (time.mktime((2021, 1, 1, 0, 0, 0, 0, 0, -1))
+                              + rng.random() * 365 * 86400)
+            for position in range(rng.randint(1, 20)):
+                stamp: str = time.strftime(
+                        '%Y-%m-%d %H:%M:%S',
+                        time.localtime(created + position * 3600)
+                        )
+                rows.append((post_id, position, stamp,
+                             rng.choice(salesmen), content))
+            threads.append((post_id, f'保單問題 {post_id}',
+                            rng.randint(1, 5),
+                            time.strftime('%Y-%m-%d %H:%M:%S',
+                                          time.localtime(created))))
+        with db.transaction():
+            db.insert('threads', threads)
+            db.insert('posts', rows)
+        count += len(rows)
+        print(f'\r已填入 {count} 筆', end='', flush=True)
+    print()
+
+
+def queries(db: Database) -> List[Tuple[str, str, tuple]]:
+    '''(name, statement, parameters) of every query, the parameters
+    picked from the data, so they are the same before and after.
+    '''
+    db.cur.execute('SELECT COALESCE(MAX(post_id), 0) FROM posts')
+    latest: int = db.cur.fetchone()[0]
+    middle: int = latest // 2
+    db.cur.execute('SELECT name FROM users WHERE NOT insurer_or_salesman '
+                   'ORDER BY id LIMIT 1')
+    row: Optional[tuple] = db.cur.fetchone()
+    name: str = row[0] if row else ''
+    batch: tuple = tuple(range(middle, middle + 50))
+
+    return [
+        # Updater.plan()
+        ('latest_post_id',
+         'SELECT COALESCE(MAX(post_id), 0) FROM posts', ()),
+        # Updater.drop_stored(), for a batch of 50 posts
+        ('stored_rows',
+         f'SELECT post_id, position FROM posts '
+         f'WHERE post_id IN ({", ".join("?" * len(batch))})', batch),
+        ('one_reply',
+         'SELECT id FROM posts WHERE post_id = ? AND position = ?',
+         (middle, 1)),
+        # RefreshPlanner.seed(), the stored posts not scheduled yet
+        ('refresh_seed',
+         'SELECT p.post_id, MAX(p.position), COUNT(*) - 1, '
+         'MIN(p.create_time), MAX(p.create_time) FROM posts p '
+         'LEFT JOIN post_refresh r ON r.post_id = p.post_id '
+         'LEFT JOIN missing_posts m ON m.post_id = p.post_id '
+         'WHERE r.post_id IS NULL AND m.post_id IS NULL '
+         'GROUP BY p.post_id', ()),
+        # dashboard: posts and replies of a week
+        ('week_by_day',
+         'SELECT DATE(create_time), SUM(position = 0), SUM(position > 0) '
+         'FROM posts WHERE create_time >= ? '
+         'AND create_time < ? + INTERVAL 7 DAY GROUP BY 1',
+         ('2021-06-01', '2021-06-01')),
+        # Exporter.export_partition()
+        ('topic_month',
+         'SELECT p.id, p.post_id, t.title, p.position, p.create_time, '
+         'p.author_id, p.content FROM posts p '
+         'LEFT JOIN threads t ON t.post_id = p.post_id '
+         'WHERE COALESCE(t.topic_id, 0) = ? AND p.create_time >= ? '
+         'AND p.create_time < ? + INTERVAL 1 MONTH ORDER BY p.id',
+         (2, '2021-06-01', '2021-06-01')),
+        ('user_by_name',
+         'SELECT id FROM users WHERE name = ?', (name,)),
+    ]
+
+
+def explain(db: Database, statement: str, params: tuple) -> List[dict]:
+    # PARTITIONS adds the partitions read, NULL if posts has none
+    db.cur.execute('EXPLAIN PARTITIONS ' + statement, params)
+    columns: List[str] = [d[0] for d in db.cur.description]
+    return [{k: v for k, v in zip(columns, r) if k in PLAN}
+            for r in db.cur.fetchall()]
+
+
+def timing(db: Database, statement: str, params: tuple, runs: int) -> float:
+    '''Median milliseconds of runs, after one to warm the buffer pool.'''
+    times: List[float] = []
+    for _ in range(runs + 1):
+        start: float = time.perf_counter()
+        db.cur.execute(statement, params)
+        db.cur.fetchall()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times[1:])
+
+
+def describe(plan: List[dict]) -> str:
+    return '; '.join(f'{p["table"]}: {p["type"]} {p["key"] or "-"} '
+                     f'rows={p["rows"]}'
+                     + (f' [{p["partitions"]}]' if p.get('partitions')
+                        else '')
+                     + (f' {p["Extra"]}' if p.get('Extra') else '')
+                     for p in plan)
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='posts 與 users 查詢計畫測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件（測試用資料庫）',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--fill', help='先填入假資料，直到 posts 有 N 筆',
+                        metavar='N', type=int)
+    argpsr.add_argument('--runs', help='每個查詢執行的次數（預設：20）',
+                        type=int, default=20)
+    argpsr.add_argument('--label', help='這次結果的名稱，例如 before、after',
+                        default='current')
+    argpsr.add_argument('--against', help='與之前某個名稱的結果比較',
+                        metavar='LABEL')
+    argpsr.add_argument('--no-save', help='不要記錄這次的結果',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    db: Database = Database(args.file)
+    if args.fill:
+        fill(db, args.fill)
+
+    results: List[dict] = []
+    if RESULTS.exists():
+        results = [json.loads(line) for line
+                   in RESULTS.read_text(encoding='utf8').splitlines()
+                   if line.strip()]
+    earlier: Dict[str, dict] = {}
+    if args.against:
+        same: List[dict] = [r for r in results if r['label'] == args.against]
+        if not same:
+            print(f'沒有名稱為 {args.against} 的結果')
+            sys.exit(1)
+        earlier = same[-1]['queries']
+
+    db.cur.execute('SELECT COUNT(*) FROM posts')
+    rows: int = db.cur.fetchone()[0]
+    print(f'posts: {rows} 筆\n')
+
+    record: Dict[str, dict] = {}
+    for name, statement, params in queries(db):
+        plan: List[dict] = explain(db, statement, params)
+        ms: float = timing(db, statement, params, args.runs)
+        record[name] = {'ms': ms, 'plan': plan}
+
+        line: str = f'{name:<15} {ms:>9.2f} ms'
+        if name in earlier:
+            before: float = earlier[name]['ms']
+            line += (f'  （{args.against}: {before:.2f} ms，'
+                     f'{before / ms if ms else 0:.1f}×）')
+        print(line)
+        if name in earlier and earlier[name]['plan'] != plan:
+            print(f'{"":<15} {args.against}: '
+                  f'{describe(earlier[name]["plan"])}')
+        print(f'{"":<15} {describe(plan)}')
+
+    if not args.no_save:
+        commit: str = subprocess.run(['git', '-C', str(ROOT), 'rev-parse',
+                                      '--short', 'HEAD'],
+                                     capture_output=True,
+                                     text=True).stdout.strip()
+        RESULTS.parent.mkdir(exist_ok=True)
+        with open(RESULTS, 'a', encoding='utf8') as file:
+            file.write(json.dumps({'label': args.label,
+                                   'commit': commit,
+                                   'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                   'posts_rows': rows,
+                                   'queries': record},
+                                  ensure_ascii=False, default=str) + '\n')
+
+
+if __name__ == '__main__':
+    main()
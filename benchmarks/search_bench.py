@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+'''Time Search.query() on the posts of a database.
+
+Every query is run --runs times after one to warm the buffer pool; the
+median time and the number of hits are reported, with the size of the
+index. Build the index first with python search.py --rebuild.
+
+$ python benchmarks/search_bench.py -f scratch.cfg 理賠 保單健檢 癌症險 \\
+      --runs 20
+'''
+from pathlib import Path
+from typing import List
+
+import argparse
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database  # noqa: E402
+from search import Hit, Search  # noqa: E402
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='全文搜尋效能測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--runs', help='每個查詢執行的次數（預設：20）',
+                        type=int, default=20)
+    argpsr.add_argument('queries', nargs='*',
+                        default=['理賠', '保單健檢', '實支實付', '癌症險',
+                                 '業務員推薦', 'ptt'])
+    args = argpsr.parse_args()
+
+    db: Database = Database(args.file)
+    search: Search = Search(db)
+    db.cur.execute("SELECT df FROM search_terms WHERE term = ''")
+    row = db.cur.fetchone()
+    db.cur.execute('SELECT COUNT(*) FROM search_terms')
+    vocabulary: int = db.cur.fetchone()[0]
+    print(f'已索引 {row[0] if row else 0} 筆，{vocabulary} 個詞\n')
+
+    print(f'{"query":<12} {"p50 ms":>8} {"max ms":>8} {"hits":>5}')
+    for query in args.queries:
+        times: List[float] = []
+        hits: List[Hit] = []
+        for _ in range(args.runs + 1):
+            start: float = time.perf_counter()
+            hits = search.query(query)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f'{query:<12} {statistics.median(times[1:]):>8.2f} '
+              f'{max(times[1:]):>8.2f} {len(hits):>5}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#! /usr/bin/env python3
+'''End-to-end throughput of update.py against the local fixture server.
+
+For every engine and concurrency level, the scratch database is rebuilt
+from schema.sql and update.py crawls the whole fixture site into it, as a
+separate process so its peak RSS can be measured. Reported per run:
+posts/s (wall clock), p50/p99 fetch latency and database rows/s from the
+metrics update.py writes, the peak RSS, and the size on disk (data and
+indexes) of the tables of posts: posts, threads and users.
+
+Results are appended to benchmarks/results/update_bench.jsonl with the
+commit they were measured on; commit the file so regressions show up. A
+run slower than the last one with the same settings by more than
+--tolerance is reported and makes the exit status 1.
+
+$ python benchmarks/update_bench.py -f scratch.cfg --posts 2000 \\
+      --latency 50 --levels 10 50 100 --engines threads async
+'''
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from db import Database  # noqa: E402
+
+RESULTS: Path = ROOT / 'benchmarks' / 'results' / 'update_bench.jsonl'
+# tables the crawled posts are stored in, those missing are skipped
+STORAGE: List[str] = ['posts', 'threads', 'users']
+
+
+def bench_config(config_path: str,
+                 url: str,
+                 engine: str,
+                 level: int,
+                 metrics_path: str) -> str:
+    '''A copy of the config file crawling url at a fixed level of
+    concurrency, with nothing kept between runs.
+    '''
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.read(config_path, encoding='utf-8-sig')
+    config['finfo.tw']['url'] = url
+    update: configparser.SectionProxy = config['UPDATE']
+    update['engine'] = engine
+    update['maxthreads'] = str(level)
+    update['concurrency'] = str(level)
+    update['adaptive'] = 'no'
+    update['metrics'] = metrics_path
+    for key in ('journal', 'cache', 'validators', 'prometheus', 'listing'):
+        update[key] = ''
+
+    fd, path = tempfile.mkstemp(suffix='.cfg')
+    with os.fdopen(fd, 'w', encoding='utf8') as file:
+        config.write(file)
+    return path
+
+
+def reset_database(config_path: str):
+    cwd: str = os.getcwd()
+    os.chdir(ROOT)  # init_database() reads schema.sql from here
+    try:
+        Database(config_path).init_database()
+    finally:
+        os.chdir(cwd)
+
+
+def table_mib(config_path: str) -> float:
+    '''MiB of data and indexes of the STORAGE tables.'''
+    db: Database = Database(config_path)
+    marks: str = ', '.join('?' * len(STORAGE))
+    db.cur.execute(f'SELECT table_name FROM information_schema.tables '
+                   f'WHERE table_schema = DATABASE() '
+                   f'AND table_name IN ({marks})', tuple(STORAGE))
+    tables: List[str] = [r[0] for r in db.cur.fetchall()]
+    # InnoDB updates the sizes of information_schema lazily
+    db.cur.execute(f'ANALYZE TABLE {", ".join(tables)}')
+    db.cur.fetchall()
+    db.cur.execute(f'SELECT COALESCE(SUM(data_length + index_length), 0) '
+                   f'FROM information_schema.tables '
+                   f'WHERE table_schema = DATABASE() '
+                   f'AND table_name IN ({marks})', tuple(STORAGE))
+    return db.cur.fetchone()[0] / 2**20
+
+
+def run_update(config_path: str) -> Dict[str, float]:
+    '''Run update.py once, return its wall time and peak RSS.'''
+    start: float = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(ROOT / 'update.py'),
+                             '-f', config_path],
+                            stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f'update.py exited with {proc.returncode}')
+    return {'wall': time.perf_counter() - start,
+            'rss_mib': usage.ru_maxrss / 1024}  # KiB on Linux
+
+
+def measure(args, url: str, engine: str, level: int) -> dict:
+    fd, metrics_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    config_path: str = bench_config(args.file, url, engine, level,
+                                    metrics_path)
+    try:
+        reset_database(config_path)
+        run: Dict[str, float] = run_update(config_path)
+        run['table_mib'] = table_mib(config_path)
+        with open(metrics_path, encoding='utf8') as file:
+            metrics: dict = json.load(file)
+    finally:
+        os.remove(config_path)
+        os.remove(metrics_path)
+
+    counters: Dict[str, int] = metrics['counters']
+    histograms: Dict[str, dict] = metrics['histograms']
+    posts: int = (counters.get('posts_fetched', 0)
+                  + counters.get('posts_deleted', 0))
+    flush: dict = histograms.get('db_flush_seconds', {'sum': 0})
+    fetch: dict = histograms.get('fetch_seconds', {'p50': 0, 'p99': 0})
+    return {'engine': engine,
+            'level': level,
+            'posts': posts,
+            'failed': counters.get('posts_failed', 0),
+            'posts_per_s': posts / run['wall'],
+            'fetch_p50_ms': fetch['p50'] * 1000,
+            'fetch_p99_ms': fetch['p99'] * 1000,
+            'db_rows_per_s': (counters.get('rows_written', 0) / flush['sum']
+                              if flush['sum'] else 0),
+            'rss_mib': run['rss_mib'],
+            'table_mib': run['table_mib']}
+
+
+def previous(results: List[dict], record: dict, keys: List[str]) \
+        -> Optional[dict]:
+    same: List[dict] = [r for r in results
+                        if all(r.get(k) == record[k] for k in keys)]
+    return same[-1] if same else None
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='update.py 整體效能測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件（測試用資料庫）',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--posts', type=int, default=1000,
+                        help='模擬網站的文章數（預設：1000）')
+    argpsr.add_argument('--latency', type=float, default=50,
+                        help='模擬網站的平均回應時間，毫秒（預設：50）')
+    argpsr.add_argument('--error-rate', type=float, default=0)
+    argpsr.add_argument('--deleted-rate', type=float, default=0.05)
+    argpsr.add_argument('--replies', default='0-20', metavar='MIN-MAX')
+    argpsr.add_argument('--levels', type=int, nargs='+',
+                        default=[10, 50, 100],
+                        help='同時請求數（預設：10 50 100）')
+    argpsr.add_argument('--engines', nargs='+', default=['threads'],
+                        choices=['threads', 'async'])
+    argpsr.add_argument('--port', type=int, default=8765)
+    argpsr.add_argument('--tolerance', type=float, default=0.1,
+                        help='比上次慢多少比例視為退步（預設：0.1）')
+    argpsr.add_argument('--no-save', help='不要記錄這次的結果',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    site: Dict[str, object] = {'site_posts': args.posts,
+                               'latency_ms': args.latency,
+                               'error_rate': args.error_rate,
+                               'deleted_rate': args.deleted_rate,
+                               'replies': args.replies}
+    server = subprocess.Popen([sys.executable,
+                               str(ROOT / 'benchmarks' / 'fixture_server.py'),
+                               '--port', str(args.port),
+                               '--posts', str(args.posts),
+                               '--latency', str(args.latency),
+                               '--error-rate', str(args.error_rate),
+                               '--deleted-rate', str(args.deleted_rate),
+                               '--replies', args.replies],
+                              stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # listening
+    url: str = f'http://127.0.0.1:{args.port}'
+
+    commit: str = subprocess.run(['git', '-C', str(ROOT), 'rev-parse',
+                                  '--short', 'HEAD'],
+                                 capture_output=True, text=True).stdout.strip()
+    results: List[dict] = []
+    if RESULTS.exists():
+        results = [json.loads(line) for line
+                   in RESULTS.read_text(encoding='utf8').splitlines()
+                   if line.strip()]
+
+    print(f'{"engine":>8} {"level":>5} {"posts/s":>8} {"p50 ms":>7} '
+          f'{"p99 ms":>7} {"rows/s":>8} {"RSS MiB":>8} {"DB MiB":>7}')
+    regressions: int = 0
+    new: List[dict] = []
+    try:
+        for engine in args.engines:
+            for level in args.levels:
+                record: dict = measure(args, url, engine, level)
+                record.update(site)
+                print(f'{engine:>8} {level:>5} {record["posts_per_s"]:>8.1f} '
+                      f'{record["fetch_p50_ms"]:>7.1f} '
+                      f'{record["fetch_p99_ms"]:>7.1f} '
+                      f'{record["db_rows_per_s"]:>8.0f} '
+                      f'{record["rss_mib"]:>8.1f} '
+                      f'{record["table_mib"]:>7.2f}')
+
+                last: Optional[dict] = previous(
+                        results, record, ['engine', 'level', *site]
+                        )
+                if last is not None and record['posts_per_s'] \
+                        < last['posts_per_s'] * (1 - args.tolerance):
+                    regressions += 1
+                    print(f'         退步：上次 {last["posts_per_s"]:.1f} '
+                          f'posts/s（{last["commit"]}）')
+
+                record.update({'commit': commit,
+                               'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+                new.append(record)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if not args.no_save:
+        RESULTS.parent.mkdir(exist_ok=True)
+        with open(RESULTS, 'a', encoding='utf8') as file:
+            for record in new:
+                file.write(json.dumps(record) + '\n')
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+'''Time Database.insert('users', ...) as the users table grows.
+
+Fills users with fake salesmen and insurers up to each size, then times a
+fresh Database inserting one batch of users (existing and new salesmen,
+insurers): loading the name cache once, and the insert itself. Use a
+scratch database, the fake users are left behind.
+
+$ python benchmarks/users_insert.py -f scratch.cfg --sizes 10000 1000000
+'''
+from pathlib import Path
+from typing import List, Tuple
+
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import Database  # noqa: E402
+
+
+def fill(db: Database, size: int, chunk: int = 1000):
+    db.cur.execute('SELECT COUNT(*) FROM users')
+    count: int = db.cur.fetchone()[0]
+    while count < size:
+        n: int = min(chunk, size - count)
+        # every tenth user is an insurer, the rest are salesmen
+        rows: List[Tuple[str, bool]] = [
+                (f'bench-{count + i}' if (count + i) % 10 else '王*',
+                 (count + i) % 10 == 0)
+                for i in range(n)
+                ]
+        db.cur.execute('INSERT INTO users (name, insurer_or_salesman) '
+                       'VALUES ' + ', '.join(['(?, ?)'] * n),
+                       tuple(v for r in rows for v in r))
+        count += n
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='使用者寫入效能測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--sizes', help='users 資料表的大小',
+                        nargs='+', type=int,
+                        default=[10_000, 100_000, 1_000_000])
+    argpsr.add_argument('--batch', help='每批寫入的使用者數目（預設：500）',
+                        type=int, default=500)
+    args = argpsr.parse_args()
+
+    print(f'{"users":>10} {"cache (s)":>10} {"insert (s)":>11}')
+    for size in args.sizes:
+        fill(Database(args.file), size)
+
+        db: Database = Database(args.file)
+        batch: List[Tuple[str, bool]] = []
+        for i in range(args.batch):
+            if i % 3 == 0:  # a salesman already stored
+                batch.append((f'bench-{random.randrange(1, size, 10)}',
+                              False))
+            elif i % 3 == 1:  # a new salesman
+                batch.append((f'bench-new-{size}-{i}', False))
+            else:
+                batch.append(('李*', True))
+
+        start: float = time.perf_counter()
+        db.insert('users', batch[:1])  # loads the name cache
+        cached: float = time.perf_counter()
+        db.insert('users', batch[1:])
+        done: float = time.perf_counter()
+
+        print(f'{size:>10} {cached - start:>10.3f} {done - cached:>11.3f}')
+
+
+if __name__ == '__main__':
+    main()
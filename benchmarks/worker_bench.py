@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+'''Throughput of update.py --worker processes sharing one database.
+
+For every number of workers, the scratch database is rebuilt from
+schema.sql and that many `update.py --worker` processes crawl the local
+fixture server together, each with the same number of threads. Reported
+per run: posts/s over all workers, and whether every post of the site
+ended up stored exactly once.
+
+--crash-after kills the first worker (SIGKILL, no chance to give its range
+back) after that many seconds, so its lease has to expire before another
+worker takes the range over; the run still has to store every post.
+
+$ python benchmarks/worker_bench.py -f scratch.cfg --posts 3000 \\
+      --latency 50 --workers 1 2 4 8 --crash-after 5
+'''
+from typing import Dict, List, Optional
+
+import argparse
+import configparser
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from fixture_server import Site
+from update_bench import ROOT, bench_config, reset_database
+
+from db import Database  # update_bench has put ROOT on sys.path
+
+
+def worker_config(args, url: str) -> str:
+    path: str = bench_config(args.file, url, 'threads', args.threads, '')
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.read(path, encoding='utf-8-sig')
+    if not config.has_section('WORKER'):
+        config.add_section('WORKER')
+    config['WORKER']['chunksize'] = str(args.chunk_size)
+    config['WORKER']['lease'] = str(args.lease)
+    with open(path, 'w', encoding='utf8') as file:
+        config.write(file)
+    return path
+
+
+def measure(args, config_path: str, workers: int) -> Dict[str, float]:
+    reset_database(config_path)
+    start: float = time.perf_counter()
+    procs: List[subprocess.Popen] = [
+            subprocess.Popen([sys.executable, str(ROOT / 'update.py'),
+                              '-f', config_path, '--worker'],
+                             stdout=subprocess.DEVNULL)
+            for _ in range(workers)
+            ]
+    killed: bool = False
+    while any(p.poll() is None for p in procs):
+        if args.crash_after and workers > 1 and not killed \
+                and time.perf_counter() - start >= args.crash_after:
+            procs[0].send_signal(signal.SIGKILL)
+            killed = True
+        time.sleep(0.1)
+    wall: float = time.perf_counter() - start
+
+    failed: List[int] = [p.returncode for p in procs[killed:]
+                         if p.returncode]
+    if failed:
+        raise RuntimeError(f'workers exited with {failed}')
+
+    db: Database = Database(config_path)
+    db.cur.execute('SELECT COUNT(DISTINCT post_id), COUNT(*) FROM posts')
+    posts, rows = db.cur.fetchone()
+    db.cur.execute('SELECT COUNT(*) FROM posts '
+                   'GROUP BY post_id, position HAVING COUNT(*) > 1')
+    duplicates: int = len(db.cur.fetchall())
+    db.cur.execute('SELECT COUNT(*) FROM missing_posts')
+    missing: int = db.cur.fetchone()[0]
+    db.cur.execute("SELECT COUNT(*) FROM crawl_chunks WHERE state <> 'done'")
+    undone: int = db.cur.fetchone()[0]
+    return {'wall': wall, 'posts': posts, 'rows': rows, 'missing': missing,
+            'duplicates': duplicates, 'undone': undone}
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='多個 worker 的整體效能測試')
+    argpsr.add_argument('-f', '--file', help='使用指定的設定文件（測試用資料庫）',
+                        metavar='文件路徑', required=True)
+    argpsr.add_argument('--posts', type=int, default=2000,
+                        help='模擬網站的文章數（預設：2000）')
+    argpsr.add_argument('--latency', type=float, default=50,
+                        help='模擬網站的平均回應時間，毫秒（預設：50）')
+    argpsr.add_argument('--deleted-rate', type=float, default=0.05)
+    argpsr.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker 數（預設：1 2 4）')
+    argpsr.add_argument('--threads', type=int, default=10,
+                        help='每個 worker 的執行緒數（預設：10）')
+    argpsr.add_argument('--chunk-size', type=int, default=200)
+    argpsr.add_argument('--lease', type=int, default=10,
+                        help='租約秒數（預設：10）')
+    argpsr.add_argument('--crash-after', type=float, metavar='SECONDS',
+                        help='幾秒後強制結束第一個 worker')
+    argpsr.add_argument('--port', type=int, default=8765)
+    args = argpsr.parse_args()
+
+    server = subprocess.Popen([sys.executable,
+                               str(ROOT / 'benchmarks' / 'fixture_server.py'),
+                               '--port', str(args.port),
+                               '--posts', str(args.posts),
+                               '--latency', str(args.latency),
+                               '--deleted-rate', str(args.deleted_rate)],
+                              stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # listening
+    site: Site = Site(posts=args.posts, deleted_rate=args.deleted_rate)
+    expected: int = sum(site.exists(i) for i in range(1, args.posts + 1))
+
+    config_path: str = worker_config(args, f'http://127.0.0.1:{args.port}')
+    print(f'{"workers":>7} {"posts/s":>8} {"scaling":>7} {"posts":>6} '
+          f'{"missing":>7} {"dup":>4} {"undone":>6}')
+    base: Optional[float] = None
+    try:
+        for workers in args.workers:
+            run: Dict[str, float] = measure(args, config_path, workers)
+            rate: float = (run['posts'] + run['missing']) / run['wall']
+            base = base or rate / workers
+            ok: bool = (run['posts'] == expected and not run['duplicates']
+                        and not run['undone'])
+            print(f'{workers:>7} {rate:>8.1f} {rate / base:>6.1f}× '
+                  f'{run["posts"]:>6} {run["missing"]:>7} '
+                  f'{run["duplicates"]:>4} {run["undone"]:>6}'
+                  + ('' if ok else f'  應有 {expected} 篇文章'))
+    finally:
+        os.remove(config_path)
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,26 @@
-from typing import Mapping, List, Tuple, Any, Set
+from contextlib import contextmanager
+from typing import Mapping, List, Tuple, Any, Optional, Dict, Iterator
 
 import configparser
 import mariadb  # type: ignore
+import os
 import re
 import sys
+import tempfile
 
 
 ConfigSection = configparser.SectionProxy
 
+DEADLOCK: int = 1213  # ER_LOCK_DEADLOCK
+
+
+def deadlocked(e: BaseException) -> bool:
+    '''Whether InnoDB rolled back the transaction of e to break a deadlock,
+    e.g. between update.py --worker processes, so it may be run again.
+    '''
+    return isinstance(e, mariadb.Error) \
+        and getattr(e, 'errno', None) == DEADLOCK
+
 
 class Database:
     def __init__(self, config_path: str):
@@ -17,7 +30,19 @@ class Database:
         cfg: ConfigSection = parser['DATABASE']
 
         self._not_select_db: bool = False
+        self._salesmen: Optional[Dict[str, int]] = None  # name -> id
+
+        # how posts are written, see [BULK] in config.cfg
+        bulk: ConfigSection = (parser['BULK'] if parser.has_section('BULK')
+                               else parser[parser.default_section])
+        self.bulk_mode: str = bulk.get('mode') or 'executemany'
+        self.bulk_rows: int = int(bulk.get('rows') or 1000)
+        self.defer_checks: bool = bulk.getboolean('deferchecks',
+                                                  fallback=False)
+
         login_opts = self._parse_login_opts(cfg, parser.BOOLEAN_STATES)
+        if self.bulk_mode == 'infile':
+            login_opts['local_infile'] = True
 
         try:
             self.conn = mariadb.connect(**login_opts)
@@ -75,31 +100,154 @@ class Database:
             except mariadb.ProgrammingError:  # statement = '\n'
                 continue
 
-    def insert(self, tbl_name: str, vals: List[Tuple[Any]]):
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        '''Run the statements inside as one transaction, i.e. one commit
+        for a whole batch instead of one per row.
+        '''
+        if self.defer_checks:
+            # unique checks stay on: the dedup of salesmen and posts
+            # (ON DUPLICATE KEY, INSERT IGNORE) relies on them
+            self.cur.execute('SET foreign_key_checks = 0')
+        self.cur.execute('START TRANSACTION')
+        try:
+            yield
+        except BaseException:
+            self.cur.execute('ROLLBACK')
+            self._salesmen = None  # may hold ids which are rolled back
+            raise
+        else:
+            self.cur.execute('COMMIT')
+        finally:
+            if self.defer_checks:
+                self.cur.execute('SET foreign_key_checks = 1')
+
+    def clear(self, tbl_names: List[str]):
+        '''Delete every row of tbl_names, in the given order.'''
+        for tbl_name in tbl_names:
+            self.cur.execute(f'DELETE FROM {tbl_name}')
+        self._salesmen = None
+
+    def insert(self,
+               tbl_name: str,
+               vals: List[Tuple[Any, ...]]) -> Optional[List[int]]:
+        '''Insert vals into tbl_name. For users, return the id of each user
+        in vals, whether it is newly inserted or not.
+        '''
         statement: str = {
-                'posts': ('INSERT INTO posts (post_id, title, position, '
-                          'create_time, author_id, topic_id, content) '
-                          'VALUES (?, ? ,?, ?, ?, ?, ?)'),
+                # a thread revisited gets its title and topic updated
+                'threads': ('INSERT INTO threads (post_id, title, topic_id, '
+                            'created) VALUES (?, ?, ?, ?) '
+                            'ON DUPLICATE KEY UPDATE title = VALUES(title), '
+                            'topic_id = VALUES(topic_id)'),
+                # rows already stored (uq_post_position) are skipped
+                'posts': ('INSERT IGNORE INTO posts (post_id, position, '
+                          'create_time, author_id, content) '
+                          'VALUES (?, ?, ?, ?, ?)'),
                 'users': ('INSERT INTO users (name, insurer_or_salesman) '
-                          'VALUES (?, ?)')
+                          'VALUES (?, ?)'),
+                'missing_posts': ('INSERT INTO missing_posts (post_id, '
+                                  'checked_at) VALUES (?, NOW()) '
+                                  'ON DUPLICATE KEY UPDATE checked_at = NOW()')
                 }[tbl_name]
 
         if tbl_name == 'posts':
+            self._insert_posts(statement, vals)
+            return None
+        elif tbl_name in ('threads', 'missing_posts'):
             self.cur.executemany(statement, vals)
+            return None
         else:  # tbl_name == 'users'
-            new_users: Set[Tuple[Any]] = set()  # ensure uniqueness
-            for u in vals:
-                existed: bool
-                if u[0].endswith('*'):  # insurer
-                    existed = False
-                else:
-                    self.cur.execute('SELECT name FROM users;')
-                    existed = u[0] in [r[0] for r in self.cur.fetchall()]
-
-                if not existed:
-                    new_users.add(u)
-
+            return self._insert_users(statement, vals)
+
+    def _insert_posts(self, statement: str, vals: List[Tuple[Any, ...]]):
+        if self.bulk_mode == 'multirow':
+            head, _, row = statement.partition(' VALUES ')
+            for i in range(0, len(vals), self.bulk_rows):
+                chunk: List[Tuple[Any, ...]] = vals[i:i + self.bulk_rows]
+                self.cur.execute(head + ' VALUES '
+                                 + ', '.join([row] * len(chunk)),
+                                 tuple(v for r in chunk for v in r))
+        elif self.bulk_mode == 'infile':
+            self._load_infile('posts',
+                              ('post_id', 'position', 'create_time',
+                               'author_id', 'content'),
+                              vals)
+        else:  # executemany
             self.cur.executemany(statement, vals)
 
+    def _load_infile(self,
+                     tbl_name: str,
+                     columns: Tuple[str, ...],
+                     vals: List[Tuple[Any, ...]]):
+        '''Stream vals through LOAD DATA LOCAL INFILE, the fastest way to
+        get many rows into InnoDB.
+        '''
+        fd, path = tempfile.mkstemp(suffix='.tsv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8', newline='') as file:
+                for r in vals:
+                    file.write('\t'.join(_escape_field(v) for v in r) + '\n')
+            self.cur.execute(f"LOAD DATA LOCAL INFILE '{_quote(path)}' "
+                             f"IGNORE INTO TABLE {tbl_name} "
+                             f"CHARACTER SET utf8mb4 "
+                             f"({', '.join(columns)})")
+        finally:
+            os.remove(path)
+
+    def _insert_users(self,
+                      statement: str,
+                      vals: List[Tuple[Any, ...]]) -> List[int]:
+        # Salesmen are unique by name (uq_salesman_name), insurers are not:
+        # their names are masked, so every insurer row is a new user.
+        if self._salesmen is None:  # loaded once, then kept up to date
+            self.cur.execute('SELECT name, id FROM users '
+                             'WHERE NOT insurer_or_salesman')
+            self._salesmen = {r[0]: r[1] for r in self.cur.fetchall()}
+
+        ids: List[Optional[int]] = [None] * len(vals)
+        insurers: List[int] = []
+        for i, (name, insurer) in enumerate(vals):
+            if insurer:
+                insurers.append(i)
+                continue
+
+            if name not in self._salesmen:
+                # another updater may have inserted it already, then
+                # LAST_INSERT_ID(id) hands us the existing id
+                self.cur.execute(statement + ' ON DUPLICATE KEY UPDATE '
+                                 'id = LAST_INSERT_ID(id)', (name, False))
+                self._salesmen[name] = self.cur.lastrowid
+            ids[i] = self._salesmen[name]
+
+        if insurers:
+            # One multi-row INSERT gets consecutive ids starting from
+            # LAST_INSERT_ID(), as long as innodb_autoinc_lock_mode is not 2
+            # (interleaved); MariaDB defaults to 1.
+            rows: str = ', '.join(['(?, ?)'] * len(insurers))
+            self.cur.execute('INSERT INTO users (name, insurer_or_salesman) '
+                             'VALUES ' + rows,
+                             tuple(v for i in insurers for v in vals[i]))
+            first: int = self.cur.lastrowid
+            for n, i in enumerate(insurers):
+                ids[i] = first + n
+
+        return ids  # type: ignore
+
     def update(self):
         ...
+
+
+def _escape_field(value: Any) -> str:
+    '''A value in the default LOAD DATA text format.'''
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\')
+                      .replace('\t', '\\t')
+                      .replace('\n', '\\n')
+                      .replace('\r', '\\r')
+                      .replace('\0', '\\0'))
+
+
+def _quote(path: str) -> str:
+    return path.replace('\\', '\\\\').replace("'", "\\'")
@@ -0,0 +1,229 @@
+'''Where finfo.tw is at: its newest post, and the stored posts active
+lately, read from the listing pages instead of a scrape of /posts.
+
+The listing /posts?page=N shows the posts most recently active first,
+so the ids listed above those at the top of the last pass are the posts
+created or replied to since. A post of that top replied to again moves
+back up above the others, so the top is found where the rest of it
+still follows in its old order (see last_top()); only a reply to the
+very first post with nothing else going on cannot be told apart.
+Discoverer reads pages from the first one and stops reading, mid-page if
+it can, as soon as the top is found. The pages are parsed as they arrive
+by the streaming parser of the standard library, keeping the ids of the
+links only. A pass costs a request or two.
+
+If the listing cannot be read, the newest post is found by probing post
+ids instead: doubling the distance from the newest stored post until no
+post is there, then halving the range left. Deleted posts leave gaps, so
+a probe looks at a few ids in a row; a post is there if its page parses
+(see finfo_view.parse_page()), as finfo.tw may answer a deleted one with
+a page of its own. A pass probes at most max_probes ids.
+'''
+from html.parser import HTMLParser
+from metrics import METRICS
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import codecs
+import finfo_view
+import json
+import os
+import requests
+
+
+LISTING_CLASS: Set[str] = {'text-decoration-none', 'd-flex',
+                           'justify-content-center', 'row'}
+USER_AGENT: str = ('Mozilla/5.0 (X11; Linux x86_64) '
+                   'AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/92.0.4515.159 Safari/537.36')
+HEAD: int = 5  # ids at the top of the listing remembered between passes
+CHUNK: int = 8192  # bytes of a listing page parsed at a time
+
+
+class Discovery(NamedTuple):
+    latest: int  # the newest post id of finfo.tw
+    active: List[int]  # stored posts listed as active since the last pass
+
+
+class ListingParser(HTMLParser):
+    '''Post ids linked from a listing page, in order, fed a chunk of the
+    page at a time.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.post_ids: List[int] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str]]):
+        if tag != 'a':
+            return
+        attributes: dict = dict(attrs)
+        if not LISTING_CLASS <= set((attributes.get('class') or '').split()):
+            return
+        tail: str = (attributes.get('href') or '').rstrip('/')
+        tail = tail.rsplit('/', 1)[-1]
+        if tail.isdigit():
+            self.post_ids.append(int(tail))
+
+
+def last_top(seen: List[int], head: List[int],
+             final: bool = False) -> Optional[int]:
+    '''Where in seen the listing reaches head, the top of the last pass:
+    the first id of head with every id before it in head moved above it
+    (replied to since), followed by the next id of head not moved. None
+    if seen does not tell yet; with final, seen is all there is.
+    '''
+    rank: Dict[int, int] = {post_id: i for i, post_id in enumerate(head)}
+    moved: Set[int] = set()
+    for n, post_id in enumerate(seen):
+        i: Optional[int] = rank.get(post_id)
+        if i is not None and moved.issuperset(head[:i]):
+            rest: List[int] = [h for h in head[i + 1:] if h not in moved]
+            if not rest:
+                return n
+            if n + 1 < len(seen):
+                if seen[n + 1] == rest[0]:
+                    return n
+            elif final:
+                return n
+        moved.add(post_id)
+    return None
+
+
+class Discoverer:
+    def __init__(self,
+                 state_path: Optional[str] = None,
+                 max_pages: int = 5,
+                 window: int = 5,
+                 max_probes: int = 200):
+        # the top of the listing at the last pass, without it only the
+        # first page is read and no post is reported active
+        self.state_path: Optional[str] = state_path
+        self.max_pages: int = max_pages
+        self.window: int = window  # ids looked at by a probe
+        self.max_probes: int = max_probes
+        self.requests: int = 0  # made by the last pass
+        self.probes: int = 0
+        self.session: requests.Session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+
+    def discover(self, stored_latest: int) -> Discovery:
+        '''The newest post of finfo.tw and the stored posts, up to
+        stored_latest, that have been active since the last pass.
+        '''
+        self.requests = 0
+        self.probes = 0
+        try:
+            discovery: Discovery = self.walk(stored_latest)
+        except (requests.RequestException, LookupError) as e:
+            print(f'無法讀取文章列表（{e}），改為探測文章編號')
+            discovery = Discovery(self.probe(stored_latest), [])
+        METRICS.count('discovery_requests', self.requests)
+        return discovery
+
+    def walk(self, stored_latest: int) -> Discovery:
+        head: List[int] = self.load_state()
+        seen: List[int] = []
+        top: Optional[int] = None
+        for page in range(1, self.max_pages + 1):
+            listed, top = self.read_page(page, seen, head)
+            if top is not None or not listed or not head:
+                break
+        if not seen:
+            raise LookupError('文章列表上沒有文章')
+        if top is None:  # the last id read may be it
+            top = last_top(seen, head, final=True)
+
+        # above top: what has been created or replied to since; without
+        # one (the first pass, or the whole head deleted) it all is
+        above: List[int] = seen if top is None else seen[:top]
+        self.save_state((above + [i for i in head if i not in above])[:HEAD])
+        active: List[int] = ([i for i in dict.fromkeys(above)
+                              if i <= stored_latest]
+                             if head else [])
+        return Discovery(max(seen + head), active)
+
+    def read_page(self,
+                  page: int,
+                  seen: List[int],
+                  head: List[int]) -> Tuple[bool, Optional[int]]:
+        '''Add the post ids of a listing page to seen, until the top of the
+        last pass (head) is found in it. Return whether the page listed
+        any post, and where in seen that top is, if found.
+        '''
+        url: str = (finfo_view.URL_BASE if page == 1
+                    else f'{finfo_view.URL_BASE}?page={page}')
+        self.requests += 1
+        parser: ListingParser = ListingParser()
+        decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        before: int = len(seen)
+        with self.session.get(url, timeout=finfo_view.TIMEOUT,
+                              stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(CHUNK):
+                parser.feed(decoder.decode(chunk))
+                del seen[before:]
+                seen += parser.post_ids
+                top: Optional[int] = last_top(seen, head)
+                if top is not None:  # the rest is known, skip it
+                    return True, top
+        parser.close()
+        del seen[before:]
+        seen += parser.post_ids
+        return bool(parser.post_ids), last_top(seen, head)
+
+    def probe(self, stored_latest: int) -> int:
+        low: int = stored_latest  # exists, or 0
+        step: int = 1
+        while True:
+            found: Optional[int] = self.found_near(low + step)
+            if found is None:
+                high: int = low + step
+                break
+            low = found
+            step *= 2
+
+        # the newest post lies between low and high
+        while high - low > 1:
+            middle: int = (low + high) // 2
+            found = self.found_near(middle)
+            if found is None:
+                high = middle
+            else:
+                low = found
+        return low
+
+    def found_near(self, index: int) -> Optional[int]:
+        '''The first post of the window starting at index that exists.'''
+        for i in range(index, index + self.window):
+            if self.exists(i):
+                return i
+        return None
+
+    def exists(self, index: int) -> bool:
+        if self.probes >= self.max_probes:
+            raise LookupError(f'探測 {self.probes} 個文章編號仍找不到最新文章')
+        self.probes += 1
+        self.requests += 1
+        with self.session.get(f'{finfo_view.URL_BASE}/{index}',
+                              timeout=finfo_view.TIMEOUT,
+                              stream=True) as response:
+            if response.status_code == 404:  # the body is never read
+                return False
+            response.raise_for_status()
+            return finfo_view.parse_page(index, response.text) is not None
+
+    def load_state(self) -> List[int]:
+        if self.state_path is None:
+            return []
+        try:
+            with open(self.state_path, encoding='utf8') as file:
+                return json.load(file)['head']
+        except FileNotFoundError:
+            return []
+
+    def save_state(self, head: List[int]):
+        if self.state_path is None:
+            return
+        tmp: str = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf8') as file:
+            json.dump({'head': head}, file)
+        os.replace(tmp, self.state_path)
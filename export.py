@@ -0,0 +1,231 @@
+#! /usr/bin/env python3
+'''Export the database into Parquet files for the dashboard.
+
+Layout of the export directory:
+    posts/topic_id=<id>/month=<YYYY-MM>/part-0.parquet
+    users.parquet, topics.parquet, regions.parquet
+    export_state.json    the highest posts.id exported so far
+
+posts is partitioned the Hive way, so dashboards (and pyarrow.dataset)
+read only the topics and months they filter on. A run rewrites only the
+partitions posts were added to since the last one, e.g. after each
+update.py; users and the two small tables are rewritten whole.
+
+Which posts are new is told by posts.id alone, which holds as long as
+rows are committed in the order of their ids. update.py --worker
+processes commit theirs out of order, so the export refuses to run while
+a range of the work queue is leased (see work_queue.py).
+
+$ python export.py [-f 設定文件] [-o 目錄] [--full]
+'''
+from datetime import datetime
+from db import Database
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import argparse
+import configparser
+import json
+import os
+import re
+import shutil
+import sys
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except ImportError:  # pyarrow is optional, only needed here
+    pa = None
+
+
+ConfigSection = configparser.SectionProxy
+Partition = Tuple[int, str]  # topic_id (0 if none), month as YYYY-MM
+
+STATE: str = 'export_state.json'
+# columns repeated a lot (a title for every reply, a name for every post
+# of a salesman) are dictionary encoded
+DICTIONARY: List[str] = ['title', 'name', 'includings']
+
+
+def schemas() -> Dict[str, Any]:
+    return {
+        # topic_id is in the path of the partition, not in the files
+        'posts': pa.schema([('id', pa.uint32()),
+                            ('post_id', pa.uint32()),
+                            ('title', pa.string()),
+                            ('position', pa.uint16()),
+                            ('create_time', pa.timestamp('s')),
+                            ('author_id', pa.uint32()),
+                            ('content', pa.string())]),
+        'users': pa.schema([('id', pa.uint32()),
+                            ('name', pa.string()),
+                            ('insurer_or_salesman', pa.bool_()),
+                            ('sex', pa.bool_()),
+                            ('region_id', pa.uint8())]),
+        'topics': pa.schema([('id', pa.uint8()), ('name', pa.string())]),
+        'regions': pa.schema([('id', pa.uint8()),
+                              ('name', pa.string()),
+                              ('includings', pa.string())]),
+    }
+
+
+class Exporter:
+    def __init__(self,
+                 database: Database,
+                 root: str,
+                 row_group: int = 100_000):
+        if pa is None:
+            print('匯出 Parquet 需要 pyarrow，請先安裝：pip install pyarrow')
+            sys.exit(1)
+
+        self.db: Database = database
+        self.root: Path = Path(root)
+        self.row_group: int = row_group  # rows fetched and written at once
+        self.schemas: Dict[str, Any] = schemas()
+
+    def load_state(self) -> int:
+        try:
+            with open(self.root / STATE, encoding='utf8') as file:
+                return json.load(file)['posts_id']
+        except FileNotFoundError:
+            return 0
+
+    def save_state(self, posts_id: int):
+        tmp: Path = self.root / (STATE + '.tmp')
+        with open(tmp, 'w', encoding='utf8') as file:
+            json.dump({'posts_id': posts_id,
+                       'exported_at': datetime.now().isoformat()}, file)
+        os.replace(tmp, self.root / STATE)
+
+    def export(self, full: bool = False):
+        self.db.cur.execute("SELECT COUNT(*) FROM crawl_chunks "
+                            "WHERE state = 'leased' "
+                            "AND lease_expires >= NOW()")
+        if self.db.cur.fetchone()[0]:
+            # rows of a batch still to come may get ids below the others
+            print('update.py --worker 執行中，請待其完成後再匯出')
+            sys.exit(1)
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.db.cur.execute('SELECT COALESCE(MAX(id), 0) FROM posts')
+        latest: int = self.db.cur.fetchone()[0]
+        exported: int = 0 if full else self.load_state()
+        if latest < exported:  # posts rebuilt, e.g. --reparse-from-cache
+            print('posts 已重建，重新匯出全部資料')
+            exported = 0
+        if not exported:  # no partition of an older export left behind
+            shutil.rmtree(self.root / 'posts', ignore_errors=True)
+
+        partitions: Set[Partition] = self.changed_partitions(exported)
+        for topic_id, month in sorted(partitions):
+            self.export_partition(topic_id, month)
+        print(f'已匯出 {len(partitions)} 個 posts 分區')
+
+        for table in ('users', 'topics', 'regions'):
+            self.export_table(table)
+
+        self.save_state(latest)
+
+    def changed_partitions(self, exported: int) -> Set[Partition]:
+        '''Partitions of the posts added after posts.id exported.'''
+        self.db.cur.execute("SELECT DISTINCT COALESCE(t.topic_id, 0), "
+                            "DATE_FORMAT(p.create_time, '%Y-%m') "
+                            "FROM posts p LEFT JOIN threads t "
+                            "ON t.post_id = p.post_id WHERE p.id > ?",
+                            (exported,))
+        return {(r[0], r[1]) for r in self.db.cur.fetchall()}
+
+    def export_partition(self, topic_id: int, month: str):
+        path: Path = (self.root / 'posts' / f'topic_id={topic_id}'
+                      / f'month={month}' / 'part-0.parquet')
+        first_day: str = month + '-01'
+        self.write(path, 'posts',
+                   # the title is stored once per thread, and joined
+                   # back into every row of the export
+                   'SELECT p.id, p.post_id, t.title, p.position, '
+                   'p.create_time, p.author_id, p.content FROM posts p '
+                   'LEFT JOIN threads t ON t.post_id = p.post_id '
+                   'WHERE COALESCE(t.topic_id, 0) = ? '
+                   'AND p.create_time >= ? '
+                   'AND p.create_time < ? + INTERVAL 1 MONTH ORDER BY p.id',
+                   (topic_id, first_day, first_day))
+
+    def export_table(self, table: str):
+        columns: str = ', '.join(self.schemas[table].names)
+        self.write(self.root / f'{table}.parquet', table,
+                   f'SELECT {columns} FROM {table} ORDER BY id', ())
+
+    def write(self, path: Path, table: str, query: str, params: tuple):
+        '''Stream the result of query into path, a row group at a time,
+        replacing the file only once it is complete.
+        '''
+        schema = self.schemas[table]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp: Path = path.with_suffix('.tmp')
+
+        # unbuffered, so the rows are not all held by the client at once
+        cur = self.db.conn.cursor(buffered=False)
+        cur.execute(query, params)
+        dictionary: List[str] = [c for c in schema.names if c in DICTIONARY]
+        with pq.ParquetWriter(str(tmp), schema, compression='zstd',
+                              use_dictionary=dictionary) as writer:
+            while True:
+                rows: List[tuple] = cur.fetchmany(self.row_group)
+                if not rows:
+                    break
+                columns: List[list] = [list(c) for c in zip(*rows)]
+                writer.write_table(pa.Table.from_arrays(
+                        [pa.array(to_bools(c) if f.type == pa.bool_() else c,
+                                  type=f.type)
+                         for c, f in zip(columns, schema)],
+                        schema=schema
+                        ))
+        cur.close()
+        os.replace(tmp, path)
+
+
+def to_bools(column: list) -> list:
+    '''MariaDB gives BOOLEAN columns as 0 or 1, which pyarrow does not
+    take for bool_().
+    '''
+    return [None if v is None else bool(v) for v in column]
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='匯出資料庫為 Parquet 檔')
+    argpsr.add_argument('-f', '--file',
+                        help='使用指定的設定文件',
+                        metavar='文件路徑')
+    argpsr.add_argument('-o', '--output',
+                        help='匯出的目錄（預設：設定文件中的 [EXPORT] dir）',
+                        metavar='目錄')
+    argpsr.add_argument('--full',
+                        help='不論上次匯出到哪裡，重新匯出全部資料',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    module_dir: Path = Path(__file__).parent.resolve()
+    cfg_path: Path = (Path(args.file).resolve() if args.file
+                      else module_dir / 'config.cfg')
+
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.SECTCRE = re.compile(r"\[ *(?P<header>[^]]+?) *\]")
+    config.read(cfg_path, encoding='utf-8-sig')
+    cfg: ConfigSection = (config['EXPORT'] if config.has_section('EXPORT')
+                          else config[config.default_section])
+
+    output: Optional[Path] = (Path(args.output).resolve() if args.output
+                              else module_dir / cfg['dir'] if cfg.get('dir')
+                              else None)
+    if output is None:
+        print('未指定匯出目錄')
+        sys.exit(1)
+
+    exporter: Exporter = Exporter(Database(str(cfg_path)),
+                                  str(output),
+                                  int(cfg.get('rowgroup') or 100_000))
+    exporter.export(full=args.full)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,9 @@ FINFO 貼文簡易查詢
 使用方式：
 $ python finfo_view.py [-h|--help] [-o|--output PATH] [-n|--nosave]
                        [-j|--json] [-i|--index INDEX]
+                       [--cache DIR] [--prefetch K]
+$ python finfo_view.py (-r|--range START-END | --ids-from FILE)
+                       [-o|--output PATH] [-t|--threads N]
 
 選項：
 -h, --help               印出這份文件並退出
@@ -21,6 +24,17 @@ $ python finfo_view.py [-h|--help] [-o|--output PATH] [-n|--nosave]
 -j, --json               改成印出 JSON 格式文字
 -i INDEX, --index INDEX  由文章編號擷取指定的一篇文章並退出，
                          文章編號須為正整數
+--cache DIR              互動模式下將抓到的網頁存於 DIR，一小時內再看
+                         同一篇文章（即使是下次執行）就不必重新下載
+--prefetch K             互動模式下，每看一篇文章就在背景先抓取前後各
+                         K 篇（預設：2，0 則不預先抓取）
+-r START-END, --range START-END
+                         同時擷取一段範圍內的文章，每抓到一篇就寫一行
+                         JSON（NDJSON）至輸出檔，PATH 為 - 時寫至標準輸出
+                        （預設存檔為 finfo_forum_<時間>.ndjson）
+--ids-from FILE          同上，但擷取 FILE 中每行一個的文章編號，
+                         FILE 為 - 時由標準輸入讀取
+-t N, --threads N        範圍模式下同時進行的請求數（預設：10）
 
 需求：
 - python3.x.x
@@ -95,28 +109,59 @@ $ python finfo_view.py [-h|--help] [-o|--output PATH] [-n|--nosave]
 #      'identity': str,  # 'insurer'（保戶）或 'salesman'（業務員）
 #      'region': str     # 業務員的服務區域，若為保戶則設為 None
 #    }
-import sys
-
-
-if '-h' in sys.argv or '--help' in sys.argv:
-    print(sys.modules[__name__].__doc__)
-    sys.exit()
-
-
 from bs4 import BeautifulSoup
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import as_completed, wait
+from metrics import METRICS
+from page_cache import PageCache
+from post_cache import PostCache
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple
+from typing import List, Optional, Set, TextIO, Tuple
+from validators import Validators
 
 import bs4
 import json
 import requests
+import sys
+import threading
 import time
 
 
+URL_BASE = "https://finfo.tw/posts"
+CLASSES = ['投保規劃', '保單健檢', '理賠申請', '理賠申請', '保險觀念']
+
+# raw pages are stored in CACHE when set, and only read from it if OFFLINE
+CACHE: Optional[PageCache] = None
+OFFLINE = False
+# seconds to wait for finfo.tw, None to wait forever
+TIMEOUT: Optional[float] = None
+# revisits are conditional requests when VALIDATORS is set
+VALIDATORS: Optional[Validators] = None
+
+
+class NotModified(Exception):
+    '''The post has not changed since it was last fetched.'''
+
+
+class Unchanged(NamedTuple):
+    '''Put on a queue in place of a post found unchanged.'''
+    post_id: int
+
+
 '''
 ==========================================================================
 Subprograms
 ==========================================================================
 '''
 
+def new_database() -> dict:
+    '''Return an empty json_ container, see the structure above.'''
+    return {'articles': [],
+            'classes': list(CLASSES),
+            'users': [],
+            'replies': []}
+
+
 def parse_content(contents):  # contents: list of div tags
     result = []
     for para in contents:
@@ -154,9 +199,60 @@ def add_user(soup, db, identity):
     db['users'].append(user)
 
 
-def get_post(index):
-    response = requests.get(URL_BASE + '/' + str(index))
-    sp=BeautifulSoup(response.text, "html.parser")
+def get_page(index, session: Optional[requests.Session] = None) -> str:
+    '''Download the raw HTML of a post. Pass a session to reuse its
+    keep-alive connection between calls. See use_cache() for the cache.
+    Raises NotModified if a post revisited has not changed since the last
+    fetch, see use_validators().
+    '''
+    if OFFLINE:
+        with METRICS.timer('cache_read_seconds'):
+            page = CACHE.get(int(index)) if CACHE is not None else None
+        if page is None:
+            raise LookupError(f'post {index} is not in the cache')
+        return page
+
+    requester = requests if session is None else session
+    headers = VALIDATORS.headers(int(index)) if VALIDATORS is not None \
+        else {}
+    started = time.perf_counter()
+    response = requester.get(URL_BASE + '/' + str(index), headers=headers,
+                             timeout=TIMEOUT)
+    # requests does not time DNS and connect apart: elapsed is up to the
+    # headers, the rest is the body
+    took = time.perf_counter() - started
+    METRICS.observe('fetch_seconds', took)
+    METRICS.observe('fetch_ttfb_seconds', response.elapsed.total_seconds())
+    METRICS.observe('fetch_body_seconds',
+                    max(took - response.elapsed.total_seconds(), 0))
+    if response.status_code != 404:  # a 404 page is a deleted post
+        response.raise_for_status()
+    if VALIDATORS is not None and not VALIDATORS.modified(
+            int(index), response.status_code, response.headers,
+            response.text):
+        raise NotModified(index)
+    if CACHE is not None and response.status_code == 200:
+        CACHE.put(int(index), response.text)
+    return response.text
+
+
+def use_cache(cache: Optional[PageCache], offline: bool = False):
+    '''Keep every page fetched in cache, or with offline, read pages from
+    cache instead of finfo.tw.
+    '''
+    global CACHE, OFFLINE
+    CACHE = cache
+    OFFLINE = offline
+
+
+def use_validators(validators: Optional[Validators]):
+    '''Make requests for posts fetched before conditional.'''
+    global VALIDATORS
+    VALIDATORS = validators
+
+
+def split_page(page: str):
+    sp=BeautifulSoup(page, "html.parser")
 
     title=sp.find('h1',class_='mb-16-px display-2 display-1-sm')
     content=sp.find('div',class_='post-content')
@@ -165,7 +261,11 @@ def get_post(index):
     return sp, title, content, comment
 
 
-def parse_post(soup, database, content, comment):
+def get_post(index, session: Optional[requests.Session] = None):
+    return split_page(get_page(index, session))
+
+
+def parse_post(soup, database, index, title, content, comment):
     # build article author
     # Article author are all insurer, and to protect personal data,
     # insurer have no other infomation beside first two latters
@@ -174,7 +274,7 @@ def parse_post(soup, database, content, comment):
 
     # build article
     article = {}
-    article['id'] = n
+    article['id'] = int(index)
     article['title'] = title.get_text(strip=True)
     cls_time = soup.find('div', class_='t6 text-gray-1')
     # NOTE: "．" (i.e. chr(65294)) is not a dot (".")
@@ -191,7 +291,7 @@ def parse_post(soup, database, content, comment):
     replies = []
     for i in range(len(comment)):  # len(meta_comments) == len(comment)
         reply = {}
-        reply['belongsTo'] = n
+        reply['belongsTo'] = int(index)
         reply['content'] = parse_content(comment[i].find_all('div'))
         # parse metadata
         flr_time = meta_comments[i].find('div', class_='t6 text-gray-1')
@@ -227,6 +327,129 @@ def parse_post(soup, database, content, comment):
     database['articles'].append(article)
 
 
+def parse_page_soup(index, page: str) -> Optional[dict]:
+    soup, title, content, comment = split_page(page)
+    if title is None:
+        return None
+
+    database = new_database()
+    parse_post(soup, database, index, title, content, comment)
+    return database['articles'][0]
+
+
+# Extractors turn the raw HTML of a post into an article, they all give the
+# same output. lxml_extractor is several times faster than BeautifulSoup,
+# and is used whenever lxml is installed.
+EXTRACTORS: Dict[str, Callable[[Any, str], Optional[dict]]] = {
+        'bs4': parse_page_soup
+        }
+try:
+    import lxml_extractor
+    EXTRACTORS['lxml'] = lxml_extractor.parse_page
+except ImportError:  # lxml is optional
+    pass
+
+EXTRACTOR = 'lxml' if 'lxml' in EXTRACTORS else 'bs4'
+
+
+def use_extractor(name: str):
+    global EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(f'unknown or unavailable extractor: {name}')
+    EXTRACTOR = name
+
+
+def parse_page(index, page: str) -> Optional[dict]:
+    '''Parse the raw HTML of a post into an article (see the structure
+    above). Return None if the post does not exist or has been deleted.
+    '''
+    with METRICS.timer('parse_seconds'):
+        return EXTRACTORS[EXTRACTOR](index, page)
+
+
+def fetch_post(index,
+               session: Optional[requests.Session] = None) -> Optional[dict]:
+    '''Fetch and parse a post in one go, this is the entry point for other
+    modules. Return None if the post does not exist or has been deleted,
+    raise NotModified if it has not changed since the last fetch.
+    '''
+    return parse_page(index, get_page(index, session))
+
+
+def export_posts(indices: Iterable[int],
+                 out: TextIO,
+                 threads: int = 10) -> Tuple[int, int, int]:
+    '''Fetch posts concurrently and write every article to out as one line
+    of compact JSON (NDJSON) as soon as it is parsed, in the order they
+    finish. At most 2 * threads posts are in flight and indices is read
+    lazily, so memory stays the same however many posts are exported.
+    Return how many posts were written, missing and failed.
+    '''
+    local = threading.local()  # one keep-alive session per thread
+
+    def fetch(index: int) -> Optional[dict]:
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return fetch_post(index, local.session)
+
+    written = missing = failed = 0
+
+    submitted: Dict[Future, int] = {}  # -> post id
+
+    def write(future: Future):
+        nonlocal written, missing, failed
+        index: int = submitted.pop(future)
+        try:
+            article = future.result()
+        except requests.RequestException as e:
+            print(f'無法擷取文章 {index}（{e}）', file=sys.stderr)
+            failed += 1
+            return
+        except Exception as e:  # markup the extractor does not expect
+            print(f'無法解析文章 {index}（{e!r}）', file=sys.stderr)
+            failed += 1
+            return
+        if article is None:
+            missing += 1
+            return
+        out.write(json.dumps(article, ensure_ascii=False,
+                             separators=(',', ':')) + '\n')
+        out.flush()
+        written += 1
+
+    with ThreadPoolExecutor(threads) as pool:
+        pending: Set[Future] = set()
+        for index in indices:
+            future: Future = pool.submit(fetch, index)
+            submitted[future] = index
+            pending.add(future)
+            if len(pending) >= 2 * threads:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+        for future in as_completed(pending):
+            write(future)
+
+    return written, missing, failed
+
+
+def read_ids(lines: Iterable[str],
+             rejected: Optional[List[str]] = None) -> Iterator[int]:
+    '''Post ids, one per line, blank lines and # comments skipped. A line
+    which is not a post id is reported, added to rejected and skipped.
+    '''
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        try:
+            yield int(line)
+        except ValueError:
+            print(f'略過無效的文章編號：{line}', file=sys.stderr)
+            if rejected is not None:
+                rejected.append(line)
+
+
 def print_post(title, content, comment, database):
     PRINT_JSON = '-j' in sys.argv or '--json' in sys.argv
     if PRINT_JSON:
@@ -240,87 +463,164 @@ def print_post(title, content, comment, database):
             print(comment[i].get_text(strip=True))
             print()
 
-'''
-==========================================================================
-Main Program - Initializing Data Container
-==========================================================================
-'''
 
-json_ = {}
-json_['articles'] = []
-json_['classes'] = ['投保規劃', '保單健檢', '理賠申請',
-                    '理賠申請', '保險觀念']
-json_['users'] = []
-json_['replies'] = []
+def main():
+    if '-h' in sys.argv or '--help' in sys.argv:
+        print(sys.modules[__name__].__doc__)
+        sys.exit()
+
+    '''
+    ======================================================================
+    Main Program - Initializing Data Container
+    ======================================================================
+    '''
+
+    json_ = new_database()
+    session = requests.Session()
+
+    '''
+    ======================================================================
+    Main Program - Range Mode
+    ======================================================================
+    '''
+
+    RANGE = [a for a in ('-r', '--range', '--ids-from') if a in sys.argv]
+    if RANGE:
+        arg = sys.argv[sys.argv.index(RANGE[0]) + 1]
+        threads = 10
+        for opt in ('-t', '--threads'):
+            if opt in sys.argv:
+                threads = int(sys.argv[sys.argv.index(opt) + 1])
+
+        ids_file = None
+        rejected = []  # lines of ids_file which are not post ids
+        if RANGE[0] == '--ids-from':
+            ids_file = sys.stdin if arg == '-' \
+                else open(arg, encoding='utf8')
+            indices = read_ids(ids_file, rejected)
+        else:
+            try:
+                start, _, end = arg.partition('-')
+                indices = range(int(start), int(end or start) + 1)
+            except ValueError:
+                print(f'參數錯誤（{RANGE[0]} {arg}）：須為 START-END')
+                sys.exit(1)
+
+        output = None
+        for opt in ('-o', '--output'):
+            if opt in sys.argv:
+                output = sys.argv[sys.argv.index(opt) + 1]
+        if output is None:
+            now = time.strftime('%b%d_%H%M_%Y', time.localtime())
+            output = 'finfo_forum_' + now + '.ndjson'
+
+        out = sys.stdout if output == '-' \
+            else open(output, 'w', encoding='utf8')
+        try:
+            written, missing, failed = export_posts(indices, out, threads)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+            if ids_file is not None and ids_file is not sys.stdin:
+                ids_file.close()
+
+        failed += len(rejected)
+        print(f'已匯出 {written} 篇文章，{missing} 篇不存在或已被刪除，'
+              f'{failed} 篇擷取失敗', file=sys.stderr)
+        sys.exit(1 if failed else 0)
+
+    '''
+    ======================================================================
+    Main Program - Interactive Mode
+    ======================================================================
+    '''
+
+    INTERACTIVE = not ('-i' in sys.argv or '--index' in sys.argv)
+
+    if INTERACTIVE:
+        prefetch = 2
+        if '--prefetch' in sys.argv:
+            prefetch = int(sys.argv[sys.argv.index('--prefetch') + 1])
+        if '--cache' in sys.argv:
+            use_cache(PageCache(sys.argv[sys.argv.index('--cache') + 1]))
+        # revisits and the posts next to the last one cost no request
+        posts = PostCache(get_page, prefetch=prefetch, disk=CACHE)
+        viewed = set()
 
-'''
-==========================================================================
-Main Program - Interactive Mode
-==========================================================================
-'''
+    try:
+        while INTERACTIVE:
+            try:
+                n=int(input('請輸入文章號碼:(輸入0則結束)'))
+            except EOFError:  # end of input, as 0
+                print()
+                n = 0
+            if n==0:
+                break
+            soup, title, content, comment = split_page(posts.get(n))
+
+            if title is None:
+                print('文章不存在或已被刪除')
+                continue
+
+            if n not in viewed:  # saved once, however often it is viewed
+                viewed.add(n)
+                parse_post(soup, json_, n, title, content, comment)
+            print_post(title, content, comment, json_)
+    finally:  # Ctrl-C included
+        if INTERACTIVE:
+            posts.close()
+            print(posts.report())
+
+    '''
+    ======================================================================
+    Main Program - Single Post Mode
+    ======================================================================
+    '''
+
+    if not INTERACTIVE:
+        if '-i' in sys.argv:
+            _index = sys.argv.index('-i')
+        else:
+            _index = sys.argv.index('--index')
 
-URL_BASE = "https://finfo.tw/posts"
-INTERACTIVE = not ('-i' in sys.argv or '--index' in sys.argv)
+        try:
+            int(sys.argv[_index + 1])
+        except ValueError:
+            print(f'參數錯誤（-i {sys.argv[_index + 1]}）：文章編號須為正整數')
+            sys.exit(1)
 
-while INTERACTIVE:
-    n=int(input('請輸入文章號碼:(輸入0則結束)'))
-    if n==0:
-        break
-    soup, title, content, comment = get_post(n)
+        n = int(sys.argv[_index + 1])
+        soup, title, content, comment = get_post(n, session)
 
-    if title is None:
-        print('文章不存在或已被刪除')
-        continue
+        if title is None:
+            print('文章不存在或已被刪除')
+        else:
+            parse_post(soup, json_, n, title, content, comment)
+            print_post(title, content, comment, json_)
 
-    parse_post(soup, json_, content, comment)
-    print_post(title, content, comment, json_)
+    '''
+    ======================================================================
+    Main Program - Save Data
+    ======================================================================
+    '''
 
-'''
-==========================================================================
-Main Program - Single Post Mode
-==========================================================================
-'''
+    if '-o' in sys.argv or '--output' in sys.argv:
+        try:
+            path_index = sys.argv.index('-o') + 1
+        except ValueError:
+            path_index = sys.argv.index('--output') + 1
 
-if not INTERACTIVE:
-    if '-i' in sys.argv:
-        _index = sys.argv.index('-i')
+        OUTPUT_PATH = sys.argv[path_index]
     else:
-        _index = sys.argv.index('--index')
+        now = time.strftime('%b%d_%H%M_%Y', time.localtime())
+        OUTPUT_PATH = 'finfo_forum_' + now + '.json'
 
-    try:
-        int(sys.argv[_index + 1])
-    except ValueError:
-        print(f'參數錯誤（-i {sys.argv[_index + 1]}）：文章編號須為正整數')
-        sys.exit(1)
+    if len(json_['articles'])                \
+            and not ('-n' in sys.argv)       \
+            and not ('--nosave' in sys.argv):
+        with open(OUTPUT_PATH, 'w') as file:
+            json.dump(json_, file, indent=4, ensure_ascii=False)
 
-    n = str(sys.argv[_index + 1])
-    soup, title, content, comment = get_post(n)
-
-    if title is None:
-        print('文章不存在或已被刪除')
-    else:
-        parse_post(soup, json_, content, comment)
-        print_post(title, content, comment, json_)
 
-'''
-==========================================================================
-Main Program - Save Data
-==========================================================================
-'''
-
-if '-o' in sys.argv or '--output' in sys.argv:
-    try:
-        path_index = sys.argv.index('-o') + 1
-    except ValueError:
-        path_index = sys.argv.index('--output') + 1
-
-    OUTPUT_PATH = sys.argv[path_index]
-else:
-    now = time.strftime('%b%d_%H%M_%Y', time.localtime())
-    OUTPUT_PATH = 'finfo_forum_' + now + '.json'
-
-if len(json_['articles'])                \
-        and not ('-n' in sys.argv)       \
-        and not ('--nosave' in sys.argv):
-    with open(OUTPUT_PATH, 'w') as file:
-        json.dump(json_, file, indent=4, ensure_ascii=False)
+if __name__ == '__main__':
+    main()
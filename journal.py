@@ -0,0 +1,114 @@
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, TextIO
+
+import os
+import time
+
+
+class CrawlJournal:
+    '''Append-only record of what happened to every post index of a crawl.
+
+    Each line is "<unix time>\\t<state>\\t<index>[\\t<detail>]", except the
+    first one, which is "<unix time>\\tplan\\t<ranges>" and lists every
+    index the run is going to fetch, e.g. "1-20,25,30-41". The last state
+    of an index wins, so an index is pending until it has been inserted
+    or found deleted.
+    '''
+    PLAN: str = 'plan'
+    FETCHED: str = 'fetched'
+    INSERTED: str = 'inserted'
+    DELETED: str = 'deleted'  # 404, or the page says it has been deleted
+    FAILED: str = 'failed'  # given up after all retries
+
+    DONE = (INSERTED, DELETED)
+
+    def __init__(self, path: str):
+        self.path: Path = Path(path)
+        self._lock: Lock = Lock()
+        self._file: Optional[TextIO] = None
+
+    def pending(self) -> List[int]:
+        '''Indices planned by the last run but neither inserted nor found
+        deleted, i.e. what is left to do.
+        '''
+        planned: List[int] = []
+        states: Dict[int, str] = {}
+        try:
+            file = open(self.path, encoding='utf8')
+        except FileNotFoundError:
+            return []
+
+        with file:
+            for line in file:
+                fields: List[str] = line.rstrip('\n').split('\t')
+                if len(fields) < 3:  # torn write from a crash
+                    continue
+                if fields[1] == self.PLAN:
+                    planned = decode_ranges(fields[2])
+                    states = {}
+                elif fields[2].isdigit():
+                    states[int(fields[2])] = fields[1]
+
+        return [i for i in planned if states.get(i) not in self.DONE]
+
+    def start(self, indices: Iterable[int]):
+        '''Begin a new journal planned for indices, dropping the old one.'''
+        self.close()
+        tmp: Path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf8') as file:
+            file.write(f'{time.time():.0f}\t{self.PLAN}\t'
+                       f'{encode_ranges(indices)}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.path)
+        self._file = open(self.path, 'a', encoding='utf8')
+
+    def record(self, state: str, index: int, detail: str = ''):
+        line: str = f'{time.time():.0f}\t{state}\t{index}'
+        if detail:
+            line += '\t' + ' '.join(detail.split())  # keep it on one line
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def sync(self):
+        '''Make sure everything recorded so far survives a power loss.'''
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def encode_ranges(indices: Iterable[int]) -> str:
+    '''[1, 2, 3, 5, 7, 8] -> "1-3,5,7-8"'''
+    ranges: List[str] = []
+    start: Optional[int] = None
+    prev: Optional[int] = None
+    for i in sorted(set(indices)):
+        if prev is not None and i == prev + 1:
+            prev = i
+            continue
+        if start is not None:
+            ranges.append(str(start) if start == prev else f'{start}-{prev}')
+        start = prev = i
+    if start is not None:
+        ranges.append(str(start) if start == prev else f'{start}-{prev}')
+
+    return ','.join(ranges)
+
+
+def decode_ranges(text: str) -> List[int]:
+    '''"1-3,5,7-8" -> [1, 2, 3, 5, 7, 8]'''
+    indices: List[int] = []
+    for part in filter(None, text.split(',')):
+        first, _, last = part.partition('-')
+        indices += range(int(first), int(last or first) + 1)
+
+    return indices
@@ -0,0 +1,200 @@
+'''
+lxml backend of finfo_view.parse_page()
+
+Produces exactly what the BeautifulSoup backend in finfo_view produces,
+quirks included (e.g. "<b>粗<b>" for a bold text, or the text of comments
+kept in the content), only several times faster: the page is parsed by
+libxml2 and every lookup is a precompiled XPath.
+'''
+from html import escape
+from lxml import etree, html  # type: ignore
+from typing import List, Optional, Union
+
+
+def _has_class(name: str) -> str:
+    # same as class_=name in BeautifulSoup for a single class name
+    return (f"contains(concat(' ', normalize-space(@class), ' '), "
+            f"' {name} ')")
+
+
+def _is_class(value: str) -> str:
+    # same as class_=value in BeautifulSoup for several class names
+    return f"normalize-space(@class) = '{value}'"
+
+
+TITLE = etree.XPath(
+        f"//h1[{_is_class('mb-16-px display-2 display-1-sm')}]"
+        )
+CONTENT = etree.XPath(f"//div[{_has_class('post-content')}]")
+COMMENTS = etree.XPath(f"//div[{_has_class('comment-content')}]")
+META = etree.XPath(
+        f"//div[{_is_class('d-flex justify-content-start mb-24-px')}]"
+        )
+AUTHOR = etree.XPath(f".//span[{_has_class('font-weight-bold')}]")
+CLS_TIME = etree.XPath(f".//div[{_is_class('t6 text-gray-1')}]")
+DIVS = etree.XPath('.//div')
+ANCHOR = etree.XPath('.//a')
+TEXTS = etree.XPath('.//text()')  # comments excluded, like get_text()
+
+# serialized as <br/> etc. by BeautifulSoup
+VOID = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+        'keygen', 'link', 'menuitem', 'meta', 'param', 'source', 'track',
+        'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image',
+        'isindex', 'nextid', 'spacer'}
+
+ASCII_SPACES: dict = str.maketrans('', '', '\x20\x0a\x09\x0c\x0d')
+
+Node = Union[str, etree._Element]
+
+
+def string(text: str, owner) -> str:
+    '''text as BeautifulSoup stores it: a run of ASCII spaces becomes a
+    single newline (or space, if it has none), except within <pre> and
+    <textarea>. owner is the element the text is in.
+    '''
+    if text.translate(ASCII_SPACES) or owner.tag in ('pre', 'textarea') \
+            or next(owner.iterancestors('pre', 'textarea'), None) is not None:
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+def get_text(element, strip: bool = False) -> str:
+    texts: List[str] = []
+    for t in TEXTS(element):
+        owner = t.getparent()
+        if t.is_tail:
+            owner = owner.getparent()
+        texts.append(string(t, owner))
+
+    if strip:
+        return ''.join(t.strip() for t in texts if t.strip())
+    return ''.join(texts)
+
+
+def first(found: list):
+    return found[0] if found else None
+
+
+def children(element) -> List[Node]:
+    '''Child nodes in document order, text included, like Tag.children.'''
+    nodes: List[Node] = [string(element.text, element)] if element.text \
+        else []
+    for child in element:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(string(child.tail, element))
+    return nodes
+
+
+def following(element) -> Optional[Node]:
+    '''The node right after element in document order, like Tag.next.'''
+    if element.text:
+        return string(element.text, element)
+    if len(element):
+        return element[0]
+
+    while element is not None:  # the next node outside of element
+        if element.tail:
+            return string(element.tail, element.getparent())
+        if element.getnext() is not None:
+            return element.getnext()
+        element = element.getparent()
+    return None
+
+
+def to_str(node: Optional[Node]) -> str:
+    '''str() of the same node in BeautifulSoup.'''
+    if node is None:
+        return 'None'
+    if isinstance(node, str):
+        return node
+    if isinstance(node, etree._Comment):
+        return f'<!--{node.text or ""}-->'
+
+    attrs: str = ''
+    for k, v in node.attrib.items():
+        if k == 'class':  # a list in BeautifulSoup, joined back by a space
+            v = ' '.join(v.split())
+        attrs += f' {k}="{escape(v, False)}"'
+
+    if node.tag in VOID and not len(node) and not node.text:
+        return f'<{node.tag}{attrs}/>'
+    inner: str = ''.join(to_str(n) if not isinstance(n, str)
+                         else escape(n, False)
+                         for n in children(node))
+    return f'<{node.tag}{attrs}>{inner}</{node.tag}>'
+
+
+def parse_content(contents) -> str:  # contents: list of div elements
+    result: List[str] = []
+    for para in contents:
+        for node in children(para):
+            if isinstance(node, str):
+                result.append(node)
+            elif isinstance(node, etree._Comment):
+                result.append(node.text or '')
+            elif node.tag == 'br':
+                result.append('\n')
+            elif node.tag == 'a':
+                nxt: Optional[Node] = following(node)
+                if isinstance(nxt, etree._Element) and nxt.tag == 'img':
+                    result.append(f'\n<img>{nxt.get("src")}<img>\n')
+                else:  # a simple link anchor
+                    result.append(get_text(node))
+            elif isinstance(node.tag, str):  # other tag
+                result.append(
+                        f'<{node.tag}>{to_str(following(node))}<{node.tag}>'
+                        )
+
+    return ''.join(result)
+
+
+def user(element, identity: str) -> dict:
+    return {'userName': get_text(AUTHOR(element)[0]), 'identity': identity}
+
+
+def parse_page(index, page: str) -> Optional[dict]:
+    try:
+        root = html.document_fromstring(page)
+    except (etree.ParserError, ValueError):  # empty page
+        return None
+
+    title = first(TITLE(root))
+    if title is None:
+        return None
+
+    content = first(CONTENT(root))
+    comment: list = COMMENTS(root)
+    cls_time: str = get_text(first(CLS_TIME(root)), strip=True)
+
+    article: dict = {}
+    article['id'] = int(index)
+    article['title'] = get_text(title, strip=True)
+    # NOTE: "．" (i.e. chr(65294)) is not a dot (".")
+    article['class'] = cls_time.split('．')[0]
+    article['dateTime'] = cls_time.split('．')[1]
+    article['author'] = user(root, 'insurer')
+    article['content'] = parse_content(DIVS(content))
+
+    meta_comments: list = META(root)[1:]  # the first one is for article
+    replies: List[dict] = []
+    for i in range(len(comment)):
+        reply: dict = {}
+        reply['belongsTo'] = int(index)
+        reply['content'] = parse_content(DIVS(comment[i]))
+        flr_time: str = get_text(first(CLS_TIME(meta_comments[i])),
+                                 strip=True)
+        reply['floor'] = int(flr_time.split('．')[0].lstrip('B'))
+        reply['dateTime'] = flr_time.split('．')[1]
+
+        anchor = first(ANCHOR(meta_comments[i]))
+        if anchor is not None:  # salesman, linked to a consultation
+            reply['author'] = user(meta_comments[i], 'salesman')
+            reply['id'] = anchor.get('href').split('=')[1]
+        else:
+            reply['author'] = user(meta_comments[i], 'insurer')
+            reply['id'] = None
+        replies.append(reply)
+
+    article['replies'] = replies
+    return article
@@ -0,0 +1,194 @@
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, Thread, Event
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import bisect
+import json
+import sys
+import threading
+import time
+
+
+# upper bounds of the buckets, seconds for timings and items for depths
+SECONDS: List[float] = [0.0005 * 2 ** i for i in range(18)]  # 0.5 ms-65 s
+ITEMS: List[float] = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000,
+                      5000, 10000]
+
+
+class Histogram:
+    '''Counts of values per bucket, like a Prometheus histogram, but not
+    cumulative until exported.
+    '''
+    def __init__(self, bounds: List[float]):
+        self.bounds: List[float] = bounds
+        self.counts: List[int] = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.count: int = 0
+        self.sum: float = 0
+        self.max: float = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        '''Upper bound of the bucket the q-quantile falls in.'''
+        if not self.count:
+            return 0
+        rank: float = q * self.count
+        seen: int = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else 0,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': self.max}
+
+
+class Metrics:
+    '''Histograms of every pipeline stage, shared by all threads.
+
+    Names are the stage and what is measured, e.g. fetch_ttfb_seconds
+    or queue_posts; the ones ending with _seconds are timings.
+    '''
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Counter = Counter()
+        self.started: float = time.monotonic()
+        self._lock: Lock = Lock()
+
+    def observe(self, name: str, value: float):
+        bounds: List[float] = SECONDS if name.endswith('_seconds') else ITEMS
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(bounds)
+            self.histograms[name].observe(value)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            return {'elapsed_seconds': time.monotonic() - self.started,
+                    'counters': dict(self.counters),
+                    'histograms': {name: h.summary() for name, h
+                                   in sorted(self.histograms.items())}}
+
+    def to_prometheus(self) -> str:
+        '''The text exposition format, for the textfile collector of
+        node_exporter.
+        '''
+        lines: List[str] = []
+        with self._lock:
+            for name, n in sorted(self.counters.items()):
+                lines.append(f'# TYPE finfo_{name}_total counter')
+                lines.append(f'finfo_{name}_total {n}')
+            for name, h in sorted(self.histograms.items()):
+                lines.append(f'# TYPE finfo_{name} histogram')
+                cumulative: int = 0
+                for bound, count in zip(h.bounds, h.counts):
+                    cumulative += count
+                    lines.append(f'finfo_{name}_bucket{{le="{bound:g}"}} '
+                                 f'{cumulative}')
+                lines.append(f'finfo_{name}_bucket{{le="+Inf"}} {h.count}')
+                lines.append(f'finfo_{name}_sum {h.sum:.6f}')
+                lines.append(f'finfo_{name}_count {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self) -> str:
+        '''One line per histogram, for the end of a run.'''
+        lines: List[str] = []
+        for name, s in self.to_json()['histograms'].items():
+            if name.endswith('_seconds'):
+                lines.append(f'{name:<24} n={s["count"]:<7} '
+                             f'p50={s["p50"] * 1000:.1f}ms '
+                             f'p99={s["p99"] * 1000:.1f}ms '
+                             f'max={s["max"] * 1000:.1f}ms')
+            else:
+                lines.append(f'{name:<24} n={s["count"]:<7} '
+                             f'p50={s["p50"]:g} p99={s["p99"]:g} '
+                             f'max={s["max"]:g}')
+        return '\n'.join(lines)
+
+    def write(self, json_path: Optional[str], prom_path: Optional[str]):
+        if json_path:
+            with open(json_path, 'w', encoding='utf8') as file:
+                json.dump(self.to_json(), file, indent=2)
+        if prom_path:
+            with open(prom_path, 'w', encoding='utf8') as file:
+                file.write(self.to_prometheus())
+
+
+class SamplingProfiler(Thread):
+    '''Samples the stack of every thread every interval seconds.
+
+    Unlike cProfile, it sees all the threads at once and costs the same
+    however hot the code is. The samples are written as collapsed stacks
+    (one "frame;frame;... count" line per stack), which flamegraph.pl and
+    speedscope read.
+    '''
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.interval: float = interval
+        self.stacks: Counter = Counter()
+        self._stop_event: Event = Event()
+
+    def run(self):
+        me: int = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names: Dict[int, str] = {t.ident: t.name
+                                     for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} '
+                                 f'({code.co_filename}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf8') as file:
+            for stack, n in self.stacks.most_common():
+                file.write(f'{stack} {n}\n')
+
+    def top(self, n: int = 15) -> List[Tuple[str, float]]:
+        '''Functions most often on top of the stack, with their share of
+        the samples, waiting (e.g. for a socket) included.
+        '''
+        total: int = sum(self.stacks.values())
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return [(name, count / total) for name, count
+                in leaves.most_common(n)] if total else []
+
+
+# shared by every stage of update.py
+METRICS: Metrics = Metrics()
@@ -0,0 +1,6 @@
+-- Tombstones of deleted posts, see missing_posts in schema.sql
+-- $ mariadb finfo < migrations/001_missing_posts.sql
+CREATE TABLE IF NOT EXISTS missing_posts (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  checked_at DATETIME NOT NULL  -- last time we saw it missing
+) ENGINE = InnoDB;
@@ -0,0 +1,12 @@
+-- Refresh schedule of stored posts, see post_refresh in schema.sql
+-- $ mariadb finfo < migrations/002_post_refresh.sql
+CREATE TABLE IF NOT EXISTS post_refresh (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  last_position SMALLINT UNSIGNED NOT NULL,  -- highest position stored
+  replies SMALLINT UNSIGNED NOT NULL,
+  created DATETIME NOT NULL,
+  last_activity DATETIME NOT NULL,  -- time of the latest reply
+  checked_at DATETIME NOT NULL,
+  next_check DATETIME NOT NULL,
+  KEY idx_next_check (next_check)
+) ENGINE = InnoDB;
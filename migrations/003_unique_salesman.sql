@@ -0,0 +1,22 @@
+-- Salesmen unique by name, see users in schema.sql
+-- $ mariadb finfo < migrations/003_unique_salesman.sql
+
+-- Merge salesmen inserted more than once into the one with the lowest id
+UPDATE posts p
+  JOIN users u ON u.id = p.author_id
+  JOIN (SELECT name, MIN(id) AS keep_id
+        FROM users WHERE NOT insurer_or_salesman
+        GROUP BY name HAVING COUNT(*) > 1) d ON d.name = u.name
+SET p.author_id = d.keep_id
+WHERE NOT u.insurer_or_salesman AND u.id <> d.keep_id;
+
+DELETE u FROM users u
+  JOIN (SELECT name, MIN(id) AS keep_id
+        FROM users WHERE NOT insurer_or_salesman
+        GROUP BY name) d ON d.name = u.name
+WHERE NOT u.insurer_or_salesman AND u.id <> d.keep_id;
+
+ALTER TABLE users
+  ADD COLUMN salesman_name VARCHAR(30)
+    AS (IF(insurer_or_salesman, NULL, name)) PERSISTENT,
+  ADD UNIQUE KEY uq_salesman_name (salesman_name);
@@ -0,0 +1,3 @@
+-- Index for MAX(post_id) and lookups by post, see posts in schema.sql
+-- $ mariadb finfo < migrations/004_posts_post_id_index.sql
+ALTER TABLE posts ADD KEY idx_post_id (post_id);
@@ -0,0 +1,29 @@
+-- Summary tables for the dashboard, see aggregates.py and schema.sql
+-- $ mariadb finfo < migrations/005_aggregates.sql
+-- then fill them once from posts:
+-- $ python aggregates.py --rebuild
+CREATE TABLE IF NOT EXISTS daily_topic_posts (
+  day DATE NOT NULL,
+  topic_id TINYINT UNSIGNED NOT NULL,  -- 0 if the post has none
+  posts INT UNSIGNED NOT NULL,  -- original posts
+  replies INT UNSIGNED NOT NULL,
+  PRIMARY KEY (day, topic_id)
+) ENGINE = InnoDB;
+
+CREATE TABLE IF NOT EXISTS post_stats (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  topic_id TINYINT UNSIGNED,
+  created DATETIME,
+  replies SMALLINT UNSIGNED NOT NULL,
+  salesman_replies SMALLINT UNSIGNED NOT NULL,
+  last_reply DATETIME,
+  first_salesman_reply DATETIME,  -- minus created: time to first answer
+  KEY idx_created (created)
+) ENGINE = InnoDB;
+
+CREATE TABLE IF NOT EXISTS salesman_activity (
+  user_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- users.id of the salesman
+  replies INT UNSIGNED NOT NULL,
+  first_reply DATETIME NOT NULL,
+  last_reply DATETIME NOT NULL
+) ENGINE = InnoDB;
@@ -0,0 +1,21 @@
+-- Indexes for the lookups on posts and users, see schema.sql
+-- $ mariadb finfo < migrations/006_posts_indexes.sql
+-- then, if any duplicate was deleted, fill the summary tables again:
+-- $ python aggregates.py --rebuild
+
+-- Rows inserted more than once (e.g. a batch written again after a crash)
+-- keep the one with the lowest id
+DELETE p FROM posts p
+  JOIN posts q ON q.post_id = p.post_id AND q.position = p.position
+WHERE q.id < p.id;
+
+-- uq_post_position also serves what idx_post_id did, and idx_topic_time
+-- the foreign key on topic_id, which had an index of its own
+ALTER TABLE posts
+  DROP KEY IF EXISTS idx_post_id,
+  ADD UNIQUE KEY uq_post_position (post_id, position),
+  ADD KEY idx_create_time (create_time),
+  ADD KEY idx_topic_time (topic_id, create_time),
+  DROP KEY IF EXISTS fk_post_topic;
+
+ALTER TABLE users ADD KEY idx_name (name);
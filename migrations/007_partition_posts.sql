@@ -0,0 +1,37 @@
+-- Optional: partition posts by quarter of create_time, so queries on a
+-- range of time (the dashboard, export.py) only read the partitions in it.
+-- $ mariadb finfo < migrations/007_partition_posts.sql
+--
+-- Run it after 006, or on a database made from schema.sql. It costs:
+--   * the foreign keys of posts, partitioned InnoDB tables have none, so
+--     deleting a user no longer sets author_id to NULL, nor deleting a
+--     topic topic_id, if 010 has not moved it to threads yet (their
+--     indexes stay)
+--   * create_time in every unique key: the primary key becomes
+--     (id, create_time) and uq_post_position (post_id, position,
+--     create_time). A reply has one create_time, so inserting it again is
+--     still ignored.
+-- Add a partition before pmax each quarter, e.g.
+-- $ mariadb finfo -e "ALTER TABLE posts REORGANIZE PARTITION pmax INTO
+--     (PARTITION p2023q1 VALUES LESS THAN ('2023-04-01'),
+--      PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+ALTER TABLE posts
+  DROP FOREIGN KEY IF EXISTS fk_post_author,
+  DROP FOREIGN KEY IF EXISTS fk_post_topic;  -- gone after 010
+
+ALTER TABLE posts
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (id, create_time),
+  DROP KEY uq_post_position,
+  ADD UNIQUE KEY uq_post_position (post_id, position, create_time)
+PARTITION BY RANGE COLUMNS (create_time) (
+  PARTITION p2021q1 VALUES LESS THAN ('2021-04-01'),
+  PARTITION p2021q2 VALUES LESS THAN ('2021-07-01'),
+  PARTITION p2021q3 VALUES LESS THAN ('2021-10-01'),
+  PARTITION p2021q4 VALUES LESS THAN ('2022-01-01'),
+  PARTITION p2022q1 VALUES LESS THAN ('2022-04-01'),
+  PARTITION p2022q2 VALUES LESS THAN ('2022-07-01'),
+  PARTITION p2022q3 VALUES LESS THAN ('2022-10-01'),
+  PARTITION p2022q4 VALUES LESS THAN ('2023-01-01'),
+  PARTITION pmax VALUES LESS THAN (MAXVALUE)
+);
@@ -0,0 +1,18 @@
+-- Work queue of update.py --worker, see work_queue.py and schema.sql
+-- $ mariadb finfo < migrations/008_crawl_chunks.sql
+CREATE TABLE IF NOT EXISTS crawl_chunks (
+  id INT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+  first_index INT UNSIGNED NOT NULL,
+  last_index INT UNSIGNED NOT NULL,
+  state ENUM('pending', 'leased', 'done') NOT NULL DEFAULT 'pending',
+  worker VARCHAR(100),  -- host:pid of the last worker to claim it
+  lease CHAR(32),  -- token of the current lease
+  lease_expires DATETIME,
+  heartbeats INT UNSIGNED NOT NULL DEFAULT 0,
+  attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+  failed INT UNSIGNED NOT NULL DEFAULT 0,  -- posts given up on
+  done_at DATETIME,
+  UNIQUE KEY uq_first_index (first_index),
+  UNIQUE KEY uq_lease (lease),
+  KEY idx_state (state, first_index)
+) ENGINE = InnoDB;
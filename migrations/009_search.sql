@@ -0,0 +1,16 @@
+-- Search index, see search.py and schema.sql
+-- $ mariadb finfo < migrations/009_search.sql
+-- then index the posts already stored:
+-- $ python search.py --rebuild
+CREATE TABLE IF NOT EXISTS search_terms (
+  term VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL PRIMARY KEY,
+  df INT UNSIGNED NOT NULL  -- rows containing it, all rows for ''
+) ENGINE = InnoDB;
+
+CREATE TABLE IF NOT EXISTS search_postings (
+  term VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  post_id INT UNSIGNED NOT NULL,  -- post id of finfo.tw
+  position SMALLINT UNSIGNED NOT NULL,
+  tf SMALLINT UNSIGNED NOT NULL,  -- times the term occurs in the row
+  PRIMARY KEY (term, post_id, position)
+) ENGINE = InnoDB;
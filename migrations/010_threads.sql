@@ -0,0 +1,28 @@
+-- Title and topic stored once per post in threads, instead of on every
+-- reply in posts. See schema.sql.
+-- $ mariadb finfo < migrations/010_threads.sql
+CREATE TABLE IF NOT EXISTS threads (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  title VARCHAR(100) NOT NULL,
+  topic_id TINYINT UNSIGNED,
+  created DATETIME NOT NULL,  -- create_time of the original post
+  KEY idx_topic_created (topic_id, created),
+  CONSTRAINT `fk_thread_topic`
+    FOREIGN KEY (topic_id) REFERENCES topics (id)
+    ON DELETE SET NULL
+    ON UPDATE RESTRICT
+) ENGINE = InnoDB;
+
+INSERT IGNORE INTO threads (post_id, title, topic_id, created)
+  SELECT post_id, title, topic_id, create_time FROM posts WHERE position = 0;
+
+-- posts whose original post is not stored, replies only
+INSERT IGNORE INTO threads (post_id, title, topic_id, created)
+  SELECT post_id, MIN(title), MIN(topic_id), MIN(create_time)
+  FROM posts GROUP BY post_id;
+
+ALTER TABLE posts
+  DROP FOREIGN KEY IF EXISTS fk_post_topic,
+  DROP KEY IF EXISTS idx_topic_time,
+  DROP COLUMN title,
+  DROP COLUMN topic_id;
@@ -0,0 +1,8 @@
+-- Ranges of update.py --worker left failed after max_attempts claims, and
+-- a backoff before a range given back with failed posts is claimed again.
+-- See work_queue.py and schema.sql.
+-- $ mariadb finfo < migrations/011_crawl_chunks_backoff.sql
+ALTER TABLE crawl_chunks
+  MODIFY state ENUM('pending', 'leased', 'done', 'failed')
+    NOT NULL DEFAULT 'pending',
+  ADD COLUMN IF NOT EXISTS not_before DATETIME AFTER done_at;
@@ -0,0 +1,132 @@
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import hashlib
+import os
+import time
+import zlib
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # zstandard is optional, zlib is used instead
+    zstandard = None
+
+
+# segment, offset, length of a compressed page
+Location = Tuple[str, int, int]
+
+
+class PageCache:
+    '''Content-addressed, compressed store of raw post pages.
+
+    Layout of the cache directory:
+        index.tsv          post_id, fetched_at, sha1, segment, offset, length
+        seg-000001.zst     compressed pages, one after another
+    Every fetch appends a line to index.tsv, but a page is only written
+    once per sha1, so refetching an unchanged post costs a line. Each page
+    is compressed on its own, so it can be read without its neighbours.
+    Segments are .zst with zstandard, or .zz (zlib) without it.
+    '''
+    INDEX: str = 'index.tsv'
+
+    def __init__(self, root: str, segment_size: int = 256 * 2**20):
+        self.root: Path = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_size: int = segment_size
+        self.suffix: str = '.zst' if zstandard is not None else '.zz'
+        self._lock: Lock = Lock()
+
+        self.latest: Dict[int, Tuple[float, str]] = {}  # id -> time, sha1
+        self.blobs: Dict[str, Location] = {}  # sha1 -> where the page is
+        self._load()
+
+        segments: List[Path] = sorted(self.root.glob('seg-*' + self.suffix))
+        self._segment: Path = (segments[-1] if segments
+                               else self._segment_path(1))
+
+    def _load(self):
+        try:
+            file = open(self.root / self.INDEX, encoding='utf8')
+        except FileNotFoundError:
+            return
+
+        with file:
+            for line in file:
+                fields: List[str] = line.rstrip('\n').split('\t')
+                if len(fields) != 6:  # torn write from a crash
+                    continue
+                post_id, fetched_at, sha1, segment, offset, length = fields
+                self.latest[int(post_id)] = (float(fetched_at), sha1)
+                self.blobs[sha1] = (segment, int(offset), int(length))
+
+    def _segment_path(self, n: int) -> Path:
+        return self.root / f'seg-{n:06d}{self.suffix}'
+
+    def __contains__(self, post_id: int) -> bool:
+        return post_id in self.latest
+
+    def __len__(self) -> int:
+        return len(self.latest)
+
+    def put(self, post_id: int, page: str):
+        '''Store the page just fetched for post_id.'''
+        data: bytes = page.encode('utf8')
+        sha1: str = hashlib.sha1(data).hexdigest()
+        fetched_at: float = time.time()
+
+        with self._lock:
+            if sha1 not in self.blobs:
+                blob: bytes = compress(data)
+                if self._segment.exists() \
+                        and self._segment.stat().st_size >= self.segment_size:
+                    n: int = int(self._segment.stem.split('-')[1])
+                    self._segment = self._segment_path(n + 1)
+                with open(self._segment, 'ab') as file:
+                    offset: int = file.tell()
+                    file.write(blob)
+                self.blobs[sha1] = (self._segment.name, offset, len(blob))
+
+            segment, offset, length = self.blobs[sha1]
+            with open(self.root / self.INDEX, 'a', encoding='utf8') as file:
+                file.write(f'{post_id}\t{fetched_at:.0f}\t{sha1}\t'
+                           f'{segment}\t{offset}\t{length}\n')
+            self.latest[post_id] = (fetched_at, sha1)
+
+    def get(self, post_id: int) -> Optional[str]:
+        '''The latest page stored for post_id, None if there is none.'''
+        if post_id not in self.latest:
+            return None
+        return self._read(self.blobs[self.latest[post_id][1]])
+
+    def _read(self, location: Location) -> str:
+        segment, offset, length = location
+        with open(self.root / segment, 'rb') as file:
+            file.seek(offset)
+            blob: bytes = file.read(length)
+        return decompress(blob, segment).decode('utf8')
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        '''(post_id, latest page) of every cached post, in storage order
+        so the segments are read sequentially.
+        '''
+        located: List[Tuple[Location, int]] = sorted(
+                (self.blobs[sha1], post_id)
+                for post_id, (_, sha1) in self.latest.items()
+                )
+        for location, post_id in located:
+            yield post_id, self._read(location)
+
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(blob: bytes, segment: str) -> bytes:
+    if os.path.splitext(segment)[1] == '.zst':
+        if zstandard is None:
+            raise RuntimeError(f'{segment} needs zstandard to be read')
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
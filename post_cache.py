@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from page_cache import PageCache
+from queue import Queue
+from threading import Lock, Thread, local
+from typing import Callable, Dict, List, Optional
+
+import requests
+import sys
+import time
+
+
+Fetch = Callable[[int, requests.Session], str]
+
+
+class PostCache:
+    '''Pages of the posts viewed lately, and of their neighbours, fetched
+    ahead of time, for the interactive mode of finfo_view.py.
+
+    At most max_entries pages taking max_bytes of memory are kept, the
+    least recently used dropped first. After every get(index), the posts
+    index ± 1 to prefetch are fetched by workers threads, so browsing to
+    the next or previous post costs no wait. With disk, pages fetched there
+    less than max_age seconds ago are read from it instead of finfo.tw,
+    across runs; fetch is expected to store them (get_page() does with
+    use_cache()).
+
+    The threads are daemons, a prefetch still waiting for finfo.tw (with no
+    TIMEOUT) does not keep the process from exiting; close() drops the
+    prefetches not started yet.
+    '''
+    def __init__(self,
+                 fetch: Fetch,
+                 max_entries: int = 200,
+                 max_bytes: int = 32 * 2**20,
+                 prefetch: int = 2,
+                 workers: int = 2,
+                 disk: Optional[PageCache] = None,
+                 max_age: float = 3600):
+        self.fetch: Fetch = fetch
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.prefetch: int = prefetch  # neighbours on each side
+        self.disk: Optional[PageCache] = disk
+        self.max_age: float = max_age  # seconds
+        self.bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self._pages: 'OrderedDict[int, str]' = OrderedDict()
+        self._pending: Dict[int, Future] = {}  # being prefetched
+        self._lock: Lock = Lock()
+        self._local: local = local()  # a keep-alive session per thread
+        self._jobs: Queue = Queue()  # post ids to prefetch, None to stop
+        self._workers: List[Thread] = [
+                Thread(target=self._work, daemon=True)
+                for _ in range(workers if prefetch else 0)]
+        for worker in self._workers:
+            worker.start()
+
+    def get(self, index: int) -> str:
+        '''The page of post index, then prefetch its neighbours.'''
+        with self._lock:
+            page: Optional[str] = self._pages.get(index)
+            if page is not None:
+                self._pages.move_to_end(index)
+            future: Optional[Future] = self._pending.get(index)
+
+        if page is None and future is not None:
+            # on its way already, wait for it instead of asking again
+            try:
+                page = future.result()
+            except requests.RequestException:
+                page = None
+        if page is None:
+            self.misses += 1
+            page = self._load(index)
+        else:
+            self.hits += 1
+
+        self._prefetch_around(index)
+        return page
+
+    def _load(self, index: int) -> str:
+        page: Optional[str] = None
+        if self.disk is not None and index in self.disk \
+                and time.time() - self.disk.latest[index][0] < self.max_age:
+            page = self.disk.get(index)
+        if page is None:
+            if not hasattr(self._local, 'session'):
+                self._local.session = requests.Session()
+            page = self.fetch(index, self._local.session)
+        self._keep(index, page)
+        return page
+
+    def _keep(self, index: int, page: str):
+        size: int = sys.getsizeof(page)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if index in self._pages:
+                self.bytes -= sys.getsizeof(self._pages.pop(index))
+            self._pages[index] = page
+            self.bytes += size
+            while len(self._pages) > self.max_entries \
+                    or self.bytes > self.max_bytes:
+                _, dropped = self._pages.popitem(last=False)
+                self.bytes -= sys.getsizeof(dropped)
+
+    def _prefetch_around(self, index: int):
+        if not self._workers:
+            return
+        for distance in range(1, self.prefetch + 1):
+            for neighbour in (index + distance, index - distance):
+                with self._lock:
+                    if neighbour < 1 or neighbour in self._pages \
+                            or neighbour in self._pending:
+                        continue
+                    future: Future = Future()
+                    self._pending[neighbour] = future
+                future.add_done_callback(
+                        lambda _, i=neighbour: self._done(i))
+                self._jobs.put(neighbour)
+
+    def _work(self):
+        while (index := self._jobs.get()) is not None:
+            with self._lock:
+                future: Optional[Future] = self._pending.get(index)
+            if future is None or not future.set_running_or_notify_cancel():
+                continue  # cancelled by close()
+            try:
+                future.set_result(self._load(index))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _done(self, index: int):
+        with self._lock:
+            self._pending.pop(index, None)
+
+    def report(self) -> str:
+        return (f'快取命中 {self.hits} 次，未命中 {self.misses} 次，'
+                f'保留 {len(self._pages)} 篇（{self.bytes / 2**20:.1f} MiB）')
+
+    def close(self):
+        '''Stop prefetching; fetches under way are not waited for.'''
+        with self._lock:
+            queued: List[Future] = list(self._pending.values())
+        for future in queued:  # outside the lock, as callbacks take it
+            future.cancel()
+        for _ in self._workers:
+            self._jobs.put(None)
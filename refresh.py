@@ -0,0 +1,109 @@
+from datetime import datetime
+from db import Database
+from typing import Dict, List, Tuple
+
+
+# hot posts are revisited hourly, cold ones monthly
+MIN_INTERVAL: float = 1  # hours
+MAX_INTERVAL: float = 30 * 24  # hours
+
+# post_id, last_position, replies, created, last_activity
+RefreshState = Tuple[int, int, int, datetime, datetime]
+
+
+def refresh_interval(created: datetime,
+                     last_activity: datetime,
+                     replies: int,
+                     now: datetime) -> float:
+    '''Hours to wait before visiting a post again.
+
+    A post is due again after about a quarter of the time it has been idle,
+    shortened further by how many replies it gets per day, so a thread that
+    is still being discussed is checked hourly while one that went quiet
+    months ago is checked once a month.
+    '''
+    idle: float = max((now - last_activity).total_seconds() / 3600, 0)
+    age_days: float = max((now - created).total_seconds() / 86400, 1)
+    velocity: float = replies / age_days  # replies per day
+
+    hours: float = idle / 4 / (1 + velocity)
+    return min(max(hours, MIN_INTERVAL), MAX_INTERVAL)
+
+
+class RefreshPlanner:
+    '''Decides which stored posts to fetch again for new replies.
+
+    The state of every post lives in post_refresh: the highest position we
+    have, when it was created and last replied, and when it is due next.
+    '''
+    def __init__(self, database: Database):
+        self.db: Database = database
+
+    def seed(self):
+        '''Add stored posts missing from post_refresh to it, but those
+        known deleted. Not only those above the newest one there: --resume,
+        --worker ranges finishing out of order and revived tombstones
+        store posts below it.
+        '''
+        self.db.cur.execute(
+                'INSERT IGNORE INTO post_refresh '
+                '(post_id, last_position, replies, created, last_activity, '
+                'checked_at, next_check) '
+                'SELECT p.post_id, MAX(p.position), COUNT(*) - 1, '
+                'MIN(p.create_time), MAX(p.create_time), NOW(), NOW() '
+                'FROM posts p '
+                'LEFT JOIN post_refresh r ON r.post_id = p.post_id '
+                'LEFT JOIN missing_posts m ON m.post_id = p.post_id '
+                'WHERE r.post_id IS NULL AND m.post_id IS NULL '
+                'GROUP BY p.post_id'
+                )
+
+    def due(self, budget: int) -> Dict[int, int]:
+        '''At most budget posts whose check is overdue, most overdue first,
+        mapped to the highest position already stored.
+        '''
+        self.db.cur.execute('SELECT post_id, last_position '
+                            'FROM post_refresh WHERE next_check <= NOW() '
+                            'ORDER BY next_check LIMIT ?', (budget,))
+        return {r[0]: r[1] for r in self.db.cur.fetchall()}
+
+    def schedule(self, states: List[RefreshState]):
+        '''Store what a visit has found and when to come back.'''
+        now: datetime = datetime.now()
+        rows: List[tuple] = []
+        for post_id, last_position, replies, created, last_activity in states:
+            hours: float = refresh_interval(created, last_activity,
+                                            replies, now)
+            rows.append((last_position, replies, last_activity,
+                         hours * 3600, post_id))
+
+        self.db.cur.executemany(
+                'UPDATE post_refresh SET last_position = ?, replies = ?, '
+                'last_activity = ?, checked_at = NOW(), '
+                'next_check = NOW() + INTERVAL ? SECOND '
+                'WHERE post_id = ?', rows
+                )
+
+    def touch(self, post_ids: List[int]):
+        '''Reschedule posts found unchanged, from what is already known.'''
+        if not post_ids:
+            return
+        marks: str = ', '.join('?' * len(post_ids))
+        self.db.cur.execute('SELECT post_id, last_position, replies, '
+                            'created, last_activity FROM post_refresh '
+                            f'WHERE post_id IN ({marks})', tuple(post_ids))
+        self.schedule([tuple(r) for r in self.db.cur.fetchall()])
+
+    def expedite(self, post_ids: List[int]):
+        '''Make posts seen active on the listing due at once, ahead of
+        those only overdue by their schedule.
+        '''
+        self.db.cur.executemany('UPDATE post_refresh '
+                                'SET next_check = LEAST(next_check, '
+                                'checked_at) WHERE post_id = ?',
+                                [(i,) for i in post_ids])
+
+    def forget(self, post_ids: List[int]):
+        '''Stop visiting posts which have been deleted.'''
+        self.db.cur.executemany('DELETE FROM post_refresh WHERE post_id = ?',
+                                [(i,) for i in post_ids])
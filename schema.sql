@@ -1,7 +1,16 @@
 DROP TABLE IF EXISTS posts;
+DROP TABLE IF EXISTS threads;
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS topics;
 DROP TABLE IF EXISTS regions;
+DROP TABLE IF EXISTS missing_posts;
+DROP TABLE IF EXISTS post_refresh;
+DROP TABLE IF EXISTS daily_topic_posts;
+DROP TABLE IF EXISTS post_stats;
+DROP TABLE IF EXISTS salesman_activity;
+DROP TABLE IF EXISTS crawl_chunks;
+DROP TABLE IF EXISTS search_terms;
+DROP TABLE IF EXISTS search_postings;
 
 -- Do we need a table referencing picture urls?
 
@@ -22,28 +31,125 @@ CREATE TABLE users (
   insurer_or_salesman BOOLEAN,  -- true: insurer, false: salesman
   sex BOOLEAN,  -- true if male, false if female
   region_id TINYINT UNSIGNED,
+  -- salesmen are unique by name, insurers' names are masked so they are not
+  salesman_name VARCHAR(30)
+    AS (IF(insurer_or_salesman, NULL, name)) PERSISTENT,
+  UNIQUE KEY uq_salesman_name (salesman_name),
+  KEY idx_name (name),
   CONSTRAINT `fk_user_region`
     FOREIGN KEY (region_id) REFERENCES regions (id)
 ) ENGINE = InnoDB;
 
+-- What the original post and its replies share, stored once per post
+CREATE TABLE threads (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  title VARCHAR(100) NOT NULL,
+  topic_id TINYINT UNSIGNED,
+  created DATETIME NOT NULL,  -- create_time of the original post
+  KEY idx_topic_created (topic_id, created),
+  CONSTRAINT `fk_thread_topic`
+    FOREIGN KEY (topic_id) REFERENCES topics (id)
+    ON DELETE SET NULL
+    ON UPDATE RESTRICT
+) ENGINE = InnoDB;
+
 CREATE TABLE posts (
   id INT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT, 
-  post_id INT UNSIGNED NOT NULL, -- post id of finfo.tw
-  title VARCHAR(100) NOT NULL, 
+  post_id INT UNSIGNED NOT NULL, -- post id of finfo.tw, see threads
   position SMALLINT UNSIGNED NOT NULL,  -- 0: main, others: reply
   create_time DATETIME NOT NULL,
   author_id INT UNSIGNED,
-  topic_id TINYINT UNSIGNED,
   content TEXT,
+  -- a reply is stored once however often it is inserted, and the key
+  -- serves lookups by post_id and MAX(post_id) as well
+  UNIQUE KEY uq_post_position (post_id, position),
+  KEY idx_create_time (create_time),
   CONSTRAINT `fk_post_author`
     FOREIGN KEY (author_id) REFERENCES users (id)
     ON DELETE SET NULL
-    ON UPDATE RESTRICT,
-  CONSTRAINT `fk_post_topic`
-    FOREIGN KEY (topic_id) REFERENCES topics (id)
-    ON DELETE SET NULL
     ON UPDATE RESTRICT
 ) ENGINE = InnoDB;
+-- To partition posts by create_time, see migrations/007_partition_posts.sql
+
+-- Posts found deleted (or never existed), so updates stop fetching them
+CREATE TABLE missing_posts (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  checked_at DATETIME NOT NULL  -- last time we saw it missing
+) ENGINE = InnoDB;
+
+-- When to revisit a stored post for new replies, see refresh.py
+CREATE TABLE post_refresh (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  last_position SMALLINT UNSIGNED NOT NULL,  -- highest position stored
+  replies SMALLINT UNSIGNED NOT NULL,
+  created DATETIME NOT NULL,
+  last_activity DATETIME NOT NULL,  -- time of the latest reply
+  checked_at DATETIME NOT NULL,
+  next_check DATETIME NOT NULL,
+  KEY idx_next_check (next_check)
+) ENGINE = InnoDB;
+
+-- Summary tables for the dashboard, updated with every batch inserted,
+-- see aggregates.py
+CREATE TABLE daily_topic_posts (
+  day DATE NOT NULL,
+  topic_id TINYINT UNSIGNED NOT NULL,  -- 0 if the post has none
+  posts INT UNSIGNED NOT NULL,  -- original posts
+  replies INT UNSIGNED NOT NULL,
+  PRIMARY KEY (day, topic_id)
+) ENGINE = InnoDB;
+
+CREATE TABLE post_stats (
+  post_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- post id of finfo.tw
+  topic_id TINYINT UNSIGNED,
+  created DATETIME,
+  replies SMALLINT UNSIGNED NOT NULL,
+  salesman_replies SMALLINT UNSIGNED NOT NULL,
+  last_reply DATETIME,
+  first_salesman_reply DATETIME,  -- minus created: time to first answer
+  KEY idx_created (created)
+) ENGINE = InnoDB;
+
+CREATE TABLE salesman_activity (
+  user_id INT UNSIGNED NOT NULL PRIMARY KEY,  -- users.id of the salesman
+  replies INT UNSIGNED NOT NULL,
+  first_reply DATETIME NOT NULL,
+  last_reply DATETIME NOT NULL
+) ENGINE = InnoDB;
+
+-- Ranges of post indices for update.py --worker, see work_queue.py
+CREATE TABLE crawl_chunks (
+  id INT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+  first_index INT UNSIGNED NOT NULL,
+  last_index INT UNSIGNED NOT NULL,
+  state ENUM('pending', 'leased', 'done', 'failed')
+    NOT NULL DEFAULT 'pending',
+  worker VARCHAR(100),  -- host:pid of the last worker to claim it
+  lease CHAR(32),  -- token of the current lease
+  lease_expires DATETIME,
+  heartbeats INT UNSIGNED NOT NULL DEFAULT 0,
+  attempts SMALLINT UNSIGNED NOT NULL DEFAULT 0,
+  failed INT UNSIGNED NOT NULL DEFAULT 0,  -- posts given up on
+  done_at DATETIME,
+  not_before DATETIME,  -- given back with failed posts, claimed after it
+  UNIQUE KEY uq_first_index (first_index),
+  UNIQUE KEY uq_lease (lease),
+  KEY idx_state (state, first_index)
+) ENGINE = InnoDB;
+
+-- Inverted index of character bigrams for search.py
+CREATE TABLE search_terms (
+  term VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL PRIMARY KEY,
+  df INT UNSIGNED NOT NULL  -- rows containing it, all rows for ''
+) ENGINE = InnoDB;
+
+CREATE TABLE search_postings (
+  term VARCHAR(20) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+  post_id INT UNSIGNED NOT NULL,  -- post id of finfo.tw
+  position SMALLINT UNSIGNED NOT NULL,
+  tf SMALLINT UNSIGNED NOT NULL,  -- times the term occurs in the row
+  PRIMARY KEY (term, post_id, position)
+) ENGINE = InnoDB;
 
 -- These tables are never be changed
 INSERT INTO topics (name)
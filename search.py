@@ -0,0 +1,218 @@
+#! /usr/bin/env python3
+'''Full-text search of posts, by an inverted index of character bigrams.
+
+MariaDB's FULLTEXT parser splits words on spaces, which Chinese has none
+of, so posts are indexed here instead: every run of CJK characters gives
+its overlapping bigrams (保單理賠 -> 保單 單理 理賠), every run of letters
+or digits a word. Titles are indexed with the original post (position 0)
+only, as every reply repeats them.
+
+    search_terms      every term, and how many rows contain it (df); the
+                      term '' counts the rows indexed
+    search_postings   (term, post_id, position) -> times it occurs
+
+Updater adds every batch it inserts to the index (Search.add()), in the
+same transaction. A query matches the rows containing all of its terms,
+joined from the rarest one, and ranks them by tf-idf.
+
+$ python search.py [-f 設定文件] [-n 20] 查詢字串
+$ python search.py [-f 設定文件] --rebuild
+'''
+from collections import Counter
+from db import Database
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import argparse
+import html
+import math
+import re
+import sys
+import unicodedata
+
+
+CJK: str = '㐀-䶿一-鿿豈-﫿'
+TOKEN = re.compile(f'[{CJK}]+|[0-9a-z]+')
+# images are "\n<img>url<img>\n" and other tags "<b>text<b>" in content,
+# see parse_content() in finfo_view.py
+IMAGE = re.compile(r'<img>.*?<img>', re.S)
+MARKER = re.compile(r'</?\w+>')
+MAX_TERM: int = 20  # longer words are cut
+
+# rows ranked at most per query: the newest rows matching, so a query of
+# common terms costs no more than this
+CANDIDATES: int = 20_000
+
+
+class Hit(NamedTuple):
+    post_id: int
+    position: int
+    score: float
+
+
+def terms(text: str) -> Counter:
+    '''How many times each term occurs in text.'''
+    text = MARKER.sub('', IMAGE.sub(' ', text))
+    # full-width letters and digits to ASCII, lower case
+    text = unicodedata.normalize('NFKC', html.unescape(text)).lower()
+    counts: Counter = Counter()
+    for run in TOKEN.findall(text):
+        if run[0].isascii():
+            counts[run[:MAX_TERM]] += 1
+        elif len(run) == 1:
+            counts[run] += 1
+        else:
+            counts.update(run[i:i + 2] for i in range(len(run) - 1))
+    return counts
+
+
+class Search:
+    def __init__(self, database: Database):
+        self.db: Database = database
+
+    def add(self, posts: List[tuple], titles: Dict[int, str]):
+        '''Index rows just inserted into posts (see to_rows() in
+        update.py), titles the title of each post_id.
+        '''
+        postings: List[Tuple[str, int, int, int]] = []
+        df: Counter = Counter()
+        for post in posts:
+            post_id, position = post[:2]
+            content: str = post[4] or ''
+            counts: Counter = terms(f'{titles.get(post_id, "")}\n{content}'
+                                    if position == 0 else content)
+            for term, tf in counts.items():
+                postings.append((term, post_id, position, min(tf, 65535)))
+            df.update(counts.keys())
+        df[''] = len(posts)
+
+        # in the order of the primary keys (utf8mb4_bin compares terms as
+        # Python does), so concurrent batches lock the rows they share,
+        # '' above all, in the same order and do not deadlock one another
+        if postings:
+            self.db.cur.executemany(
+                    'INSERT IGNORE INTO search_postings '
+                    '(term, post_id, position, tf) VALUES (?, ?, ?, ?)',
+                    sorted(postings)
+                    )
+        self.db.cur.executemany(
+                'INSERT INTO search_terms (term, df) VALUES (?, ?) '
+                'ON DUPLICATE KEY UPDATE df = df + VALUES(df)',
+                sorted(df.items())
+                )
+
+    def query(self, text: str, limit: int = 20) -> List[Hit]:
+        '''Rows containing every term of text, best first.'''
+        wanted: List[str] = list(terms(text))
+        if not wanted:
+            return []
+        marks: str = ', '.join('?' * (len(wanted) + 1))
+        self.db.cur.execute(f'SELECT term, df FROM search_terms '
+                            f'WHERE term IN ({marks})', ('', *wanted))
+        df: Dict[str, int] = dict(self.db.cur.fetchall())
+        rows: int = df.pop('', 0)
+        if len(df) < len(wanted):  # a term no row contains
+            return []
+
+        # the rarest term gives the candidates, each other one is a
+        # lookup on the primary key per candidate
+        ordered: List[str] = sorted(wanted, key=df.__getitem__)
+        joins: str = ''.join(
+                f' JOIN search_postings t{i} ON t{i}.term = ? '
+                f'AND t{i}.post_id = t0.post_id '
+                f'AND t{i}.position = t0.position'
+                for i in range(1, len(ordered))
+                )
+        tfs: str = ', '.join(f't{i}.tf' for i in range(len(ordered)))
+        self.db.cur.execute(
+                f'SELECT t0.post_id, t0.position, {tfs} '
+                f'FROM search_postings t0{joins} WHERE t0.term = ? '
+                f'ORDER BY t0.post_id DESC, t0.position DESC LIMIT ?',
+                (*ordered[1:], ordered[0], CANDIDATES)
+                )
+
+        idf: List[float] = [math.log(1 + rows / df[t]) for t in ordered]
+        hits: List[Hit] = [
+                Hit(r[0], r[1], sum(w * (1 + math.log(tf))
+                                    for w, tf in zip(idf, r[2:])))
+                for r in self.db.cur.fetchall()
+                ]
+        hits.sort(key=lambda h: h.score, reverse=True)
+        return hits[:limit]
+
+    def rebuild(self, chunk: int = 5000):
+        '''Index every row of posts again.'''
+        with self.db.transaction():
+            self.db.clear(['search_postings', 'search_terms'])
+        self.db.cur.execute('SELECT COALESCE(MAX(id), 0) FROM posts')
+        latest: int = self.db.cur.fetchone()[0]
+        for first in range(0, latest, chunk):
+            self.db.cur.execute('SELECT p.post_id, p.position, '
+                                'p.create_time, p.author_id, p.content, '
+                                't.title FROM posts p LEFT JOIN threads t '
+                                'ON t.post_id = p.post_id '
+                                'WHERE p.id > ? AND p.id <= ?',
+                                (first, first + chunk))
+            rows: List[tuple] = self.db.cur.fetchall()
+            with self.db.transaction():
+                self.add([r[:5] for r in rows],
+                         {r[0]: r[5] for r in rows if r[5] is not None})
+            print(f'\r已建立索引至 posts.id {min(first + chunk, latest)}'
+                  f' / {latest}', end='', flush=True)
+        print()
+
+
+def show(database: Database, hits: Iterable[Hit]):
+    hits = list(hits)
+    if not hits:
+        print('找不到符合的文章')
+        return
+    marks: str = ', '.join(['(?, ?)'] * len(hits))
+    database.cur.execute(f'SELECT p.post_id, p.position, t.title, '
+                         f'p.content FROM posts p LEFT JOIN threads t '
+                         f'ON t.post_id = p.post_id '
+                         f'WHERE (p.post_id, p.position) IN ({marks})',
+                         tuple(v for h in hits for v in h[:2]))
+    rows: Dict[Tuple[int, int], tuple] = {(r[0], r[1]): r[2:]
+                                          for r in database.cur.fetchall()}
+    for h in hits:
+        title, content = rows.get((h.post_id, h.position), ('', ''))
+        title = title or ''
+        text: str = MARKER.sub('', IMAGE.sub(' ', content or ''))
+        snippet: str = ' '.join(text.split())[:60]
+        print(f'{h.score:6.2f}  {h.post_id}#{h.position}  {title}\n'
+              f'        {snippet}')
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='全文搜尋文章')
+    argpsr.add_argument('-f', '--file',
+                        help='使用指定的設定文件',
+                        metavar='文件路徑')
+    argpsr.add_argument('-n', '--limit',
+                        help='最多列出幾筆結果（預設：20）',
+                        metavar='N', type=int, default=20)
+    argpsr.add_argument('--rebuild',
+                        help='由 posts 重新建立整個索引',
+                        action='store_true')
+    argpsr.add_argument('query', nargs='?', help='查詢字串')
+    args = argpsr.parse_args()
+
+    if not args.rebuild and not args.query:
+        argpsr.error('請輸入查詢字串，或使用 --rebuild')
+
+    cfg_path: Path = (Path(args.file).resolve() if args.file
+                      else Path(__file__).parent.resolve() / 'config.cfg')
+    database: Database = Database(str(cfg_path))
+    search: Search = Search(database)
+
+    if args.rebuild:
+        search.rebuild()
+        print('搜尋索引已重建')
+        sys.exit(0)
+
+    show(database, search.query(args.query, args.limit))
+
+
+if __name__ == '__main__':
+    main()
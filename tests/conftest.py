@@ -0,0 +1,27 @@
+'''Shared by the tests: the repository and benchmarks/ importable, and the
+fixture server of benchmarks/fixture_server.py to crawl.'''
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from typing import Iterator
+
+import pytest
+import sys
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'benchmarks')]
+
+
+@pytest.fixture
+def site_url() -> Iterator[str]:
+    '''URL of a fixture site of 30 posts, a few of them deleted.'''
+    import fixture_server
+    fixture_server.Handler.site = fixture_server.Site(posts=30,
+                                                      deleted_rate=0.1,
+                                                      replies=(0, 5))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), fixture_server.Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
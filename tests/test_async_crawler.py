@@ -0,0 +1,35 @@
+'''AsyncCrawler records a post it cannot fetch or store as failed, and goes
+on with the others.'''
+from queue import Queue
+from typing import List
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('bs4')
+
+import finfo_view  # noqa: E402
+from async_crawler import AsyncCrawler  # noqa: E402
+from metrics import METRICS  # noqa: E402
+
+
+class FullDisk:
+    '''A page cache which cannot store post 3.'''
+    def put(self, index: int, page: str):
+        if index == 3:
+            raise OSError(28, 'No space left on device')
+
+
+def test_failed_post_does_not_stop_crawl(site_url, monkeypatch):
+    monkeypatch.setattr(finfo_view, 'URL_BASE', site_url + '/posts')
+    monkeypatch.setattr(finfo_view, 'CACHE', FullDisk())
+    out: Queue = Queue()
+    failed: int = METRICS.counters['posts_failed']
+    AsyncCrawler(list(range(1, 7)), out, concurrency=3, retries=0).run()
+
+    items: List = []
+    while not out.empty():
+        items.append(out.get())
+    ids: List[int] = [i if isinstance(i, int) else i['id'] for i in items]
+    assert sorted(ids) == [1, 2, 4, 5, 6]
+    assert METRICS.counters['posts_failed'] == failed + 1
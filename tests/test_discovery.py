@@ -0,0 +1,96 @@
+'''discovery.py against a listing whose order changes between passes.'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Iterator, List
+
+import pytest
+
+pytest.importorskip('bs4')
+
+import finfo_view  # noqa: E402
+from discovery import Discoverer, Discovery, last_top  # noqa: E402
+from fixture_server import LISTING_CLASS, Site  # noqa: E402
+
+
+class Listing(BaseHTTPRequestHandler):
+    '''/posts lists order, every post up to latest exists, but answers
+    with a page of its own (200) for a missing one, like finfo.tw may.
+    '''
+    order: List[int] = []
+    latest: int = 0
+    site: Site = Site()
+
+    def do_GET(self):
+        path: str = self.path.partition('?')[0].rstrip('/')
+        if path == '/posts':
+            page: int = int(self.path.partition('page=')[2] or 1)
+            body: str = ''.join(f'<a class="{LISTING_CLASS}" '
+                                f'href="/posts/{i}"><div>{i}</div></a>'
+                                for i in self.order[(page - 1) * 20:
+                                                    page * 20])
+        else:
+            index: int = int(path.rsplit('/', 1)[-1])
+            body = (self.site.post(index) if index <= self.latest
+                    else '<html><body>找不到頁面</body></html>')
+        data: bytes = body.encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def listing(monkeypatch) -> Iterator[type]:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Listing)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(finfo_view, 'URL_BASE',
+                        f'http://127.0.0.1:{server.server_port}/posts')
+    yield Listing
+    server.shutdown()
+    server.server_close()
+
+
+def test_last_top():
+    head: List[int] = [100, 99, 98, 97, 96]
+    assert last_top([101, 100, 99, 98], head) == 1
+    # 100 replied to: it is above 101 now, the top is where 99 follows
+    assert last_top([100, 101, 99, 98], head) == 2
+    assert last_top([97, 96, 100, 99, 98], head) == 2
+    # not told yet: the id after 100 is still to be read
+    assert last_top([101, 100], head) is None
+    assert last_top([101, 100], head, final=True) == 1
+
+
+def test_replies_to_the_top_do_not_hide_new_posts(listing, tmp_path):
+    discoverer: Discoverer = Discoverer(str(tmp_path / 'listing.json'))
+    listing.order = list(range(100, 0, -1))
+    assert discoverer.discover(100) == Discovery(100, [])
+
+    listing.order = [100, 101] + list(range(99, 0, -1))
+    assert discoverer.discover(100) == Discovery(101, [100])
+    assert discoverer.requests == 1
+
+    listing.order = [102, 100, 101] + list(range(99, 0, -1))
+    assert discoverer.discover(101) == Discovery(102, [])
+
+    listing.order = [100, 102, 101] + list(range(99, 0, -1))
+    assert discoverer.discover(102) == Discovery(102, [100])
+
+    # old posts replied to, the top read on the second page
+    old: List[int] = list(range(30, 5, -1))
+    listing.order = old + [100, 102, 101] + [i for i in range(99, 0, -1)
+                                             if i not in old]
+    assert discoverer.discover(102) == Discovery(102, old)
+    assert discoverer.requests == 2
+
+
+def test_probing_stops_at_deleted_posts_served_as_pages(listing, tmp_path):
+    listing.order = []  # the listing is unreadable
+    listing.latest = 37
+    discoverer: Discoverer = Discoverer(str(tmp_path / 'listing.json'))
+    assert discoverer.discover(10).latest == 37
+    assert discoverer.probes < discoverer.max_probes
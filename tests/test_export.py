@@ -0,0 +1,31 @@
+'''finfo_view.py --range / --ids-from: a post which cannot be parsed, or a
+line which is not a post id, is counted as failed and the export goes on.'''
+from io import StringIO
+from typing import List
+
+import finfo_view
+import json
+
+
+def test_failures_do_not_stop_export(site_url, monkeypatch):
+    monkeypatch.setattr(finfo_view, 'URL_BASE', site_url + '/posts')
+    extract = finfo_view.EXTRACTORS[finfo_view.EXTRACTOR]
+
+    def broken(index, page):
+        if int(index) == 3:
+            raise AttributeError("'NoneType' object has no attribute 'text'")
+        return extract(index, page)
+
+    monkeypatch.setitem(finfo_view.EXTRACTORS, finfo_view.EXTRACTOR, broken)
+    rejected: List[str] = []
+    indices = finfo_view.read_ids(['1', '2 # ok', 'x3', '', '3', '4'],
+                                  rejected)
+    out: StringIO = StringIO()
+    written, missing, failed = finfo_view.export_posts(indices, out, 2)
+
+    assert rejected == ['x3']
+    assert failed == 1
+    exported = [json.loads(line)['id'] for line in out.getvalue().splitlines()]
+    assert sorted(exported) == [i for i in (1, 2, 4)
+                                if finfo_view.fetch_post(i) is not None]
+    assert written + missing == 3
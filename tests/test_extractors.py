@@ -0,0 +1,28 @@
+'''Every extractor gives the output of the bs4 one on the golden corpus of
+tests/corpus: pages of benchmarks/fixture_server.py and handcrafted ones
+with the quirks of the markup of finfo.tw (entities, comments, images,
+nested tags, a deleted post). <文章編號>.json is the bs4 output of
+<文章編號>.html, regenerate it with
+
+$ python benchmarks/parse_bench.py tests/corpus --golden
+'''
+from pathlib import Path
+from typing import List
+
+import finfo_view
+import json
+import pytest
+
+CORPUS: Path = Path(__file__).resolve().parent / 'corpus'
+PAGES: List[Path] = sorted(CORPUS.glob('*.html'), key=lambda p: int(p.stem))
+
+
+@pytest.mark.parametrize('extractor', ['bs4', 'lxml'])
+@pytest.mark.parametrize('page', PAGES, ids=lambda p: p.stem)
+def test_matches_golden(extractor: str, page: Path):
+    if extractor not in finfo_view.EXTRACTORS:
+        pytest.skip(f'{extractor} is not installed')
+    golden: Path = page.with_suffix('.json')
+    expected = json.loads(golden.read_text(encoding='utf8'))
+    extract = finfo_view.EXTRACTORS[extractor]
+    assert extract(int(page.stem), page.read_text(encoding='utf8')) == expected
@@ -0,0 +1,89 @@
+'''A batch is written again when InnoDB breaks a deadlock by rolling it
+back, and summary rows are upserted in the order of their keys.'''
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import pytest
+
+pytest.importorskip('bs4')
+mariadb = pytest.importorskip('mariadb')  # update.py imports db.py
+
+from aggregates import Aggregates  # noqa: E402
+from update import Batch, Updater  # noqa: E402
+
+
+class Cursor:
+    def __init__(self):
+        self.many: List[tuple] = []  # (statement, rows)
+
+    def execute(self, query: str, params: tuple = ()):
+        pass
+
+    def executemany(self, query: str, rows: List[tuple]):
+        self.many.append((query, rows))
+
+
+class Database:
+    def __init__(self):
+        self.cur: Cursor = Cursor()
+        self.commits: int = 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        yield
+        self.commits += 1
+
+
+def deadlock() -> Exception:
+    e = mariadb.Error('Deadlock found when trying to get lock')
+    e.errno = 1213
+    return e
+
+
+def test_deadlocked_batch_written_again(monkeypatch):
+    database: Database = Database()
+    updater: Updater = Updater(database, reparse=True)
+    written: List[Batch] = []
+
+    def write(batch: Batch):
+        written.append(batch)
+        if len(written) < 3:
+            raise deadlock()
+
+    monkeypatch.setattr(updater, 'write', write)
+    batch: Batch = Batch()
+    batch.missing.append((7,))
+    updater.flush(batch)
+    assert len(written) == 3 and database.commits == 1
+
+
+def test_other_errors_not_retried(monkeypatch):
+    updater: Updater = Updater(Database(), reparse=True)
+    written: List[Batch] = []
+
+    def write(batch: Batch):
+        written.append(batch)
+        raise mariadb.Error('Data too long')
+
+    monkeypatch.setattr(updater, 'write', write)
+    batch: Batch = Batch()
+    batch.missing.append((7,))
+    with pytest.raises(mariadb.Error):
+        updater.flush(batch)
+    assert len(written) == 1
+
+
+def test_summaries_in_key_order():
+    database: Database = Database()
+    posts: List[tuple] = [
+            (9, 0, '2021-06-02 10:00:00', 1, ''),
+            (9, 1, '2021-06-02 11:00:00', 8, ''),
+            (3, 0, '2021-06-01 09:00:00', 2, ''),
+            (3, 1, '2021-06-01 12:00:00', 5, ''),
+            ]
+    users: List[tuple] = [('林*', True), ('業務員甲', False),
+                          ('陳*', True), ('業務員乙', False)]
+    Aggregates(database).apply(posts, users, {9: 2, 3: 1})
+    for _, rows in database.cur.many:
+        assert [r[:2] for r in rows] == sorted(r[:2] for r in rows)
+    assert [r[0] for r in database.cur.many[1][1]] == [3, 9]
@@ -0,0 +1,41 @@
+'''The crawl journal of update.py --resume.'''
+from journal import CrawlJournal, decode_ranges, encode_ranges
+
+import pytest
+
+
+@pytest.mark.parametrize('indices, text', [
+    ([], ''),
+    ([5], '5'),
+    ([1, 2, 3, 5, 7, 8], '1-3,5,7-8'),
+    ([8, 1, 3, 2, 2], '1-3,8'),  # any order, duplicates once
+])
+def test_ranges(indices, text):
+    assert encode_ranges(indices) == text
+    assert decode_ranges(text) == sorted(set(indices))
+
+
+def test_pending_after_crash(tmp_path):
+    journal: CrawlJournal = CrawlJournal(str(tmp_path / 'crawl.journal'))
+    journal.start([1, 2, 3, 4, 5, 6])
+    journal.record(CrawlJournal.FETCHED, 1)
+    journal.record(CrawlJournal.INSERTED, 1)
+    journal.record(CrawlJournal.DELETED, 2)
+    journal.record(CrawlJournal.FETCHED, 3)  # not inserted yet
+    journal.record(CrawlJournal.FAILED, 4, 'HTTP 503\nService Unavailable')
+    journal.record(CrawlJournal.INSERTED, 6)
+    journal.close()
+    with open(tmp_path / 'crawl.journal', 'a', encoding='utf8') as file:
+        file.write('1700000000\tinser')  # torn by the crash
+
+    assert journal.pending() == [3, 4, 5]
+
+
+def test_new_plan_replaces_old(tmp_path):
+    journal: CrawlJournal = CrawlJournal(str(tmp_path / 'crawl.journal'))
+    assert journal.pending() == []  # no journal yet
+    journal.start([1, 2])
+    journal.record(CrawlJournal.INSERTED, 1)
+    journal.start([7, 8])
+    journal.close()
+    assert journal.pending() == [7, 8]
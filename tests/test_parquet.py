@@ -0,0 +1,60 @@
+'''export.py writes the rows MariaDB gives, BOOLEAN columns as 0 or 1
+included, and keeps away from a database --worker processes write to.'''
+from typing import List
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+pytest.importorskip('mariadb')  # export.py imports db.py
+
+from export import Exporter  # noqa: E402
+
+
+class Cursor:
+    def __init__(self, rows: List[tuple]):
+        self.rows: List[tuple] = rows
+        self.result: List[tuple] = []
+
+    def execute(self, query: str, params: tuple = ()):
+        self.result = list(self.rows)
+
+    def fetchone(self) -> tuple:
+        return self.result[0]
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        taken, self.result = self.result[:size], self.result[size:]
+        return taken
+
+    def close(self):
+        pass
+
+
+class Database:
+    def __init__(self, rows: List[tuple]):
+        self.cur: Cursor = Cursor(rows)
+        self.conn = self
+
+    def cursor(self, buffered: bool = True) -> Cursor:
+        return self.cur
+
+
+def test_users_from_int_columns(tmp_path):
+    rows: List[tuple] = [(1, '林*', 1, None, None),
+                         (2, '業務員甲', 0, 1, 3),
+                         (3, '業務員乙', 0, 0, None)]
+    exporter: Exporter = Exporter(Database(rows), str(tmp_path), row_group=2)
+    exporter.export_table('users')
+
+    table = pq.read_table(tmp_path / 'users.parquet')
+    assert table.column('insurer_or_salesman').to_pylist() == [True, False,
+                                                               False]
+    assert table.column('sex').to_pylist() == [None, True, False]
+    assert table.column('region_id').to_pylist() == [None, 3, None]
+
+
+def test_refused_while_workers_run(tmp_path):
+    exporter: Exporter = Exporter(Database([(1,)]), str(tmp_path))
+    with pytest.raises(SystemExit):
+        exporter.export()  # one range of the work queue leased
+    assert not (tmp_path / 'users.parquet').exists()
@@ -0,0 +1,66 @@
+'''update.py --refresh with --parse-workers and validators: posts found
+unchanged go through ParseStage untouched.'''
+from queue import Queue
+from typing import List
+
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('mariadb')  # update.py imports db.py
+
+import finfo_view  # noqa: E402
+from finfo_view import Unchanged  # noqa: E402
+from metrics import METRICS  # noqa: E402
+from update import DataPorter, ParseStage  # noqa: E402
+from validators import Validators  # noqa: E402
+
+
+def crawl(indices: List[int]) -> list:
+    '''What the consumer of Updater.run() gets, fetchers handing raw
+    pages to ParseStage.
+    '''
+    page_queue: Queue = Queue()
+    post_queue: Queue = Queue()
+    stage: ParseStage = ParseStage(page_queue, post_queue, workers=2)
+    stage.start()
+    jobs: List[int] = list(indices)
+    porters: List[DataPorter] = [DataPorter(jobs, page_queue, retries=0,
+                                            parse=False)
+                                 for _ in range(2)]
+    for porter in porters:
+        porter.start()
+    for porter in porters:
+        porter.join()
+    page_queue.put(None)
+
+    items: list = []
+    while (item := post_queue.get()) is not None:
+        items.append(item)
+    return items
+
+
+def test_unchanged_posts_skip_parsing(site_url, tmp_path, monkeypatch):
+    validators: Validators = Validators(str(tmp_path / 'validators'))
+    monkeypatch.setattr(finfo_view, 'URL_BASE', site_url + '/posts')
+    monkeypatch.setattr(finfo_view, 'VALIDATORS', validators)
+    indices: List[int] = list(range(1, 31))
+
+    first: list = crawl(indices)
+    stored: List[int] = sorted(rows[0].post_id for rows in first
+                               if isinstance(rows, tuple)
+                               and not isinstance(rows, Unchanged))
+    assert stored and not any(isinstance(i, Unchanged) for i in first)
+
+    # as Updater.flush() does once their rows are committed
+    validators.save(stored)
+
+    # --refresh: the stored posts are revisited with conditional requests
+    validators.revalidate(stored)
+    failed: int = METRICS.counters.get('posts_failed', 0)
+    second: list = crawl(stored)
+    validators.close()
+
+    assert sorted(i.post_id for i in second) == stored
+    assert all(isinstance(i, Unchanged) for i in second)
+    assert validators.not_modified == len(stored)
+    assert METRICS.counters.get('posts_failed', 0) == failed
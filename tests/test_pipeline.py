@@ -0,0 +1,96 @@
+'''Updater.run() ends, with an error, when a stage before it dies instead
+of waiting for the end of the crawl forever.'''
+from concurrent.futures.process import BrokenProcessPool
+from queue import Queue
+from threading import Thread
+from typing import List
+
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('mariadb')  # update.py imports db.py
+
+import update  # noqa: E402
+from update import ParseStage, Updater  # noqa: E402
+
+# the stages that die print their traceback, as they should
+pytestmark = pytest.mark.filterwarnings(
+        'ignore::pytest.PytestUnhandledThreadExceptionWarning')
+
+
+class BrokenPool:
+    '''A ProcessPoolExecutor whose worker processes have been killed.'''
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, *args):
+        raise BrokenProcessPool('a worker process was killed')
+
+
+def run(updater: Updater) -> List[BaseException]:
+    '''Run updater.run() on a thread, what it raised if it ended.'''
+    raised: List[BaseException] = []
+
+    def target():
+        try:
+            updater.run()
+        except BaseException as e:
+            raised.append(e)
+
+    thread: Thread = Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), 'Updater.run() hangs'
+    return raised
+
+
+def fetchers(updater: Updater):
+    '''Stands for the fetchers: raw pages of updater.new_posts, taken as
+    DataPorter does.'''
+    def crawl_cache(out_queue: Queue, parse: bool = True):
+        while updater.new_posts:
+            index: int = updater.new_posts.pop()
+            out_queue.put((index, '<html></html>'))
+    return crawl_cache
+
+
+def test_crawl_error_ends_run(monkeypatch):
+    updater: Updater = Updater(None, reparse=True, flush_interval=0.1)
+    updater.new_posts = [1, 2, 3]
+
+    def crawl_cache(out_queue: Queue, parse: bool = True):
+        raise OSError('the page cache is gone')
+
+    monkeypatch.setattr(updater, 'crawl_cache', crawl_cache)
+    raised: List[BaseException] = run(updater)
+    assert len(raised) == 1 and isinstance(raised[0], SystemExit)
+    assert raised[0].code == 1
+
+
+def test_broken_parse_pool_ends_run(monkeypatch):
+    monkeypatch.setattr(update, 'ProcessPoolExecutor', BrokenPool)
+    updater: Updater = Updater(None, reparse=True, parse_workers=2,
+                               queue_size=2, flush_interval=0.1)
+    updater.new_posts = list(range(1, 101))
+    monkeypatch.setattr(updater, 'crawl_cache', fetchers(updater))
+    raised: List[BaseException] = run(updater)
+    assert len(raised) == 1 and isinstance(raised[0], SystemExit)
+    assert updater.new_posts == []  # the fetchers stopped
+
+
+def test_parse_stage_ends_its_output(monkeypatch):
+    monkeypatch.setattr(update, 'ProcessPoolExecutor', BrokenPool)
+    pages: Queue = Queue()
+    out: Queue = Queue()
+    pages.put((1, '<html></html>'))
+    stage: ParseStage = ParseStage(pages, out, workers=1)
+    stage.start()
+    stage.join(10)
+    assert out.get(timeout=1) is None
+    assert stage.failed
@@ -0,0 +1,48 @@
+'''PostCache prefetches the neighbours of a post, and a prefetch that never
+returns does not keep finfo_view.py from exiting.'''
+from pathlib import Path
+from post_cache import PostCache
+from threading import Event
+
+import subprocess
+import sys
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+
+
+def test_neighbours_prefetched():
+    fetched: list = []
+    done: Event = Event()
+
+    def fetch(index: int, session) -> str:
+        fetched.append(index)
+        if len(fetched) == 3:
+            done.set()
+        return f'page {index}'
+
+    posts: PostCache = PostCache(fetch, prefetch=1)
+    assert posts.get(5) == 'page 5'
+    assert done.wait(5)
+    assert posts.get(6) == 'page 6'
+    assert posts.misses == 1 and posts.hits == 1
+    posts.close()
+
+
+def test_hung_prefetch_does_not_block_exit():
+    script: str = '\n'.join([
+        'from post_cache import PostCache',
+        'from threading import Event',
+        'hang = Event()',
+        'def fetch(index, session):',
+        '    if index != 5:',
+        '        hang.wait()  # finfo.tw never answering, with no TIMEOUT',
+        '    return "page"',
+        'posts = PostCache(fetch, prefetch=3, workers=1)',
+        'posts.get(5)',
+        'posts.close()',
+        'print(posts.report())',
+        ])
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT,
+                            capture_output=True, text=True, timeout=10)
+    assert result.returncode == 0, result.stderr
+    assert '未命中 1 次' in result.stdout
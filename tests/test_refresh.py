@@ -0,0 +1,33 @@
+'''How often update.py --refresh revisits a stored post.'''
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('mariadb')  # refresh.py imports db.py
+
+from refresh import MAX_INTERVAL, MIN_INTERVAL  # noqa: E402
+from refresh import refresh_interval  # noqa: E402
+
+NOW: datetime = datetime(2021, 6, 30, 12)
+
+
+def hours(created_days: float, idle_hours: float, replies: int) -> float:
+    return refresh_interval(NOW - timedelta(days=created_days),
+                            NOW - timedelta(hours=idle_hours),
+                            replies, NOW)
+
+
+def test_a_quarter_of_the_idle_time():
+    assert hours(100, 96, 0) == pytest.approx(24)
+
+
+def test_shortened_by_replies_per_day():
+    # 10 replies in 10 days: 40 hours idle / 4 / (1 + 1)
+    assert hours(10, 40, 10) == pytest.approx(5)
+    assert hours(10, 40, 30) < hours(10, 40, 10)
+
+
+def test_bounds():
+    assert hours(1, 0.5, 3) == MIN_INTERVAL  # still being discussed
+    assert hours(400, 365 * 24, 2) == MAX_INTERVAL  # quiet for a year
+    assert hours(1, -5, 0) == MIN_INTERVAL  # clocks out of step
@@ -0,0 +1,37 @@
+'''update.py --reparse-from-cache rebuilds posts from the page cache, so it
+refuses to start when stored posts are missing from the cache.'''
+from typing import List
+
+import pytest
+
+pytest.importorskip('bs4')
+pytest.importorskip('mariadb')  # update.py imports db.py
+
+from update import Updater  # noqa: E402
+
+
+class Cursor:
+    def __init__(self, post_ids: List[int]):
+        self.post_ids: List[int] = post_ids
+        self.statements: List[str] = []
+
+    def execute(self, query: str, params: tuple = ()):
+        self.statements.append(query)
+
+    def fetchall(self) -> List[tuple]:
+        return [(i,) for i in self.post_ids]
+
+
+class Database:
+    def __init__(self, post_ids: List[int]):
+        self.cur: Cursor = Cursor(post_ids)
+
+
+def test_partial_cache_refused():
+    database: Database = Database([1, 2, 3])
+    updater: Updater = Updater(database, reparse=True)
+    updater.new_posts = [1, 3]  # post 2 was never cached
+    with pytest.raises(SystemExit) as exit:
+        updater.start()
+    assert exit.value.code == 1
+    assert not any(s.startswith('DELETE') for s in database.cur.statements)
@@ -0,0 +1,52 @@
+'''The bigram index of search.py.'''
+from typing import List
+
+import pytest
+
+pytest.importorskip('mariadb')  # search.py imports db.py
+
+from search import MAX_TERM, Search, terms  # noqa: E402
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('保單理賠', {'保單': 1, '單理': 1, '理賠': 1}),
+    ('保', {'保': 1}),  # a lone character is a term of its own
+    ('保單 保單', {'保單': 2}),
+    # full-width letters and digits are ASCII ones, any case
+    ('健檢 ＡＢＣ１２３ Abc', {'健檢': 1, 'abc123': 1, 'abc': 1}),
+    ('&amp;保險&lt;', {'保險': 1}),
+    # markers of parse_content() are no text, images none at all
+    ('理賠<b>申請<b>\n<img>https://finfo.tw/a.png<img>\n好',
+     {'理賠': 1, '賠申': 1, '申請': 1, '好': 1}),
+    ('', {}),
+])
+def test_terms(text, expected):
+    assert dict(terms(text)) == expected
+
+
+def test_long_words_cut():
+    assert dict(terms('a' * 30)) == {'a' * MAX_TERM: 1}
+
+
+class Cursor:
+    def __init__(self):
+        self.many: List[tuple] = []  # (statement, rows)
+
+    def executemany(self, query: str, rows: List[tuple]):
+        self.many.append((query, rows))
+
+
+class Database:
+    def __init__(self):
+        self.cur: Cursor = Cursor()
+
+
+def test_rows_added_in_key_order():
+    database: Database = Database()
+    Search(database).add([(12, 0, '2021-06-01', 1, '理賠申請'),
+                          (5, 3, '2021-06-01', 2, '申請 abc')],
+                         {12: '保單'})
+    postings, df = (rows for _, rows in database.cur.many)
+    assert postings == sorted(postings)
+    assert [r[0] for r in df] == sorted(r[0] for r in df)
+    assert df[0] == ('', 2)
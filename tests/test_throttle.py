@@ -0,0 +1,96 @@
+'''Throttle: requests in flight grown additively and cut in half on
+overload, under a token bucket.'''
+from throttle import Throttle, parse_retry_after
+
+import math
+import pytest
+import time
+
+
+def round_trip(throttle: Throttle, latency: float = 0.1,
+               overloaded: bool = False):
+    throttle.acquire()
+    throttle.release(latency, overloaded)
+
+
+def test_grows_by_one_per_round():
+    throttle: Throttle = Throttle(2, 10)
+    assert throttle.limit == 2
+    round_trip(throttle)
+    round_trip(throttle)  # a round: one success per request in flight
+    assert throttle.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)  # about 3
+    for _ in range(200):
+        round_trip(throttle)
+    assert throttle.limit == 10 and throttle.peak == 10
+
+
+def test_halved_once_per_round_trip():
+    throttle: Throttle = Throttle(2, 16)
+    throttle.limit = 16
+    round_trip(throttle, latency=30)
+    round_trip(throttle, overloaded=True)
+    assert throttle.limit == 8 and throttle.decreases == 1
+    # sent before the cut, the same cause does not halve it again
+    round_trip(throttle, overloaded=True)
+    assert throttle.limit == 8 and throttle.decreases == 1
+
+
+def test_never_below_min_limit():
+    throttle: Throttle = Throttle(3, 16)
+    throttle.limit = 4
+    round_trip(throttle, overloaded=True)
+    assert throttle.limit == 3
+
+
+def test_rising_latency_is_overload():
+    throttle: Throttle = Throttle(2, 16)
+    throttle.limit = 16
+    for _ in range(5):
+        round_trip(throttle, latency=0.1)
+    for _ in range(10):  # the server queues requests up
+        round_trip(throttle, latency=1)
+    assert throttle.decreases >= 1 and throttle.limit < 16
+
+
+def test_fixed_unless_adaptive():
+    throttle: Throttle = Throttle(2, 16, adaptive=False)
+    assert throttle.limit == 16
+    round_trip(throttle, overloaded=True)
+    assert throttle.limit == 16 and throttle.decreases == 0
+
+
+def test_full_until_a_slot_is_released():
+    throttle: Throttle = Throttle(2, 2, adaptive=False)
+    throttle.acquire()
+    throttle.acquire()
+    assert throttle._try_acquire() == math.inf
+    throttle.release(0.1)
+    assert throttle._try_acquire() == 0
+
+
+def test_token_bucket():
+    throttle: Throttle = Throttle(100, 100, rate=20, adaptive=False)
+    started: float = time.monotonic()
+    for _ in range(20):  # a burst of one second worth of requests
+        throttle.acquire()
+    assert time.monotonic() - started < 0.04
+    for _ in range(4):
+        throttle.acquire()
+    assert time.monotonic() - started >= 0.15  # then 20 per second
+
+
+def test_paused_by_retry_after():
+    throttle: Throttle = Throttle(2, 2, adaptive=False)
+    throttle.acquire()
+    throttle.release(0.1, overloaded=True, retry_after=0.2)
+    started: float = time.monotonic()
+    throttle.acquire()
+    assert time.monotonic() - started >= 0.15
+
+
+@pytest.mark.parametrize('value, seconds', [
+    (None, 0), ('', 0), ('5', 5), ('1.5', 1.5), ('-3', 0),
+    ('Wed, 21 Oct 2015 07:28:00 GMT', 0),
+])
+def test_parse_retry_after(value, seconds):
+    assert parse_retry_after(value) == seconds
@@ -0,0 +1,18 @@
+'''Validators are only trusted once the rows of their fetch are stored.'''
+from validators import Validators
+
+
+def test_kept_once_saved(tmp_path):
+    validators: Validators = Validators(str(tmp_path / 'validators'))
+    validators.revalidate([7])
+    assert validators.modified(7, 200, {'ETag': '"a"'}, 'page')
+
+    # fetched again before the batch of the first fetch was committed
+    assert validators.headers(7) == {}
+    assert validators.modified(7, 200, {'ETag': '"a"'}, 'page')
+
+    validators.save([7])
+    assert validators.headers(7) == {'If-None-Match': '"a"'}
+    assert not validators.modified(7, 200, {'ETag': '"a"'}, 'page')
+    assert validators.same_body == 1
+    validators.close()
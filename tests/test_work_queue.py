@@ -0,0 +1,113 @@
+'''State transitions of the ranges of work_queue.py, on the statements sent
+to the database.'''
+from typing import List, Optional
+
+import pytest
+
+pytest.importorskip('mariadb')  # work_queue.py imports db.py
+
+from work_queue import Chunk, WorkQueue  # noqa: E402
+
+
+class Cursor:
+    '''Answers every query with the next of rows, and counts a row as
+    changed by every UPDATE.'''
+    def __init__(self, rows: List[tuple], rowcount: int = 1):
+        self.rows: List[tuple] = rows
+        self.rowcount: int = rowcount
+        self.statements: List[tuple] = []  # (statement, params)
+
+    def execute(self, query: str, params: tuple = ()):
+        self.statements.append((query, params))
+
+    def executemany(self, query: str, rows: List[tuple]):
+        self.statements.append((query, rows))
+
+    def fetchone(self) -> Optional[tuple]:
+        return self.rows.pop(0)
+
+    def sent(self, start: str) -> List[tuple]:
+        return [s for s in self.statements if s[0].startswith(start)]
+
+
+class Database:
+    def __init__(self, cursor: Cursor):
+        self.cur: Cursor = cursor
+
+
+def test_enqueue_needs_the_lock():
+    cursor: Cursor = Cursor([(0,)])  # GET_LOCK timed out
+    with pytest.raises(TimeoutError):
+        WorkQueue(Database(cursor), chunk_size=10).enqueue(100)
+    assert not cursor.sent('INSERT')
+    assert not cursor.sent("SELECT RELEASE_LOCK")
+
+
+def test_enqueue_after_last_range():
+    cursor: Cursor = Cursor([(1,), (20,)])
+    assert WorkQueue(Database(cursor), chunk_size=10).enqueue(45) == 3
+    assert cursor.sent('INSERT')[0][1] == [(21, 30), (31, 40), (41, 45)]
+    assert cursor.sent("SELECT RELEASE_LOCK")
+
+
+def leased(cursor: Cursor, attempts: int, **options) -> WorkQueue:
+    queue: WorkQueue = WorkQueue(Database(cursor), **options)
+    queue.chunk = Chunk(1, 1, 1000, 'token', attempts)
+    return queue
+
+
+def test_failed_range_given_back_after_backoff():
+    cursor: Cursor = Cursor([])
+    leased(cursor, 2, max_attempts=3, retry_delay=60).complete(failed=4)
+    update, = cursor.sent('UPDATE')
+    assert update[1][:3] == ('pending', 4, 120)  # 60 s, doubled once
+    assert 'done_at = NULL' in update[0]
+
+
+def test_failed_range_done_without_attempts_left():
+    cursor: Cursor = Cursor([])
+    leased(cursor, 3, max_attempts=3).complete(failed=4)
+    update, = cursor.sent('UPDATE')
+    assert update[1][:3] == ('done', 4, 0)
+
+
+def test_claim_respects_attempts_and_backoff():
+    cursor: Cursor = Cursor([(7, 1, 1000, 'token', 2)], rowcount=0)
+    queue: WorkQueue = WorkQueue(Database(cursor), max_attempts=3)
+    assert queue.claim() is None  # nothing to claim
+    give_up, lease = cursor.sent('UPDATE')
+    assert "state = 'failed'" in give_up[0] and give_up[1] == (3,)
+    assert 'not_before <= NOW()' in lease[0]
+    assert 'attempts < ?' in lease[0] and lease[1][-1] == 3
+
+
+def test_claim_complete():
+    cursor: Cursor = Cursor([(7, 1, 1000, 'token', 1)])
+    queue: WorkQueue = WorkQueue(Database(cursor), lease_seconds=30)
+    chunk: Optional[Chunk] = queue.claim()
+    assert chunk == Chunk(7, 1, 1000, 'token', 1)
+    assert queue._heartbeat is not None and queue._heartbeat.is_alive()
+
+    assert queue.complete()
+    assert not queue._heartbeat.is_alive() and queue.chunk is None
+    done = cursor.statements[-1]
+    assert done[1][0] == 'done' and done[1][-2:] == (7, 'token')
+
+
+def test_lease_lost():
+    cursor: Cursor = Cursor([], rowcount=0)  # taken over by another
+    queue: WorkQueue = leased(cursor, 1)
+    assert not queue.renew()
+    assert not queue.complete()
+
+
+def test_release_gives_the_attempt_back():
+    cursor: Cursor = Cursor([])
+    queue: WorkQueue = leased(cursor, 1)
+    queue.release()
+    update, = cursor.sent('UPDATE')
+    assert "state = 'pending'" in update[0]
+    assert 'attempts = attempts - 1' in update[0]
+    assert queue.chunk is None
+    queue.release()  # nothing leased any more
+    assert len(cursor.sent('UPDATE')) == 1
@@ -0,0 +1,139 @@
+from threading import Condition
+from typing import Optional
+
+import asyncio
+import math
+import time
+
+
+class Throttle:
+    '''Decides how many requests may be in flight, and how often they may
+    start, from how the site copes with them.
+
+    The limit grows by one every round of successful requests (one per
+    request in flight) and is halved when the site is overloaded: a 429,
+    a 5xx, a timeout or a refused connection, or the average latency
+    rising to twice its lowest, i.e. requests queuing up on the server.
+    It is halved at most once per round trip, as the requests already in
+    flight were sent before the cut and would halve it again for the same
+    cause.
+    Independently, a token bucket keeps the rate under rate requests per
+    second, with bursts of up to one second worth of requests.
+    '''
+    ALPHA: float = 0.2  # weight of a new sample in the average latency
+    TOLERANCE: float = 2  # latency / lowest latency regarded as overload
+    DRIFT: float = 1.001  # lowest latency forgotten slowly, per sample
+
+    def __init__(self,
+                 min_limit: int,
+                 max_limit: int,
+                 rate: float = 0,
+                 adaptive: bool = True):
+        self.min_limit: int = max(min_limit, 1)
+        self.max_limit: int = max(max_limit, self.min_limit)
+        # fixed at max_limit unless adaptive
+        self.limit: float = (float(self.min_limit) if adaptive
+                             else float(self.max_limit))
+        self.adaptive: bool = adaptive
+        self.rate: float = rate  # requests per second, 0 for no cap
+        self.inflight: int = 0
+
+        self.latency: Optional[float] = None  # moving average, seconds
+        self.lowest: Optional[float] = None  # lowest average
+        self.decreases: int = 0
+        self.peak: int = int(self.limit)
+
+        self._tokens: float = max(rate, 1)
+        self._refilled: float = time.monotonic()
+        self._paused_until: float = 0  # Retry-After of a 429
+        self._decreased: float = 0
+        self._cond: Condition = Condition()
+
+    def _try_acquire(self) -> float:
+        now: float = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.inflight >= int(self.limit):
+            return math.inf  # until a slot is released
+
+        if self.rate:
+            self._tokens = min(self._tokens
+                               + (now - self._refilled) * self.rate,
+                               max(self.rate, 1))
+            self._refilled = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+
+        self.inflight += 1
+        return 0
+
+    def acquire(self):
+        '''Wait for a slot, in a thread.'''
+        with self._cond:
+            while True:
+                wait: float = self._try_acquire()
+                if not wait:
+                    return
+                self._cond.wait(None if wait == math.inf else wait)
+
+    async def acquire_async(self):
+        '''Wait for a slot, in the event loop of AsyncCrawler.'''
+        while True:
+            with self._cond:
+                wait: float = self._try_acquire()
+            if not wait:
+                return
+            if wait == math.inf:  # poll at a fraction of a round trip
+                wait = max((self.latency or 0.02) / 4, 0.005)
+            await asyncio.sleep(wait)
+
+    def release(self,
+                latency: float,
+                overloaded: bool = False,
+                retry_after: float = 0):
+        '''Give the slot back, with how long the request took and whether
+        the site said it was overloaded.
+        '''
+        with self._cond:
+            self.inflight -= 1
+            now: float = time.monotonic()
+            if retry_after:
+                self._paused_until = max(self._paused_until,
+                                         now + retry_after)
+
+            if not overloaded:
+                self.latency = (latency if self.latency is None
+                                else self.ALPHA * latency
+                                + (1 - self.ALPHA) * self.latency)
+                self.lowest = (self.latency if self.lowest is None
+                               else min(self.lowest * self.DRIFT,
+                                        self.latency))
+                overloaded = self.latency > self.TOLERANCE * self.lowest
+
+            if self.adaptive:
+                self._adapt(overloaded, now)
+            self._cond.notify(max(int(self.limit) - self.inflight, 0))
+
+    def _adapt(self, overloaded: bool, now: float):
+        if not overloaded:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self.peak = max(self.peak, int(self.limit))
+        elif now - self._decreased >= (self.latency or 0):
+            self.limit = max(self.limit / 2, self.min_limit)
+            self._decreased = now
+            self.decreases += 1
+
+    def report(self) -> str:
+        latency: str = (f'{self.latency * 1000:.0f} ms'
+                        if self.latency is not None else '-')
+        return (f'同時請求數：目前 {int(self.limit)}，最高 {self.peak}，'
+                f'降速 {self.decreases} 次，平均延遲 {latency}')
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    '''Seconds of a Retry-After header, 0 if missing or an HTTP date.'''
+    try:
+        return max(float(value), 0) if value else 0
+    except ValueError:
+        return 0
@@ -1,178 +1,900 @@
 #! /usr/bin/env python3
-from bs4 import BeautifulSoup  # type: ignore
-from db import Database
+from aggregates import Aggregates
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from db import Database, deadlocked
+from discovery import Discoverer, Discovery
+from finfo_view import get_page, parse_page
+from finfo_view import use_cache, use_extractor, use_validators, EXTRACTORS
+from finfo_view import NotModified, Unchanged
+from journal import CrawlJournal
+from metrics import METRICS, SamplingProfiler
+from page_cache import PageCache
 from pathlib import Path
-from queue import Queue
-from subprocess import Popen, PIPE
+from queue import Queue, Empty
+from refresh import RefreshPlanner, RefreshState
+from search import Search
 from threading import Thread
-from typing import Tuple, List, Any
+from throttle import Throttle, parse_retry_after
+from validators import Validators
+from work_queue import Chunk, WorkQueue
+from typing import Tuple, List, Any, Optional, Set, Union, Dict
+from typing import Callable, Deque, NamedTuple
 
 import argparse
 import configparser
-import http.client
-import json
+import finfo_view
+import multiprocessing
 import os
+import random
 import re
+import requests
 import sys
-import urllib.request as request
+import time
 
 
 ConfigSection = configparser.SectionProxy
-Response = http.client.HTTPResponse
-Request = request.Request
+
+DEADLOCK_RETRIES: int = 5  # times a batch is written again on a deadlock
+
+
+class ThreadRow(NamedTuple):
+    '''A row of threads: what the original post and its replies share.'''
+    post_id: int
+    title: str
+    topic_id: int
+    created: str
+
+
+# the thread, rows of posts, their authors - see to_rows()
+Rows = Tuple[ThreadRow, List[tuple], List[tuple]]
+
+
+class Batch:
+    '''Rows waiting to be written to the database by Updater.flush().'''
+    def __init__(self):
+        self.threads: List[ThreadRow] = []
+        self.posts: List[tuple] = []
+        self.users: List[tuple] = []  # users[i] is the author of posts[i]
+        self.missing: List[tuple] = []  # (post_id,) of deleted posts
+        self.refreshed: List[RefreshState] = []  # revisited posts
+        self.unchanged: List[int] = []  # revisited, but nothing new
+
+    def __len__(self) -> int:
+        return len(self.posts) + len(self.missing)
 
 
 class Updater:
     def __init__(self,
                  database: Database,
-                 maxthreads: int = 10):
+                 maxthreads: int = 10,
+                 engine: str = 'threads',
+                 concurrency: int = 100,
+                 conn_per_host: int = 0,
+                 batch_size: int = 500,
+                 flush_interval: float = 30,
+                 queue_size: int = 1000,
+                 journal: Optional[CrawlJournal] = None,
+                 resume: bool = False,
+                 retries: int = 3,
+                 backoff: float = 1,
+                 recheck_days: Optional[float] = None,
+                 refresh_budget: Optional[int] = None,
+                 parse_workers: int = 0,
+                 reparse: bool = False,
+                 min_inflight: int = 2,
+                 rate_limit: float = 0,
+                 adaptive: bool = True,
+                 work_queue: Optional[WorkQueue] = None,
+                 discoverer: Optional[Discoverer] = None,
+                 search: bool = True):
         self.maxthreads: int = maxthreads
+        self.engine: str = engine
+        self.concurrency: int = concurrency
+        self.conn_per_host: int = conn_per_host
+        self.batch_size: int = batch_size  # rows per insert
+        self.flush_interval: float = flush_interval  # seconds
+        self.queue_size: int = queue_size  # articles waiting to be inserted
+        # processes parsing pages, 0 to parse them in the fetchers
+        self.parse_workers: int = parse_workers
+        self.journal: Optional[CrawlJournal] = journal
+        self.retries: int = retries  # extra attempts for a failed fetch
+        self.backoff: float = backoff  # seconds, doubled on each retry
+        # requests in flight float between min_inflight and maxthreads (or
+        # concurrency) by how finfo.tw copes, at most rate_limit per second
+        self.throttle: Throttle = Throttle(
+                min_inflight,
+                concurrency if engine == 'async' else maxthreads,
+                rate_limit,
+                adaptive
+                )
+        # tombstones older than this (days) are fetched again
+        self.recheck_days: Optional[float] = recheck_days
+        self.rechecking: Set[int] = set()
         self.db: Database = database
+        self.aggregates: Aggregates = Aggregates(database)
+        # one tuple per distinct (name, is insurer) of the run, shared by
+        # every row it authors
+        self.users: Dict[tuple, tuple] = {}
+        # the full-text index, None if it is not kept up to date
+        self.search: Optional[Search] = Search(database) if search else None
 
-        self.db.cur.execute('SELECT id FROM posts')
-        local_latest: int
-        try:
-            local_latest = max([r[0] for r in self.db.cur.fetchall()])
-        except ValueError:  # empty
-            local_latest = 0
-        remote_latest: int = self.get_remote_latest()
-        self.new_posts: List[int] = [
-                i for i in range(local_latest, remote_latest + 1)
-                ]
-
-    def get_remote_latest(self) -> int:
-        print('更新文章列表...')
-        user_agent: str = ('Mozilla/5.0 (X11; Linux x86_64) '
-                           'AppleWebKit/537.36 (KHTML, like Gecko) '
-                           'Chrome/92.0.4515.159 Safari/537.36')
-        req: Request = request.Request(url='https://finfo.tw/posts',
-                                       headers={'User-Agent': user_agent},
-                                       method='GET')
-        response: Response = request.urlopen(req)
-
-        if response.status == 200:
-            page: str = response.read().decode('utf8')
+        # refresh mode: revisit stored posts instead of fetching new ones,
+        # known maps the revisited post ids to their highest stored position
+        self.refresh: Optional[RefreshPlanner] = None
+        self.known: Dict[int, int] = {}
+
+        # reparse mode: rebuild posts and users from the page cache
+        self.reparse: bool = reparse
+
+        # worker mode: crawl ranges claimed from a queue shared with other
+        # processes, possibly on other hosts
+        self.work_queue: Optional[WorkQueue] = work_queue
+
+        # the newest post of finfo.tw, and the stored ones active lately
+        self.discoverer: Discoverer = discoverer or Discoverer()
+
+        # whether crawl() ended on an error, see run()
+        self.crawl_failed: bool = False
+
+        self.new_posts: List[int]
+        if reparse:
+            self.journal = None
+            cache: Optional[PageCache] = finfo_view.CACHE
+            self.new_posts = sorted(cache.latest) if cache is not None else []
+            print(f'由快取重新解析 {len(self.new_posts)} 篇文章')
+        elif refresh_budget is not None:
+            self.journal = None  # keep the plan of the last normal crawl
+            self.refresh = RefreshPlanner(self.db)
+            self.refresh.seed()
+            self.get_remote_latest(self.stored_latest())  # listed active
+            self.known = self.refresh.due(refresh_budget)
+            self.new_posts = sorted(self.known)
+            if finfo_view.VALIDATORS is not None:
+                finfo_view.VALIDATORS.revalidate(self.new_posts)
+            print(f'重新檢查 {len(self.new_posts)} 篇文章的新回應')
+        elif work_queue is not None:
+            self.journal = None  # the queue keeps track of what is done
+            stored_latest: int = self.stored_latest()
+            remote_latest: int = self.get_remote_latest(stored_latest)
+            try:
+                added: int = work_queue.enqueue(remote_latest, stored_latest)
+            except TimeoutError as e:  # another worker is adding them
+                print(f'{e}，只處理佇列中已有的範圍')
+                added = 0
+            if added:
+                print(f'已加入 {added} 個範圍至工作佇列')
+            self.new_posts = []  # a range at a time, see work()
+        elif resume and self.journal is not None:
+            self.new_posts = self.journal.pending()
+            print(f'從上次中斷處繼續，尚有 {len(self.new_posts)} 篇文章')
         else:
-            print('無法更新聞章列表，請稍後再試。')
-            sys.exit(1)
+            self.new_posts = self.plan()
 
-        soup: BeautifulSoup = BeautifulSoup(page, 'html.parser')
-        class_: str = ('text-decoration-none d-flex '
-                       'justify-content-center row')
-        latest_post = soup.find('a', class_=class_)
+        if self.journal is not None:
+            self.journal.start(self.new_posts)
+        # the fetchers empty new_posts as they go
+        self.planned: int = len(self.new_posts)
 
-        return int(latest_post['href'].split('/')[-1])
+    def stored_latest(self) -> int:
+        # one lookup on uq_post_position, instead of fetching every row
+        self.db.cur.execute('SELECT COALESCE(MAX(post_id), 0) FROM posts')
+        return self.db.cur.fetchone()[0]
 
-    def parse(self, json_data) -> Tuple[list, list]:
-        TOPICS: List[str] = ['投保規劃', '保單健檢', '理賠申請',
-                             '保單解約', '保險觀念']
-#        REGIONS: List[str] = ['北部', '中部', '南部', '東部']
+    def plan(self) -> List[int]:
+        local_latest: int = self.stored_latest()
+        remote_latest: int = self.get_remote_latest(local_latest)
+        new_posts: Set[int] = set(range(local_latest + 1, remote_latest + 1))
 
-        self.db.cur.execute('SELECT id FROM users')
-        AUTHOR_ID_BASE: int
-        try:
-            AUTHOR_ID_BASE = max([r[0] for r in self.db.cur.fetchall()])
-        except ValueError:
-            AUTHOR_ID_BASE = 0
+        # known deleted posts cost no request, unless due for a recheck
+        self.db.cur.execute('SELECT post_id FROM missing_posts '
+                            'WHERE post_id > ?', (local_latest,))
+        new_posts.difference_update(r[0] for r in self.db.cur.fetchall())
+        if self.recheck_days is not None:
+            self.db.cur.execute('SELECT post_id FROM missing_posts '
+                                'WHERE checked_at < NOW() - INTERVAL ? DAY',
+                                (self.recheck_days,))
+            self.rechecking = {r[0] for r in self.db.cur.fetchall()}
+            if self.rechecking:
+                print(f'重新檢查 {len(self.rechecking)} 篇已刪除的文章')
+            new_posts.update(self.rechecking)
+
+        if self.journal is not None:
+            # whatever an unfinished run left behind is still to be done,
+            # as it may lie below local_latest
+            leftover: List[int] = self.journal.pending()
+            if leftover:
+                print(f'加入上次未完成的 {len(leftover)} 篇文章')
+                new_posts.update(leftover)
 
+        return sorted(new_posts)
+
+    def get_remote_latest(self, stored_latest: int) -> int:
+        '''The newest post id of finfo.tw. Stored posts the listing shows
+        active since the last time are made due for --refresh.
+        '''
+        print('更新文章列表...')
         try:
-            data: dict = json.loads(json_data)['articles'][0]
-        except json.decoder.JSONDecodeError:  # post not exists anymore
-            return None
-
-        post_id: int = data['id']
-        title: str = data['title']
-        topic_id: int = TOPICS.index(data['class']) + 1  # db count from 1
-        # finfo.tw start at 2021, it's safe to hard code year till 2022...
-        datetime: str = '2021-' + '-'.join(data['dateTime'].split('/'))
-        author_name: str = data['author']['userName']
-        author_type: str = data['author']['identity']
-        content: str = data['content']
-        replies: List[dict] = data['replies']
-
-        posts: list = []
-        users: list = []
-
-        users.append((author_name, author_type == 'insurer'))
-        #                             ↓ 0 means oringinal post, not a reply
-        posts.append((post_id, title, 0, datetime,
-                      AUTHOR_ID_BASE + len(users), topic_id, content))
-
-        for reply in replies:
-            users.append((reply['author']['userName'],
-                          reply['author']['identity'] == 'insurer'))
-            posts.append((reply['belongsTo'],
-                          title,
-                          reply['floor'],
-                          '2021-' + '-'.join(reply['dateTime'].split('/')),
-                          AUTHOR_ID_BASE + len(users),
-                          topic_id,
-                          reply['content']))
-
-        return posts, users
+            discovery: Discovery = self.discoverer.discover(stored_latest)
+        except (requests.RequestException, LookupError):
+            print('無法更新聞章列表，請稍後再試。')
+            sys.exit(1)
+
+        if discovery.active:
+            refresh: RefreshPlanner = self.refresh or RefreshPlanner(self.db)
+            refresh.seed()
+            refresh.expedite(discovery.active)
+            print(f'文章列表上有 {len(discovery.active)} 篇已儲存的文章'
+                  f'有新動態，已排入重新檢查')
+        return discovery.latest
 
     def start(self):
-        if not any(self.new_posts):
+        if not self.new_posts and self.work_queue is None:
             print('資料庫以為最新狀態，無須更新')
             sys.exit(0)
 
-        json_queue: Queue = Queue()  # json string - str
-        threads: List[Thread] = [DataPorter(self.new_posts, json_queue)
-                                 for _ in range(self.maxthreads)]
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+        if self.engine == 'async':
+            try:
+                import async_crawler  # noqa: F401
+            except ImportError:  # aiohttp is optional
+                print('非同步模式需要 aiohttp，請先安裝：pip install aiohttp')
+                sys.exit(1)
 
-        posts: List[tuple] = []
-        users: List[tuple] = []
-        while not json_queue.empty():
-            tmp: Tuple[List[Any], List[Any]] = self.parse(json_queue.get())
-            posts += [*tmp[0]]
-            users += [*tmp[1]]
+        if self.reparse:
+            # every stored post is deleted, only those cached come back
+            self.db.cur.execute('SELECT DISTINCT post_id FROM posts')
+            uncached: Set[int] = ({r[0] for r in self.db.cur.fetchall()}
+                                  - set(self.new_posts))
+            if uncached:
+                print(f'快取中缺少 {len(uncached)} 篇已儲存的文章'
+                      f'（例如 {min(uncached)}），重建將刪除它們，已中止')
+                sys.exit(1)
+            with self.db.transaction():
+                self.db.clear(['post_refresh', 'daily_topic_posts',
+                               'post_stats', 'salesman_activity',
+                               'search_postings', 'search_terms',
+                               'posts', 'threads', 'users'])
 
-        self.db.insert('users', users)
-        self.db.insert('posts', posts)
+        if self.work_queue is not None:
+            self.work()
+        else:
+            self.run()
+        if self.journal is not None:
+            self.journal.close()
+        print(METRICS.report())
+        if not self.reparse:
+            print(self.throttle.report())
+        if finfo_view.VALIDATORS is not None:
+            if finfo_view.VALIDATORS.conditional:
+                print(finfo_view.VALIDATORS.report())
+            finfo_view.VALIDATORS.close()
 
         print('\n全部工作皆已完成，資料庫為最新狀態\n')
 
+    def work(self):
+        '''Crawl ranges claimed from the work queue until none is left.'''
+        queue: WorkQueue = self.work_queue
+        try:
+            while True:
+                chunk: Optional[Chunk] = queue.claim()
+                if chunk is None:
+                    break
+                self.new_posts = self.chunk_posts(chunk.first, chunk.last)
+                self.planned += len(self.new_posts)
+                print(f'領取範圍 {chunk.first}-{chunk.last}，'
+                      f'{len(self.new_posts)} 篇待抓取'
+                      f'（第 {chunk.attempts} 次）')
+
+                failed: int = METRICS.counters['posts_failed']
+                if self.new_posts:
+                    self.run()
+                failed = METRICS.counters['posts_failed'] - failed
+                if not queue.complete(failed):
+                    print(f'範圍 {chunk.first}-{chunk.last} 已由其他 '
+                          'worker 接手')
+        except BaseException:  # e.g. Ctrl-C, let another worker take it
+            queue.release()
+            raise
+
+    def chunk_posts(self, first: int, last: int) -> List[int]:
+        '''Indices first to last, but those already stored (by a worker
+        which died before finishing the range) or known deleted.
+        '''
+        new_posts: Set[int] = set(range(first, last + 1))
+        self.db.cur.execute('SELECT DISTINCT post_id FROM posts '
+                            'WHERE post_id BETWEEN ? AND ?', (first, last))
+        new_posts.difference_update(r[0] for r in self.db.cur.fetchall())
+        self.db.cur.execute('SELECT post_id FROM missing_posts '
+                            'WHERE post_id BETWEEN ? AND ?', (first, last))
+        new_posts.difference_update(r[0] for r in self.db.cur.fetchall())
+        return sorted(new_posts)
+
+    def run(self):
+        '''Crawl self.new_posts into the database.'''
+        # bounded, so a slow database makes the fetchers wait instead of
+        # piling up articles in memory
+        # article - dict, parsed rows - Rows, a deleted post index - int,
+        # or a post revisited but not modified - Unchanged
+        post_queue: Queue = Queue(maxsize=self.queue_size)
+        page_queue: Optional[Queue] = None
+        parse_stage: Optional[ParseStage] = None
+        stages: List[Thread]
+        self.crawl_failed = False
+        if self.parse_workers:
+            # fetchers hand raw pages to the process pool of ParseStage
+            page_queue = Queue(maxsize=self.queue_size)
+            parse_stage = ParseStage(page_queue, post_queue,
+                                     self.parse_workers, self.journal)
+            stages = [Thread(target=self.crawl, args=(page_queue, False),
+                             daemon=True),
+                      parse_stage]
+        else:
+            stages = [Thread(target=self.crawl, args=(post_queue,),
+                             daemon=True)]
+        for stage in stages:
+            stage.start()
+
+        batch: Batch = Batch()
+        last_flush: float = time.monotonic()
+        lost: bool = False  # the last stage died without its None
+        while True:
+            try:
+                item: Union[dict, Rows, int, Unchanged, None] = \
+                    post_queue.get(timeout=self.flush_interval)
+            except Empty:  # nothing new for a while, flush what we have
+                if not stages[-1].is_alive() and post_queue.empty():
+                    lost = True
+                    break
+            else:
+                if item is None:  # crawling has finished
+                    break
+                METRICS.observe('queue_posts', post_queue.qsize())
+                if isinstance(item, Unchanged):
+                    METRICS.count('posts_unchanged')
+                    batch.unchanged.append(item.post_id)
+                elif isinstance(item, int):
+                    METRICS.count('posts_deleted')
+                    batch.missing.append((item,))
+                elif isinstance(item, dict):  # from AsyncCrawler
+                    try:
+                        rows: Rows = to_rows(item)
+                    except Exception as e:  # unexpected markup, keep going
+                        METRICS.count('posts_failed')
+                        print(f'無法解析文章 {item["id"]}（{e!r}）')
+                        if self.journal is not None:
+                            self.journal.record(CrawlJournal.FAILED,
+                                                item['id'], repr(e))
+                    else:
+                        METRICS.count('posts_fetched')
+                        self.add(batch, rows)
+                else:
+                    METRICS.count('posts_fetched')
+                    self.add(batch, item)
+
+            if len(batch) >= self.batch_size \
+                    or time.monotonic() - last_flush >= self.flush_interval:
+                self.flush(batch)
+                batch = Batch()
+                last_flush = time.monotonic()
+
+        failed: bool = (lost or self.crawl_failed
+                        or (parse_stage is not None and parse_stage.failed))
+        if failed:
+            self.new_posts.clear()  # the fetchers stop after the post at hand
+            while page_queue is not None and stages[0].is_alive():
+                try:  # unblock those waiting for the dead ParseStage
+                    page_queue.get(timeout=1)
+                except Empty:
+                    pass
+        for stage in stages:
+            stage.join()
+        self.flush(batch)
+        if failed:
+            print('抓取或解析的執行緒異常結束，請查看上方的錯誤訊息')
+            sys.exit(1)
+
+    def add(self, batch: Batch, rows: Rows):
+        thread, posts, users = rows
+        users = [self.users.setdefault(u, u) for u in users]
+        batch.threads.append(thread)  # a revisit may bring a new title
+        post_id: int = thread.post_id
+        if post_id not in self.known:
+            batch.posts += posts
+            batch.users += users
+            return
+
+        # a revisited post, keep the new replies only
+        batch.refreshed.append((
+                post_id,
+                max(p[1] for p in posts),
+                len(posts) - 1,
+                datetime.fromisoformat(thread.created),
+                max(datetime.fromisoformat(p[2]) for p in posts)
+                ))
+        for post, user in zip(posts, users):
+            if post[1] > self.known[post_id]:
+                batch.posts.append(post)
+                batch.users.append(user)
+
+    def crawl(self, out_queue: Queue, parse: bool = True):
+        '''Fetch every post in self.new_posts into out_queue, then put None
+        to tell the consumer that there is nothing left, even if crawling
+        fails (see crawl_failed). Without parse, the raw pages are put as
+        (index, page).
+        '''
+        try:
+            if self.reparse:
+                self.crawl_cache(out_queue, parse)
+            elif self.engine == 'async':
+                self.crawl_async(out_queue, parse)
+            else:
+                threads: List[DataPorter] = [
+                        DataPorter(self.new_posts, out_queue, self.journal,
+                                   self.retries, self.backoff, parse,
+                                   self.throttle)
+                        for _ in range(self.maxthreads)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                if any(t.failed for t in threads):
+                    self.crawl_failed = True
+        except BaseException:
+            self.crawl_failed = True
+            raise
+        finally:
+            out_queue.put(None)
+
+    def crawl_cache(self, out_queue: Queue, parse: bool = True):
+        cache: Optional[PageCache] = finfo_view.CACHE
+        if cache is None:
+            return
+
+        for index, page in cache.items():
+            if not parse:
+                out_queue.put((index, page))
+                continue
+
+            try:
+                out_queue.put(parse_rows(index, page))
+            except Exception as e:  # unexpected markup, keep going
+                METRICS.count('posts_failed')
+                print(f'無法解析快取中的文章 {index}（{e!r}）')
+
+    def crawl_async(self, out_queue: Queue, parse: bool = True):
+        from async_crawler import AsyncCrawler
+
+        crawler = AsyncCrawler(self.new_posts, out_queue,
+                               concurrency=self.concurrency,
+                               conn_per_host=self.conn_per_host,
+                               journal=self.journal,
+                               retries=self.retries,
+                               backoff=self.backoff,
+                               parse=parse,
+                               throttle=self.throttle)
+        crawler.run()
+
+    def flush(self, batch: Batch):
+        if not len(batch) and not batch.refreshed and not batch.unchanged:
+            return
+
+        # before write(), which leaves out rows already stored
+        post_ids: Set[int] = {p[0] for p in batch.posts}
+        with METRICS.timer('db_flush_seconds'):
+            for attempt in range(DEADLOCK_RETRIES + 1):
+                try:
+                    with self.db.transaction():  # one commit per batch
+                        self.write(batch)
+                    break
+                except Exception as e:
+                    # rolled back whole, e.g. for a --worker writing the
+                    # same summary rows, and safe to write again
+                    if not deadlocked(e) or attempt == DEADLOCK_RETRIES:
+                        raise
+                    METRICS.count('db_deadlocks')
+                    time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        if finfo_view.VALIDATORS is not None:
+            # only now are the pages fetched safe to skip if unchanged
+            finfo_view.VALIDATORS.save(
+                    [t.post_id for t in batch.threads] + batch.unchanged
+                    + [m[0] for m in batch.missing])
+        METRICS.observe('db_batch_rows', len(batch.posts))
+        METRICS.count('rows_written', len(batch.posts))
+        if batch.posts:
+            done: int = sum(METRICS.counters[k] for k in
+                            ('posts_fetched', 'posts_deleted',
+                             'posts_unchanged'))
+            print(f'已寫入 {len(batch.posts)} 筆資料至資料庫'
+                  f'（已處理 {done} / {self.planned} 篇文章）')
+
+        if self.journal is not None and post_ids:
+            for post_id in post_ids:
+                self.journal.record(CrawlJournal.INSERTED, post_id)
+            self.journal.sync()
+
+    def write(self, batch: Batch):
+        post_ids: Set[int] = {p[0] for p in batch.posts}
+        self.drop_stored(batch)
+
+        if batch.missing:
+            self.db.insert('missing_posts', batch.missing)
+            if self.refresh is not None:
+                self.refresh.forget([m[0] for m in batch.missing])
+
+        if batch.threads:
+            self.db.insert('threads', batch.threads)
+
+        if batch.posts:
+            author_ids: List[int] = self.db.insert('users', batch.users)
+            posts: List[tuple] = [p[:3] + (author_id,) + p[4:]
+                                  for p, author_id
+                                  in zip(batch.posts, author_ids)]
+            self.db.insert('posts', posts)
+            self.aggregates.apply(posts, batch.users,
+                                  {t.post_id: t.topic_id
+                                   for t in batch.threads})
+            if self.search is not None:
+                self.search.add(posts, {t.post_id: t.title
+                                        for t in batch.threads})
+
+        if self.refresh is not None:
+            if batch.refreshed:
+                self.refresh.schedule(batch.refreshed)
+            self.refresh.touch(batch.unchanged)
+
+        revived: List[tuple] = [(i,) for i in post_ids
+                                if i in self.rechecking]
+        if revived:  # rechecked posts that turn out to exist again
+            self.db.cur.executemany('DELETE FROM missing_posts '
+                                    'WHERE post_id = ?', revived)
+
+    def drop_stored(self, batch: Batch):
+        '''Leave out rows of batch already in posts, e.g. a batch written
+        again after a crash before the journal recorded it. INSERT IGNORE
+        would skip them too, but their users and summaries would be added
+        again.
+        '''
+        if not batch.posts:
+            return
+        post_ids: List[int] = list({p[0] for p in batch.posts})
+        marks: str = ', '.join('?' * len(post_ids))
+        self.db.cur.execute('SELECT post_id, position FROM posts '
+                            f'WHERE post_id IN ({marks})', tuple(post_ids))
+        stored: Set[Tuple[int, int]] = {(r[0], r[1])
+                                        for r in self.db.cur.fetchall()}
+        if not stored:
+            return
+
+        kept: List[int] = [i for i, p in enumerate(batch.posts)
+                           if (p[0], p[1]) not in stored]
+        METRICS.count('rows_skipped', len(batch.posts) - len(kept))
+        batch.posts = [batch.posts[i] for i in kept]
+        batch.users = [batch.users[i] for i in kept]
+
+
+def to_rows(data: dict) -> Rows:
+    '''Turn an article into its row of threads, and rows of posts and
+    users. Users are one tuple each per thread, however many rows they
+    author, so they are pickled once.
+    '''
+    TOPICS: List[str] = ['投保規劃', '保單健檢', '理賠申請',
+                         '保單解約', '保險觀念']
+#        REGIONS: List[str] = ['北部', '中部', '南部', '東部']
+
+    post_id: int = data['id']
+    title: str = data['title']
+    topic_id: int = TOPICS.index(data['class']) + 1  # db count from 1
+    # finfo.tw start at 2021, it's safe to hard code year till 2022...
+    datetime: str = '2021-' + '-'.join(data['dateTime'].split('/'))
+    author_name: str = data['author']['userName']
+    author_type: str = data['author']['identity']
+    content: str = data['content']
+    replies: List[dict] = data['replies']
+
+    # author_id is left None here, users[i] is the author of posts[i]
+    # and Updater.write() fills in the ids the database gives them
+    posts: list = []
+    users: list = []
+    seen: Dict[tuple, tuple] = {}
+
+    user: tuple = (author_name, author_type == 'insurer')
+    users.append(seen.setdefault(user, user))
+    #                 ↓ 0 means oringinal post, not a reply
+    posts.append((post_id, 0, datetime, None, content))
+
+    for reply in replies:
+        user = (reply['author']['userName'],
+                reply['author']['identity'] == 'insurer')
+        users.append(seen.setdefault(user, user))
+        posts.append((reply['belongsTo'],
+                      reply['floor'],
+                      '2021-' + '-'.join(reply['dateTime'].split('/')),
+                      None,
+                      reply['content']))
+
+    return ThreadRow(post_id, title, topic_id, datetime), posts, users
+
+
+def parse_rows(index: int, page: str) -> Union[Rows, int]:
+    '''Parse a raw page straight into rows, or return index if the post
+    has been deleted. This runs in the worker processes of ParseStage, so
+    only small tuples are pickled back.
+    '''
+    article: Optional[dict] = parse_page(index, page)
+    return index if article is None else to_rows(article)
+
+
+def timed_parse_rows(index: int, page: str) -> Tuple[Union[Rows, int],
+                                                     float]:
+    '''parse_rows() and how long it took, as the metrics of the worker
+    processes are not seen by the main one.
+    '''
+    started: float = time.perf_counter()
+    rows: Union[Rows, int] = parse_rows(index, page)
+    return rows, time.perf_counter() - started
+
+
+class ParseStage(Thread):
+    '''Consumes raw pages (index, page) in in_queue, parses them on a pool
+    of processes so every core is used, then puts the rows (or the index
+    of a deleted post) into out_queue, in the order the pages came. Posts
+    found Unchanged are passed on as they are. None is put at the end,
+    even if the pool breaks (see failed).
+    '''
+    def __init__(self,
+                 in_queue: Queue,
+                 out_queue: Queue,
+                 workers: int,
+                 journal: Optional[CrawlJournal] = None):
+        super().__init__(daemon=True)
+        self.in_queue: Queue = in_queue
+        self.out_queue: Queue = out_queue
+        self.workers: int = workers
+        self.journal: Optional[CrawlJournal] = journal
+        self.failed: bool = False  # e.g. a worker process killed
+
+    def run(self):
+        try:
+            self.parse()
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            self.out_queue.put(None)
+
+    def parse(self):
+        # not forked: the fetch threads are running by now, and a child
+        # forked off would inherit the locks they hold (METRICS, stdout)
+        # locked for good. Started afresh, workers do not inherit the
+        # extractor in use either, hence the initializer
+        methods: List[str] = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn')
+        with ProcessPoolExecutor(self.workers,
+                                 mp_context=context,
+                                 initializer=use_extractor,
+                                 initargs=(finfo_view.EXTRACTOR,)) as pool:
+            pending: Deque[Tuple[int, Future]] = deque()
+            while True:
+                item: Union[Tuple[int, str], Unchanged, None] = \
+                    self.in_queue.get()
+                if item is None:
+                    break
+                METRICS.observe('queue_pages', self.in_queue.qsize())
+                if isinstance(item, Unchanged):
+                    # revalidated, nothing to parse; queued in turn so
+                    # the order of the pages is kept
+                    unchanged: Future = Future()
+                    unchanged.set_result((item, 0))
+                    pending.append((item.post_id, unchanged))
+                    continue
+                pending.append((item[0], pool.submit(timed_parse_rows,
+                                                     *item)))
+
+                # a few pages per worker in flight keep them all busy
+                while len(pending) > 2 * self.workers \
+                        or (pending and pending[0][1].done()):
+                    self.deliver(*pending.popleft())
+
+            while pending:
+                self.deliver(*pending.popleft())
+
+    def deliver(self, index: int, future: Future):
+        try:
+            rows: Union[Rows, int, Unchanged]
+            rows, took = future.result()
+        except Exception as e:  # unexpected markup, keep going
+            METRICS.count('posts_failed')
+            print(f'ParseStage: 無法解析文章 {index}（{e!r}）')
+            if self.journal is not None:
+                self.journal.record(CrawlJournal.FAILED, index, repr(e))
+            return
+
+        if isinstance(rows, Unchanged):
+            self.out_queue.put(rows)
+            return
+        METRICS.observe('parse_seconds', took)
+        if isinstance(rows, int) and self.journal is not None:
+            self.journal.record(CrawlJournal.DELETED, index)
+        self.out_queue.put(rows)
+
 
 class DataPorter(Thread):
     '''Consumes post index in in_queue, get data from remote, then put
     gathered data into out_queue.
     '''
-    def __init__(self, indices: List[int], out_queue: Queue):
+    def __init__(self,
+                 indices: List[int],
+                 out_queue: Queue,
+                 journal: Optional[CrawlJournal] = None,
+                 retries: int = 3,
+                 backoff: float = 1,
+                 parse: bool = True,
+                 throttle: Optional[Throttle] = None):
         super().__init__()
         self.job_not_done: List[int] = indices
         self.out_queue: Queue = out_queue
+        self.journal: Optional[CrawlJournal] = journal
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.parse: bool = parse  # False to put raw pages in out_queue
+        # shared by all DataPorters, None for no limit but the threads
+        self.throttle: Optional[Throttle] = throttle
+        # one session per thread, so the connection is kept alive between
+        # posts instead of a new TCP/TLS handshake for each of them
+        self.session: requests.Session = requests.Session()
+        self.failed: bool = False  # ended on an unexpected error
 
     def run(self):
-        while any(self.job_not_done):
-            index: int = self.job_not_done.pop()
-            print(f'DataPorter: 抓取文章 {index} ...')
-            args: list = ['python3', 'finfo_view.py',
-                          '--nosave', '--json', '--index', str(index)]
-            proc = Popen(args, stdout=PIPE)
-            out, err = proc.communicate()
+        try:
+            self.port()
+        except BaseException:
+            self.failed = True
+            raise
+
+    def port(self):
+        while True:
+            try:
+                index: int = self.job_not_done.pop()
+            except IndexError:  # taken by other threads
+                break
+            try:
+                page: str = self.fetch(index, get_page)
+            except NotModified:
+                self.out_queue.put(Unchanged(index))
+                continue
+            except requests.RequestException as e:
+                METRICS.count('posts_failed')
+                print(f'DataPorter: 無法擷取文章 {index}（{e}）')
+                self.record(CrawlJournal.FAILED, index, str(e))
+                continue
 
-            out = out.decode('utf8')
+            if not self.parse:
+                self.record(CrawlJournal.FETCHED, index)
+                self.out_queue.put((index, page))
+                continue
 
-            if '文章不存在或已被刪除' in out:
+            rows: Union[Rows, int]
+            try:
+                rows = parse_rows(index, page)
+            except Exception as e:  # unexpected markup, keep going
+                METRICS.count('posts_failed')
+                print(f'DataPorter: 無法解析文章 {index}（{e!r}）')
+                self.record(CrawlJournal.FAILED, index, repr(e))
+                continue
+
+            if isinstance(rows, int):
                 print(f'DataPorter: 文章 {index} 不存在或已被刪除')
+                self.record(CrawlJournal.DELETED, index)
             else:
-                self.out_queue.put(out)
-                print(f'DataPorter: 文章 {index} 已擷取至本地端')
+                self.record(CrawlJournal.FETCHED, index)
+            self.out_queue.put(rows)
+
+    def fetch(self, index: int, get: Callable) -> Any:
+        '''get(index, session), retried with exponential backoff.'''
+        for attempt in range(self.retries + 1):
+            if self.throttle is not None:
+                self.throttle.acquire()
+            started: float = time.monotonic()
+            overloaded: bool = False
+            retry_after: float = 0
+            try:
+                return get(index, self.session)
+            except requests.RequestException as e:
+                overloaded = is_overload(e)
+                if e.response is not None:
+                    retry_after = parse_retry_after(
+                            e.response.headers.get('Retry-After'))
+                if attempt == self.retries:
+                    raise
+            finally:
+                if self.throttle is not None:
+                    self.throttle.release(time.monotonic() - started,
+                                          overloaded, retry_after)
+            time.sleep(self.backoff * 2 ** attempt)
+
+        return None  # not reached
+
+    def record(self, state: str, index: int, detail: str = ''):
+        if self.journal is not None:
+            self.journal.record(state, index, detail)
+
+
+def is_overload(e: requests.RequestException) -> bool:
+    '''Whether the error means finfo.tw is struggling with our requests.'''
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 \
+            or e.response.status_code >= 500
+    return isinstance(e, (requests.Timeout, requests.ConnectionError))
+
+
+def cfg_int(cfg: ConfigSection, key: str, default: int) -> int:
+    '''Like cfg.getint(), but keys left empty also fall back to default.'''
+    value: Optional[str] = cfg.get(key)
+    return int(value) if value else default
 
 
 def main():
     argpsr = argparse.ArgumentParser(description='更新資料庫')
     argpsr.add_argument('-f', '--file',
                         help='使用指定的設定文件',
-                        nargs=1, metavar='文件路徑')
+                        metavar='文件路徑')
     argpsr.add_argument('-t', '--threads',
                         help='同時間最大執行緒數目（預設：10）',
-                        nargs=1, metavar='N',
+                        metavar='N',
                         type=int, default=10)
+    argpsr.add_argument('-e', '--engine',
+                        help='抓取方式：threads 或 async（預設：threads）',
+                        choices=['threads', 'async'])
+    argpsr.add_argument('-c', '--concurrency',
+                        help='非同步模式下同時進行的請求數目（預設：100）',
+                        metavar='N', type=int)
+    argpsr.add_argument('-b', '--batch-size',
+                        help='累積多少筆資料就寫入資料庫（預設：500）',
+                        metavar='N', type=int)
+    argpsr.add_argument('--flush-interval',
+                        help='最長每隔幾秒寫入資料庫一次（預設：30）',
+                        metavar='SECONDS', type=float)
+    argpsr.add_argument('-r', '--resume',
+                        help='只抓取上次中斷時尚未完成的文章',
+                        action='store_true')
+    argpsr.add_argument('--recheck-tombstones-older-than',
+                        help='重新抓取 N 天前確認已刪除的文章',
+                        metavar='DAYS', type=float, dest='recheck_days')
+    argpsr.add_argument('-p', '--parse-workers',
+                        help='以 N 個行程解析網頁（預設：0，即由抓取者解析）',
+                        metavar='N', type=int)
+    argpsr.add_argument('--extractor',
+                        help='解析網頁的方式：lxml 或 bs4'
+                             '（預設：已安裝 lxml 時為 lxml）',
+                        choices=sorted(EXTRACTORS))
+    argpsr.add_argument('--reparse-from-cache',
+                        help='不連網，由快取的網頁重建 posts 與 users',
+                        action='store_true', dest='reparse')
+    argpsr.add_argument('--rate-limit',
+                        help='每秒最多發出幾個請求（預設：不限）',
+                        metavar='N', type=float)
+    argpsr.add_argument('--metrics',
+                        help='將各階段的統計寫入 JSON 檔',
+                        metavar='文件路徑')
+    argpsr.add_argument('--prometheus',
+                        help='將各階段的統計寫入 Prometheus 文字檔',
+                        metavar='文件路徑')
+    argpsr.add_argument('--profile',
+                        help='取樣所有執行緒的呼叫堆疊，寫入 collapsed '
+                             'stacks 檔（可供 flamegraph.pl 使用）',
+                        metavar='文件路徑')
+    argpsr.add_argument('-R', '--refresh',
+                        help='不抓新文章，改為重新檢查舊文章是否有新回應',
+                        action='store_true')
+    argpsr.add_argument('--refresh-budget',
+                        help='每次最多重新檢查幾篇文章（預設：1000）',
+                        metavar='N', type=int)
+    argpsr.add_argument('-w', '--worker',
+                        help='與其他 worker（可在不同主機上）分工，'
+                             '由資料庫中的工作佇列領取範圍抓取',
+                        action='store_true')
 
     module_dir: Path = Path(sys.modules['db'].__file__).parent.resolve()
 
@@ -199,10 +921,136 @@ def main():
     else:
         maxthreads = 10
 
+    engine: str = args.engine or cfg.get('engine') or 'threads'
+    concurrency: int = args.concurrency or cfg_int(cfg, 'concurrency', 100)
+    conn_per_host: int = cfg_int(cfg, 'connperhost', 0)
+    batch_size: int = args.batch_size or cfg_int(cfg, 'batchsize', 500)
+    flush_interval: float = (args.flush_interval
+                             or cfg_int(cfg, 'flushinterval', 30))
+    queue_size: int = cfg_int(cfg, 'queuesize', 1000)
+    retries: int = cfg_int(cfg, 'retries', 3)
+    backoff: float = float(cfg.get('backoff') or 1)
+    min_inflight: int = cfg_int(cfg, 'mininflight', 2)
+    rate_limit: float = args.rate_limit or float(cfg.get('ratelimit') or 0)
+    adaptive: bool = cfg.getboolean('adaptive', fallback=True)
+    search: bool = cfg.getboolean('search', fallback=True)
+
+    site: ConfigSection = config['finfo.tw']
+    if site.get('url'):  # e.g. benchmarks/fixture_server.py
+        finfo_view.URL_BASE = site['url'].rstrip('/') + '/posts'
+    if site.get('timeout'):
+        finfo_view.TIMEOUT = site.getfloat('timeout')
+
+    extractor: Optional[str] = args.extractor or cfg.get('extractor')
+    if extractor:
+        try:
+            use_extractor(extractor)
+        except ValueError:
+            print(f'無法使用 {extractor} 解析網頁，請確認是否已安裝')
+            sys.exit(1)
+
+    parse_workers: int = (args.parse_workers
+                          if args.parse_workers is not None
+                          else cfg_int(cfg, 'parseworkers', 0))
+
+    if args.worker and (args.resume or args.refresh or args.reparse):
+        print('--worker 不能與 --resume、--refresh、'
+              '--reparse-from-cache 同時使用')
+        sys.exit(1)
+
+    use_stores: bool = not args.worker
+    if args.worker and (cfg.get('cache') or cfg.get('validators')):
+        # neither store is safe for several processes writing at once
+        print('--worker 模式下不使用 cache 與 validators')
+
+    if cfg.get('cache') and use_stores:
+        use_cache(PageCache(str(module_dir / cfg['cache'])),
+                  offline=args.reparse)
+    elif args.reparse:
+        print('未設定 cache，無法由快取重建資料庫')
+        sys.exit(1)
+
+    refresh_budget: Optional[int] = None
+    if args.refresh:
+        refresh_budget = (args.refresh_budget
+                          or cfg_int(cfg, 'refreshbudget', 1000))
+
+    if cfg.get('validators') and use_stores and not args.reparse:
+        use_validators(Validators(str(module_dir / cfg['validators'])))
+
+    work_queue: Optional[WorkQueue] = None
+    if args.worker:
+        worker: ConfigSection = (config['WORKER']
+                                 if config.has_section('WORKER')
+                                 else config[config.default_section])
+        # a connection of its own, shared with the heartbeat of the lease
+        work_queue = WorkQueue(Database(str(cfg_path)),
+                               chunk_size=cfg_int(worker, 'chunksize', 1000),
+                               lease_seconds=cfg_int(worker, 'lease', 120),
+                               max_attempts=cfg_int(worker, 'maxattempts', 3),
+                               retry_delay=cfg_int(worker, 'retrydelay', 60))
+
+    discoverer: Discoverer = Discoverer(
+            str(module_dir / cfg['listing']) if cfg.get('listing') else None,
+            max_pages=cfg_int(cfg, 'listingpages', 5)
+            )
+
+    journal: Optional[CrawlJournal] = None
+    if cfg.get('journal'):
+        journal = CrawlJournal(str(module_dir / cfg['journal']))
+    elif args.resume:
+        print('未設定 journal，無法從上次中斷處繼續')
+        sys.exit(1)
+
+    metrics_path: Optional[str] = args.metrics or cfg.get('metrics')
+    prometheus_path: Optional[str] = (args.prometheus
+                                      or cfg.get('prometheus'))
+    if metrics_path:
+        metrics_path = str(Path(metrics_path).resolve())
+    if prometheus_path:
+        prometheus_path = str(Path(prometheus_path).resolve())
+    profile_path: Optional[str] = (str(Path(args.profile).resolve())
+                                   if args.profile else None)
+
     os.chdir(module_dir)
 
-    updater: Updater = Updater(database=database, maxthreads=maxthreads)
-    updater.start()
+    updater: Updater = Updater(database=database,
+                               maxthreads=maxthreads,
+                               engine=engine,
+                               concurrency=concurrency,
+                               conn_per_host=conn_per_host,
+                               batch_size=batch_size,
+                               flush_interval=flush_interval,
+                               queue_size=queue_size,
+                               journal=journal,
+                               resume=args.resume,
+                               retries=retries,
+                               backoff=backoff,
+                               recheck_days=args.recheck_days,
+                               refresh_budget=refresh_budget,
+                               parse_workers=parse_workers,
+                               reparse=args.reparse,
+                               min_inflight=min_inflight,
+                               rate_limit=rate_limit,
+                               adaptive=adaptive,
+                               work_queue=work_queue,
+                               discoverer=discoverer,
+                               search=search)
+
+    profiler: Optional[SamplingProfiler] = None
+    if profile_path:
+        profiler = SamplingProfiler()
+        profiler.start()
+    try:
+        updater.start()
+    finally:
+        METRICS.write(metrics_path, prometheus_path)
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(profile_path)
+            print('最常出現在堆疊頂端的函式：')
+            for name, share in profiler.top():
+                print(f'{share:6.1%}  {name}')
 
 
 if __name__ == "__main__":
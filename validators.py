@@ -0,0 +1,105 @@
+from threading import Lock
+from typing import Dict, Iterable, Mapping, Optional, Set
+
+import dbm
+import hashlib
+
+
+class Validators:
+    '''ETag, Last-Modified and body hash of the last fetch of every post.
+
+    They make revisiting a post a conditional request: the server answers
+    304 if the post has not changed, and if it ignores the validators, an
+    identical body hash tells the same. Either way the page does not need
+    to be parsed again.
+
+    Validators are only trusted for the posts in conditional, which the
+    caller knows are stored already, and those of a fetch are only kept
+    once save() is told its rows are committed: a post fetched but never
+    stored (say, the run crashed or the batch was rolled back in between)
+    must not be skipped when it is fetched again, first visit or revisit.
+    '''
+    SEP: str = '\x1f'
+
+    def __init__(self, path: str):
+        self._db = dbm.open(path, 'c')
+        self._lock: Lock = Lock()
+        self.conditional: Set[int] = set()
+        self._fetched: Dict[int, bytes] = {}  # not yet committed, by post
+        self.not_modified: int = 0  # 304
+        self.same_body: int = 0  # 200, but the same hash as last time
+        self.changed: int = 0  # 200, modified
+
+    def revalidate(self, post_ids: Iterable[int]):
+        '''Fetch post_ids conditionally from now on.'''
+        self.conditional.update(post_ids)
+
+    def _get(self, post_id: int) -> Optional[list]:
+        with self._lock:
+            value: Optional[bytes] = self._db.get(str(post_id))
+        return value.decode('utf8').split(self.SEP) if value else None
+
+    def headers(self, post_id: int) -> Dict[str, str]:
+        '''Headers making the request for post_id conditional.'''
+        stored: Optional[list] = (self._get(post_id)
+                                  if post_id in self.conditional else None)
+        if stored is None:
+            return {}
+
+        etag, last_modified, _ = stored
+        headers: Dict[str, str] = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def modified(self,
+                 post_id: int,
+                 status: int,
+                 headers: Mapping[str, str],
+                 page: str) -> bool:
+        '''Whether the response is worth parsing, and remember its
+        validators for next time.
+        '''
+        if status == 304:
+            self.not_modified += 1
+            return False
+        if status != 200:
+            return True
+
+        sha1: str = hashlib.sha1(page.encode('utf8')).hexdigest()
+        stored: Optional[list] = (self._get(post_id)
+                                  if post_id in self.conditional else None)
+        value: str = self.SEP.join([headers.get('ETag', ''),
+                                    headers.get('Last-Modified', ''),
+                                    sha1])
+        with self._lock:
+            self._fetched[post_id] = value.encode('utf8')
+
+        if stored is None:  # not a revisit
+            return True
+        if stored[2] == sha1:
+            self.same_body += 1
+            return False
+        self.changed += 1
+        return True
+
+    def save(self, post_ids: Iterable[int]):
+        '''Keep the validators of the last fetch of post_ids, whose rows
+        have been committed.
+        '''
+        with self._lock:
+            for post_id in post_ids:
+                value: Optional[bytes] = self._fetched.pop(post_id, None)
+                if value is not None:
+                    self._db[str(post_id)] = value
+
+    def report(self) -> str:
+        hits: int = self.not_modified + self.same_body
+        return (f'條件式請求：命中 {hits} 次（304：{self.not_modified}，'
+                f'內容相同：{self.same_body}），未命中 {self.changed} 次')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,244 @@
+#! /usr/bin/env python3
+'''Ranges of post indices shared out to update.py --worker processes.
+
+Every range of crawl_chunks is pending, leased to a worker, done or
+failed. A worker claims the first pending range (or one whose lease has
+expired), renews its lease by a heartbeat while it crawls, and marks it
+done once its posts are in the database. A worker that dies stops the
+heartbeat, so its range is claimed again by another one after the lease
+runs out. The random token of the lease goes with every renewal and
+completion, so a worker whose range has been taken over cannot touch it
+any more.
+
+A range is claimed at most max_attempts times: one whose workers keep
+dying is left failed. A range given back with failed posts waits
+retry_delay seconds, doubled on every attempt, before it is claimed again.
+
+Workers may run on any host reaching the database; whichever starts first
+adds the ranges up to the latest post of finfo.tw.
+
+$ python work_queue.py [-f 設定文件] (--status | --requeue-failed)
+'''
+from db import Database
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import List, NamedTuple, Optional
+
+import argparse
+import os
+import socket
+import uuid
+
+
+class Chunk(NamedTuple):
+    id: int
+    first: int  # post indices first to last, inclusive
+    last: int
+    lease: str
+    attempts: int  # claims so far, this one included
+
+
+class WorkQueue:
+    def __init__(self,
+                 database: Database,
+                 chunk_size: int = 1000,
+                 lease_seconds: float = 120,
+                 max_attempts: int = 3,
+                 retry_delay: float = 60):
+        self.db: Database = database  # a connection of its own
+        self.chunk_size: int = chunk_size
+        self.lease_seconds: float = lease_seconds
+        # a range with posts failing is claimed again, up to max_attempts
+        self.max_attempts: int = max_attempts
+        self.retry_delay: float = retry_delay  # seconds, see complete()
+        self.worker: str = f'{socket.gethostname()}:{os.getpid()}'
+        self.chunk: Optional[Chunk] = None
+        self.lost: bool = False  # the lease of chunk expired under us
+        self._lock: Lock = Lock()  # the heartbeat shares the connection
+        self._stop: Event = Event()
+        self._heartbeat: Optional[Thread] = None
+
+    def enqueue(self, latest: int, start: int = 0) -> int:
+        '''Add ranges up to post index latest, after the last one added
+        (or after start, for a queue still empty). Return how many.
+        '''
+        with self._lock:
+            # one worker at a time, or two could add the same ranges
+            self.db.cur.execute("SELECT GET_LOCK('crawl_chunks', 30)")
+            if self.db.cur.fetchone()[0] != 1:  # 0 timed out, NULL error
+                raise TimeoutError('無法取得 crawl_chunks 的鎖')
+            try:
+                self.db.cur.execute('SELECT COALESCE(MAX(last_index), ?) '
+                                    'FROM crawl_chunks', (start,))
+                first: int = self.db.cur.fetchone()[0] + 1
+                rows: List[tuple] = [
+                        (i, min(i + self.chunk_size - 1, latest))
+                        for i in range(first, latest + 1, self.chunk_size)
+                        ]
+                if rows:
+                    self.db.cur.executemany('INSERT INTO crawl_chunks '
+                                            '(first_index, last_index) '
+                                            'VALUES (?, ?)', rows)
+            finally:
+                self.db.cur.execute("SELECT RELEASE_LOCK('crawl_chunks')")
+        return len(rows)
+
+    def claim(self) -> Optional[Chunk]:
+        '''Lease the first range to do, None if there is none left.'''
+        lease: str = uuid.uuid4().hex
+        with self._lock:
+            # ranges whose workers died every time they were claimed
+            self.db.cur.execute(
+                    "UPDATE crawl_chunks SET state = 'failed', lease = NULL, "
+                    'lease_expires = NULL, done_at = NOW() '
+                    "WHERE state = 'leased' AND lease_expires < NOW() "
+                    'AND attempts >= ?', (self.max_attempts,)
+                    )
+            if self.db.cur.rowcount:
+                print(f'WorkQueue: {self.db.cur.rowcount} 個範圍已領取 '
+                      f'{self.max_attempts} 次仍未完成，不再發放')
+            # a single statement, so no two workers get the same range
+            self.db.cur.execute(
+                    "UPDATE crawl_chunks SET state = 'leased', lease = ?, "
+                    'worker = ?, attempts = attempts + 1, heartbeats = 0, '
+                    'lease_expires = NOW() + INTERVAL ? SECOND '
+                    "WHERE (state = 'pending' AND (not_before IS NULL "
+                    'OR not_before <= NOW())) '
+                    "OR (state = 'leased' AND lease_expires < NOW() "
+                    'AND attempts < ?) '
+                    'ORDER BY first_index LIMIT 1',
+                    (lease, self.worker, self.lease_seconds,
+                     self.max_attempts)
+                    )
+            if not self.db.cur.rowcount:
+                return None
+            self.db.cur.execute('SELECT id, first_index, last_index, lease, '
+                                'attempts FROM crawl_chunks WHERE lease = ?',
+                                (lease,))
+            self.chunk = Chunk(*self.db.cur.fetchone())
+
+        self.lost = False
+        self._stop.clear()
+        self._heartbeat = Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self.chunk
+
+    def _beat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            if not self.renew():
+                print(f'WorkQueue: 範圍 {self.chunk.first}-{self.chunk.last} '
+                      '的租約已過期，已由其他 worker 接手')
+                self.lost = True
+                return
+
+    def renew(self) -> bool:
+        '''Extend the lease of the current range, False if it is lost.'''
+        with self._lock:
+            self.db.cur.execute(
+                    'UPDATE crawl_chunks SET heartbeats = heartbeats + 1, '
+                    'lease_expires = NOW() + INTERVAL ? SECOND '
+                    "WHERE id = ? AND lease = ? AND state = 'leased'",
+                    (self.lease_seconds, self.chunk.id, self.chunk.lease)
+                    )
+            return self.db.cur.rowcount > 0
+
+    def complete(self, failed: int = 0) -> bool:
+        '''Mark the current range done, or give it back to be claimed
+        again, after a backoff, while posts of it fail and attempts are
+        left. False if the lease was lost meanwhile (another worker redoes
+        the range).
+        '''
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        retry: bool = bool(failed) and self.chunk.attempts < self.max_attempts
+        delay: float = self.retry_delay * 2 ** (self.chunk.attempts - 1)
+        with self._lock:
+            self.db.cur.execute(
+                    'UPDATE crawl_chunks SET state = ?, failed = ?, '
+                    'lease = NULL, lease_expires = NULL, '
+                    f'done_at = {"NULL" if retry else "NOW()"}, '
+                    'not_before = NOW() + INTERVAL ? SECOND '
+                    "WHERE id = ? AND lease = ? AND state = 'leased'",
+                    ('pending' if retry else 'done', failed,
+                     delay if retry else 0,
+                     self.chunk.id, self.chunk.lease)
+                    )
+            completed: bool = self.db.cur.rowcount > 0
+        self.chunk = None
+        return completed
+
+    def release(self):
+        '''Give the current range back at once, e.g. on Ctrl-C.'''
+        if self.chunk is None:
+            return
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        with self._lock:
+            self.db.cur.execute(
+                    "UPDATE crawl_chunks SET state = 'pending', lease = NULL, "
+                    'lease_expires = NULL, attempts = attempts - 1 '
+                    "WHERE id = ? AND lease = ? AND state = 'leased'",
+                    (self.chunk.id, self.chunk.lease)
+                    )
+        self.chunk = None
+
+    def status(self) -> str:
+        self.db.cur.execute(
+                "SELECT IF(state = 'leased' AND lease_expires < NOW(), "
+                "'expired', state), COUNT(*), "
+                'SUM(last_index - first_index + 1), SUM(failed) '
+                'FROM crawl_chunks GROUP BY 1 ORDER BY 1')
+        lines: List[str] = [f'{"state":<8} {"ranges":>7} {"posts":>9} '
+                            f'{"failed":>7}']
+        for state, ranges, posts, failed in self.db.cur.fetchall():
+            lines.append(f'{state:<8} {ranges:>7} {posts:>9} {failed:>7}')
+        self.db.cur.execute("SELECT worker, first_index, last_index, "
+                            "TIMESTAMPDIFF(SECOND, NOW(), lease_expires) "
+                            "FROM crawl_chunks WHERE state = 'leased' "
+                            "ORDER BY worker")
+        for worker, first, last, left in self.db.cur.fetchall():
+            lines.append(f'  {worker}: {first}-{last}'
+                         + (f'（租約剩 {left} 秒）' if left >= 0
+                            else '（租約已過期）'))
+        return '\n'.join(lines)
+
+    def requeue_failed(self) -> int:
+        '''Hand ranges failed, or done with failed posts, out again, from
+        scratch.
+        '''
+        self.db.cur.execute("UPDATE crawl_chunks SET state = 'pending', "
+                            'attempts = 0, failed = 0, done_at = NULL, '
+                            'not_before = NULL '
+                            "WHERE state = 'failed' "
+                            "OR (state = 'done' AND failed > 0)")
+        return self.db.cur.rowcount
+
+
+def main():
+    argpsr = argparse.ArgumentParser(description='檢視或調整 worker 的工作佇列')
+    argpsr.add_argument('-f', '--file',
+                        help='使用指定的設定文件',
+                        metavar='文件路徑')
+    action = argpsr.add_mutually_exclusive_group(required=True)
+    action.add_argument('--status',
+                        help='列出各狀態的範圍數與租用中的 worker',
+                        action='store_true')
+    action.add_argument('--requeue-failed',
+                        help='重新發放失敗或有文章抓取失敗的範圍',
+                        action='store_true')
+    args = argpsr.parse_args()
+
+    cfg_path: Path = (Path(args.file).resolve() if args.file
+                      else Path(__file__).parent.resolve() / 'config.cfg')
+    queue: WorkQueue = WorkQueue(Database(str(cfg_path)))
+
+    if args.requeue_failed:
+        print(f'已重新發放 {queue.requeue_failed()} 個範圍')
+    else:
+        print(queue.status())
+
+
+if __name__ == '__main__':
+    main()